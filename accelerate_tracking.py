@@ -23,6 +23,7 @@ from models.spatracker.utils.visualizer import Visualizer, read_video_from_path
 #-------- import Depth Estimator -------------
 from PIL import Image
 from image_gen_aux import DepthPreprocessor
+from models.depth import estimate_video_depth
 
 # set the arguments
 parser = argparse.ArgumentParser()
@@ -53,6 +54,8 @@ parser.add_argument('--query_frame', type=int, default=0, help='query frame')
 parser.add_argument('--point_size', type=int, default=10, help='point size')
 # take the RGBD as input
 parser.add_argument('--rgbd', action='store_true', help='whether to take the RGBD as input')
+# depth estimation micro-batch size
+parser.add_argument('--depth_batch_size', type=int, default=8, help='number of frames per depth model call')
 
 args = parser.parse_args()
 
@@ -133,13 +136,8 @@ def process_video(args, model, MonoDEst_M, vid_name, root_dir, outdir):
     video = video.to(device)
 
     if not args.rgbd:
-        video_depths = []
-        for i in range(video.shape[1]):
-            frame = (video[0, i].permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
-            depth = depth_preprocessor(Image.fromarray(frame))[0]
-            depth_tensor = transforms.ToTensor()(depth)  # [1, H, W]
-            video_depths.append(depth_tensor)
-        depths = torch.stack(video_depths, dim=0).cuda()  # [T, 1, H, W]
+        # video is in range [0,255] here, the depth stage expects [0,1]
+        depths = estimate_video_depth(depth_preprocessor, video[0] / 255.0, batch_size=args.depth_batch_size)  # [T, 1, H, W]
         print("Depth maps shape:", depths.shape)
     else:
         depths = None
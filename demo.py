@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import argparse
 from PIL import Image
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -14,90 +15,78 @@ import torch
 import numpy as np
 from PIL import Image
 import torchvision.transforms as transforms
-from moviepy.editor import VideoFileClip
-from diffusers.utils import load_image, load_video
+from diffusers.utils import load_image
 
 from models.pipelines import DiffusionAsShaderPipeline, FirstFrameRepainter, CameraMotionGenerator, ObjectMotionGenerator
+from models.artifact_cache import ArtifactCache, file_digest
+from models.video_io import VideoFrameReader
+from models.long_video import WINDOW_FRAMES, plan_windows
+from models.batching import total_bytes
+from models.cost_model import GIB, AdmissionController, CalibrationStore, CostModel, JobSpec, read_transformer_config
+from models.tracker_pool import MOGE_REPO, ZOEDEPTH_REPO, COTRACKER_HUB_DIR
 from submodules.MoGe.moge.model.v1 import MoGeModel
 from submodules.vggt.vggt.utils.pose_enc import pose_encoding_to_extri_intri
 from submodules.vggt.vggt.models.vggt import VGGT
 
-def load_media(media_path, max_frames=49, transform=None):
+VGGT_REPO = "facebook/VGGT-1B"
+
+def load_media(media_path, max_frames=49, transform=None, long_video_fps=8, size=(480, 720)):
     """Load video or image frames and convert to tensor
     
+    A video is opened once: frame count and rate come from the container metadata, only the sampled frames
+    are decoded (seeking to a keyframe when that skips decoding) and the decoder scales them to `size`.
+    
     Args:
         media_path (str): Path to video or image file
-        max_frames (int): Maximum number of frames to load
-        transform (callable): Transform to apply to frames
+        max_frames (int): Maximum number of frames to load, None to sample the whole video at `long_video_fps`
+        transform (callable): Applied once to all uint8 frames [T,C,H,W], defaults to scaling to [0,1]
+        long_video_fps (float): Sampling rate of the whole video when `max_frames` is None
+        size (Tuple[int, int]): (height, width) of the loaded frames
         
     Returns:
         Tuple[torch.Tensor, float, bool]: Video tensor [T,C,H,W], FPS, and is_video flag
     """
-    if transform is None:
-        transform = transforms.Compose([
-            transforms.Resize((480, 720)),
-            transforms.ToTensor()
-        ])
-    
     # Determine if input is video or image based on extension
     ext = os.path.splitext(media_path)[1].lower()
     is_video = ext in ['.mp4', '.avi', '.mov']
     
     if is_video:
-        # Load video file info
-        video_clip = VideoFileClip(media_path)
-        duration = video_clip.duration
-        original_fps = video_clip.fps
+        reader = VideoFrameReader(media_path, size=size)
+        num_frames, duration = reader.num_frames, reader.duration
         
-        # Case 1: Video longer than 6 seconds, sample first 6 seconds + 1 frame
-        if duration > 6.0:
-            frames = load_video(media_path)
+        # Long video mode: keep the whole duration, at least one window
+        if max_frames is None:
+            step = max(reader.fps / long_video_fps, 1.0)
+            indices = np.arange(0, num_frames, step).astype(int)
+            if len(indices) < 49:
+                indices = np.linspace(0, num_frames - 1, 49).astype(int)
+            fps = long_video_fps
+        # Case 1: Video longer than 6 seconds, keep the first max_frames frames
+        elif duration > 6.0:
+            indices = np.arange(min(num_frames, max_frames))
             fps = (max_frames-1) / 6.0
-        # Cases 2 and 3: Video shorter than 6 seconds
+        # Case 2: Total frames less than max_frames, evenly repeat frames and keep the original fps
+        elif num_frames < max_frames:
+            indices = np.linspace(0, num_frames - 1, max_frames).astype(int)
+            fps = num_frames / duration
+        # Case 3: Total frames more than max_frames but video less than 6 seconds, evenly sample
         else:
-            # Load all frames
-            frames = load_video(media_path)
-            
-            # Case 2: Total frames less than max_frames, need interpolation
-            if len(frames) < max_frames:
-                fps = len(frames) / duration  # Keep original fps
-                
-                # Evenly interpolate to max_frames
-                indices = np.linspace(0, len(frames) - 1, max_frames)
-                new_frames = []
-                for i in indices:
-                    idx = int(i)
-                    new_frames.append(frames[idx])
-                frames = new_frames
-            # Case 3: Total frames more than max_frames but video less than 6 seconds
-            else:
-                # Evenly sample to max_frames
-                indices = np.linspace(0, len(frames) - 1, max_frames)
-                new_frames = []
-                for i in indices:
-                    idx = int(i)
-                    new_frames.append(frames[idx])
-                frames = new_frames
-                fps = max_frames / duration  # New fps to maintain duration
+            indices = np.linspace(0, num_frames - 1, max_frames).astype(int)
+            fps = max_frames / duration  # New fps to maintain duration
+        video_tensor = reader.read(indices)  # uint8 [T, C, H, W]
     else:
-        # Handle image as single frame
-        image = load_image(media_path)
-        frames = [image]
+        # Handle image as single frame, duplicated to max_frames
+        image = load_image(media_path).resize((size[1], size[0]), Image.BILINEAR)
+        frame = torch.from_numpy(np.array(image)).permute(2, 0, 1)
+        video_tensor = frame.unsqueeze(0).expand(max_frames or 49, -1, -1, -1)
         fps = 8  # Default fps for images
-        
-        # Duplicate frame to max_frames
-        while len(frames) < max_frames:
-            frames.append(frames[0].copy())
-
-    if len(frames) > max_frames:
-        frames = frames[:max_frames]
     
-    # Convert frames to tensor
-    video_tensor = torch.stack([transform(frame) for frame in frames])
-    
-    return video_tensor, fps, is_video
+    if transform is None:
+        return video_tensor.float() / 255.0, fps, is_video
+    return transform(video_tensor), fps, is_video
 
-if __name__ == "__main__":
+def build_parser():
+    """Command line options of a DaS job, shared with the inference worker"""
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_path', type=str, default=None, help='Path to input video/image')
     parser.add_argument('--prompt', type=str, required=True, help='Repaint prompt')
@@ -117,23 +106,153 @@ if __name__ == "__main__":
     parser.add_argument('--object_mask', type=str, default=None, help='Path to object mask image (binary image)')
     parser.add_argument('--tracking_method', type=str, default='spatracker', choices=['spatracker', 'moge', 'cotracker'], 
                     help='Tracking method to use (spatracker, cotracker or moge)')
-    args = parser.parse_args()
+    parser.add_argument('--model_cache_gb', type=float, default=None,
+                    help='Memory budget in GB for resident models, least recently used models are evicted when exceeded')
+    parser.add_argument('--prompt_cache_dir', type=str, default=None,
+                    help='Directory to persist T5 prompt embeddings across runs')
+    parser.add_argument('--artifact_cache_dir', type=str, default=None,
+                    help='Directory of cached depth, tracks, camera, tracking video and latents, defaults to <output_dir>/artifacts')
+    parser.add_argument('--no_artifact_cache', action='store_true', help='Recompute every stage instead of reusing cached artifacts')
+    parser.add_argument('--long_video', action='store_true',
+                    help='Keep the whole input video (sampled at 8 fps) and generate it in overlapping 49-frame windows')
+    parser.add_argument('--window_overlap', type=int, default=9, help='Frames shared by consecutive windows in --long_video mode')
+    parser.add_argument('--cache_threshold', type=float, default=None,
+                    help='Skip transformer blocks on denoising steps whose input changed less than this (e.g. 0.1), faster at a small quality cost')
+    parser.add_argument('--memory_gb', type=float, default=None,
+                    help='Device memory in GB that admission control plans with, defaults to the total memory of the GPU')
+    parser.add_argument('--max_seconds', type=float, default=None, help='Reject jobs predicted to take longer than this')
+    parser.add_argument('--calibration_path', type=str, default=None,
+                    help='JSON lines file of measured runs the cost model is calibrated with, defaults to <output_dir>/cost_calibration.jsonl')
+    parser.add_argument('--no_admission', action='store_true',
+                    help='Run without predicting the memory and latency of the job first')
+    return parser
+
+
+def job_spec(args, num_frames):
+    """Cost model description of the generation a job runs, read from the options and the checkpoint config only
+    
+    Args:
+        args (argparse.Namespace): Options parsed by `build_parser`
+        num_frames (int): Frames of the loaded input
+        
+    Returns:
+        JobSpec: Spec of the generation, with the VAE slicing and tiling every registry pipeline uses
+    """
+    num_windows = 1
+    if num_frames > WINDOW_FRAMES:
+        num_windows = len(plan_windows(num_frames, WINDOW_FRAMES, args.window_overlap))
+    return JobSpec(
+        num_frames=min(num_frames, WINDOW_FRAMES),
+        height=480,
+        width=720,
+        num_inference_steps=args.num_inference_steps,
+        num_windows=num_windows,
+        **read_transformer_config(args.checkpoint_path),
+    )
+
+
+def build_admission(args):
+    """Admission controller and calibration store of a standalone run
     
+    Returns:
+        Tuple[AdmissionController, CalibrationStore]: The controller is None when the device memory is unknown
+    """
+    calibration = CalibrationStore(args.calibration_path or os.path.join(args.output_dir, "cost_calibration.jsonl"))
+    capacity = args.memory_gb * GIB if args.memory_gb else total_bytes(f"cuda:{args.gpu}")
+    if capacity is None:
+        return None, calibration
+    device_name = torch.cuda.get_device_name(args.gpu) if torch.cuda.is_available() else None
+    cost_model = CostModel.from_store(calibration, device_name)
+    return AdmissionController(cost_model, capacity, max_seconds=args.max_seconds), calibration
+
+
+def run(args, das=None, progress=None, admission=None, calibration=None):
+    """Run one DaS job
+    
+    The memory and latency of the generation are predicted from the input shape before any model is loaded;
+    the job is then admitted, queued behind running jobs, down-shifted to sequential CFG, or rejected.
+    
+    Args:
+        args (argparse.Namespace): Options parsed by `build_parser`
+        das (DiffusionAsShaderPipeline): Resident pipeline to reuse, e.g. by the inference worker, created if None
+        progress (callable): Called with a message at every stage, defaults to print
+        admission (AdmissionController): Controller shared with concurrent jobs, built from the options if None
+        calibration (CalibrationStore): Store the measured peak memory and time of the generation are recorded to
+        
+    Returns:
+        str: Path of the generated video
+        
+    Raises:
+        AdmissionError: The job is predicted not to fit the device or the time limit
+    """
+    report = progress or print
+
     # Load input video/image
-    video_tensor, fps, is_video = load_media(args.input_path)
+    report("Loading input media")
+    max_frames = None if args.long_video else 49
+    video_tensor, fps, is_video = load_media(args.input_path, max_frames=max_frames)
+    num_frames = video_tensor.shape[0]
     if not is_video:
         args.tracking_method = "moge"
         print("Image input detected, using MoGe for tracking video generation.")
 
-    # Initialize pipeline
-    das = DiffusionAsShaderPipeline(gpu_id=args.gpu, output_dir=args.output_dir)
+    spec = job_spec(args, num_frames)
+    if admission is None and not args.no_admission:
+        admission, calibration = build_admission(args)
+    if admission is None:
+        return generate(args, video_tensor, fps, max_frames, das, report, spec, calibration)
+
+    decision = admission.acquire(spec, on_queue=lambda queued: report(f"Queued: {queued.reason}"))
+    report(f"Admitted ({decision.action}): predicted peak {decision.peak_bytes / GIB:.1f}GB, ~{decision.seconds:.0f}s")
+    try:
+        return generate(args, video_tensor, fps, max_frames, das, report, decision.spec, calibration)
+    finally:
+        admission.release(decision)
+
+
+def generate(args, video_tensor, fps, max_frames, das=None, report=print, spec=None, calibration=None):
+    """Run the stages of a DaS job on loaded media, see `run`
+    
+    Args:
+        args (argparse.Namespace): Options parsed by `build_parser`
+        video_tensor (torch.Tensor): Input frames [T,C,H,W]
+        fps (float): Frame rate of the input
+        max_frames (int): Frame limit the media was loaded with, part of the cache keys
+        das (DiffusionAsShaderPipeline): Resident pipeline to reuse, created if None
+        report (callable): Called with a message at every stage
+        spec (JobSpec): Admitted spec, its `sequential_cfg` and VAE slicing and tiling are applied to the pipeline
+        calibration (CalibrationStore): Store the measured generation is recorded to, None to not record
+        
+    Returns:
+        str: Path of the generated video
+    """
+    num_frames = video_tensor.shape[0]
+
+    # Initialize pipeline, a resident one only switches its output directory
+    if das is None:
+        das = DiffusionAsShaderPipeline(gpu_id=args.gpu, output_dir=args.output_dir, model_cache_gb=args.model_cache_gb,
+                                        prompt_cache_dir=args.prompt_cache_dir)
+    else:
+        das.output_dir = args.output_dir
+        os.makedirs(args.output_dir, exist_ok=True)
     das.fps = fps
-    if args.tracking_method == "moge" and args.tracking_path is None:
-        moge = MoGeModel.from_pretrained("Ruicheng/moge-vitl").to(das.device)
+    das.sequential_cfg = True if spec is not None and spec.sequential_cfg else None
+    das.vae_slicing = True if spec is not None and spec.vae_slicing else None
+    das.vae_tiling = True if spec is not None and spec.vae_tiling else None
+
+    # Cache of intermediate stages, keyed by the input media and the stage parameters
+    artifacts = None
+    if not args.no_artifact_cache:
+        artifacts = ArtifactCache(args.artifact_cache_dir or os.path.join(args.output_dir, "artifacts"))
+    media_key = None
+    if args.input_path is not None:
+        media_key = ArtifactCache.make_key("media", media=file_digest(args.input_path), max_frames=max_frames, size=(480, 720),
+                                       decoder="decord")
     
     # Repaint first frame if requested
     repaint_img_tensor = None
     if args.repaint:
+        report("Repainting the first frame")
         if args.repaint.lower() == "true":
             repainter = FirstFrameRepainter(gpu_id=args.gpu, output_dir=args.output_dir)
             repaint_img_tensor = repainter.repaint(
@@ -148,135 +267,237 @@ if __name__ == "__main__":
     # Generate tracking if not provided
     tracking_tensor = None
     pred_tracks = None
-    cam_motion = CameraMotionGenerator(args.camera_motion)
+    cam_motion = CameraMotionGenerator(args.camera_motion, frame_num=num_frames)
+
+    # Every stage is keyed by its inputs and parameters, later stages include the keys of the
+    # stages they consume. Changing e.g. --camera_motion only invalidates rendering and encoding.
+    def run_stage(stage, key, compute_fn):
+        if artifacts is None:
+            return compute_fn()
+        return artifacts.get_or_compute(stage, key, compute_fn)
+
+    object_mask_key = file_digest(args.object_mask) if args.object_mask else None
+    motion_params = dict(
+        camera_motion=args.camera_motion,
+        object_motion=args.object_motion,
+        object_mask=object_mask_key,
+    )
 
+    report("Generating the tracking video")
     if args.tracking_path:
-        tracking_tensor, _, _ = load_media(args.tracking_path)
+        tracking_tensor, _, _ = load_media(args.tracking_path, max_frames=max_frames)
+        render_key = ArtifactCache.make_key("tracking_video", tracking_path=file_digest(args.tracking_path))
         
     elif args.tracking_method == "moge":
-        # Use the first frame from previously loaded video_tensor
-        infer_result = moge.infer(video_tensor[0].to(das.device))  # [C, H, W] in range [0,1]
-        H, W = infer_result["points"].shape[0:2]
-        pred_tracks = infer_result["points"].unsqueeze(0).repeat(49, 1, 1, 1) #[T, H, W, 3]
-        cam_motion.set_intr(infer_result["intrinsics"])
-
-        # Apply object motion if specified
-        if args.object_motion:
-            if args.object_mask is None:
-                raise ValueError("Object motion specified but no mask provided. Please provide a mask image with --object_mask")
+        moge_key = ArtifactCache.make_key("moge", media=media_key, revision=MOGE_REPO)
+
+        def run_moge():
+            # Use the first frame from previously loaded video_tensor
+            with das.tracker_pool.use("moge") as moge_model:
+                infer_result = moge_model.infer(video_tensor[0].to(das.device))  # [C, H, W] in range [0,1]
+            return {name: infer_result[name] for name in ("points", "mask", "intrinsics")}
+
+        render_key = ArtifactCache.make_key("tracking_video", moge=moge_key, **motion_params)
+
+        def render_moge():
+            infer_result = run_stage("moge", moge_key, run_moge)
+            H, W = infer_result["points"].shape[0:2]
+            pred_tracks = infer_result["points"].to(das.device).unsqueeze(0).repeat(num_frames, 1, 1, 1) #[T, H, W, 3]
+            cam_motion.set_intr(infer_result["intrinsics"].to(das.device))
+
+            # Apply object motion if specified
+            if args.object_motion:
+                if args.object_mask is None:
+                    raise ValueError("Object motion specified but no mask provided. Please provide a mask image with --object_mask")
+                    
+                # Load mask image
+                mask_image = Image.open(args.object_mask).convert('L')  # Convert to grayscale
+                mask_image = transforms.Resize((480, 720))(mask_image)  # Resize to match video size
+                # Convert to binary mask
+                mask = torch.from_numpy(np.array(mask_image) > 127)  # Threshold at 127
                 
-            # Load mask image
-            mask_image = Image.open(args.object_mask).convert('L')  # Convert to grayscale
-            mask_image = transforms.Resize((480, 720))(mask_image)  # Resize to match video size
-            # Convert to binary mask
-            mask = torch.from_numpy(np.array(mask_image) > 127)  # Threshold at 127
-            
-            motion_generator = ObjectMotionGenerator(device=das.device)
-
-            pred_tracks = motion_generator.apply_motion(
-                pred_tracks=pred_tracks,
-                mask=mask,
-                motion_type=args.object_motion,
-                distance=50,
-                num_frames=49,
-                tracking_method="moge"
+                motion_generator = ObjectMotionGenerator(device=das.device)
+
+                pred_tracks = motion_generator.apply_motion(
+                    pred_tracks=pred_tracks,
+                    mask=mask,
+                    motion_type=args.object_motion,
+                    distance=50,
+                    num_frames=num_frames,
+                    tracking_method="moge"
+                )
+                print("Object motion applied")
+
+            # Apply camera motion if specified
+            if args.camera_motion:
+                poses = cam_motion.get_default_motion() # shape: [T, 4, 4]
+                print("Camera motion applied")
+            else:
+                # no poses
+                poses = torch.eye(4).unsqueeze(0).repeat(num_frames, 1, 1)
+            # change pred_tracks into screen coordinate
+            pred_tracks_flatten = pred_tracks.reshape(video_tensor.shape[0], H*W, 3)
+            pred_tracks = cam_motion.w2s_moge(pred_tracks_flatten, poses).reshape([video_tensor.shape[0], H, W, 3]) # [T, H, W, 3]
+            _, frames = das.visualize_tracking_moge(
+                pred_tracks, 
+                infer_result["mask"].cpu().numpy(),
+                zero_copy=True
             )
-            print("Object motion applied")
+            print('export tracking video via MoGe.')
+            return {"frames": frames}
 
-        # Apply camera motion if specified
-        if args.camera_motion:
-            poses = cam_motion.get_default_motion() # shape: [49, 4, 4]
-            print("Camera motion applied")
-        else:
-            # no poses
-            poses = torch.eye(4).unsqueeze(0).repeat(49, 1, 1)
-        # change pred_tracks into screen coordinate
-        pred_tracks_flatten = pred_tracks.reshape(video_tensor.shape[0], H*W, 3)
-        pred_tracks = cam_motion.w2s_moge(pred_tracks_flatten, poses).reshape([video_tensor.shape[0], H, W, 3]) # [T, H, W, 3]
-        _, tracking_tensor = das.visualize_tracking_moge(
-            pred_tracks.cpu().numpy(), 
-            infer_result["mask"].cpu().numpy()
-        )
-        print('export tracking video via MoGe.')
+        tracking_tensor = run_stage("tracking_video", render_key, render_moge)["frames"]
 
     else:
-
+        density = 70
+        depth_key = ArtifactCache.make_key("depth", media=media_key, revision=ZOEDEPTH_REPO)
         if args.tracking_method == "cotracker":
-            pred_tracks, pred_visibility = das.generate_tracking_cotracker(video_tensor) # T N 3, T N
+            tracks_key = ArtifactCache.make_key(
+                "tracks", depth=depth_key, tracking_method="cotracker", density=density,
+                revision=COTRACKER_HUB_DIR,
+            )
         else:
-            pred_tracks, pred_visibility, T_Firsts = das.generate_tracking_spatracker(video_tensor) # T N 3, T N, B N
-
-        # Preprocess video tensor to match VGGT requirements
-        t, c, h, w = video_tensor.shape
-        new_width = 518
-        new_height = round(h * (new_width / w) / 14) * 14
-        resize_transform = transforms.Resize((new_height, new_width), interpolation=Image.BICUBIC)
-        video_vggt = resize_transform(video_tensor)  # [T, C, H, W]
-        
-        if new_height > 518:
-            start_y = (new_height - 518) // 2
-            video_vggt = video_vggt[:, :, start_y:start_y + 518, :]
+            tracks_key = ArtifactCache.make_key(
+                "tracks", depth=depth_key, tracking_method="spatracker", density=density,
+                interp_shape=(384, 576), revision="spaT_final",
+            )
+        camera_key = ArtifactCache.make_key("camera", media=media_key, revision=VGGT_REPO, width=518)
 
-        # Get extrinsic and intrinsic matrices
-        vggt_model = VGGT.from_pretrained("facebook/VGGT-1B").to(das.device)
+        def run_depth():
+            return {"depth": das.estimate_depth(video_tensor)}
 
-        with torch.no_grad():
-            with torch.cuda.amp.autocast(dtype=das.dtype):
+        def run_tracks():
+            video_depth = run_stage("depth", depth_key, run_depth)["depth"]
+            if args.tracking_method == "cotracker":
+                pred_tracks, pred_visibility = das.generate_tracking_cotracker(video_tensor, density=density, video_depth=video_depth) # T N 3, T N
+                return {"tracks": pred_tracks, "visibility": pred_visibility}
+            pred_tracks, pred_visibility, T_Firsts = das.generate_tracking_spatracker(video_tensor, density=density, video_depth=video_depth) # T N 3, T N, B N
+            return {"tracks": pred_tracks, "visibility": pred_visibility, "t_firsts": T_Firsts}
 
-                video_vggt = video_vggt.unsqueeze(0)  # [1, T, C, H, W]
-                aggregated_tokens_list, ps_idx = vggt_model.aggregator(video_vggt.to(das.device))
+        def run_camera():
+            # Preprocess video tensor to match VGGT requirements
+            t, c, h, w = video_tensor.shape
+            new_width = 518
+            new_height = round(h * (new_width / w) / 14) * 14
+            resize_transform = transforms.Resize((new_height, new_width), interpolation=Image.BICUBIC)
+            video_vggt = resize_transform(video_tensor)  # [T, C, H, W]
             
-                # Extrinsic and intrinsic matrices, following OpenCV convention (camera from world)
-                extr, intr = pose_encoding_to_extri_intri(vggt_model.camera_head(aggregated_tokens_list)[-1], video_vggt.shape[-2:])
-                depth_map, depth_conf = vggt_model.depth_head(aggregated_tokens_list, video_vggt, ps_idx)
-        
-        cam_motion.set_intr(intr)
-        cam_motion.set_extr(extr)
-
-        del vggt_model
-
-        # Apply camera motion if specified
-        if args.camera_motion:
-            poses = cam_motion.get_default_motion() # shape: [49, 4, 4]
-            pred_tracks_world = cam_motion.s2w_vggt(pred_tracks, extr, intr)
-            pred_tracks = cam_motion.w2s_vggt(pred_tracks_world, extr, intr, poses, 
-                                 override_extrinsics=(args.override_extrinsics == "override"))
-            print("Camera motion applied")
-        
-        # Apply object motion if specified
-        if args.object_motion:
-            if args.object_mask is None:
-                raise ValueError("Object motion specified but no mask provided. Please provide a mask image with --object_mask")
+            if new_height > 518:
+                start_y = (new_height - 518) // 2
+                video_vggt = video_vggt[:, :, start_y:start_y + 518, :]
+
+            # Get extrinsic and intrinsic matrices
+            vggt_model = VGGT.from_pretrained(VGGT_REPO).to(das.device)
+
+            with torch.no_grad():
+                with torch.cuda.amp.autocast(dtype=das.dtype):
+
+                    video_vggt = video_vggt.unsqueeze(0)  # [1, T, C, H, W]
+                    aggregated_tokens_list, ps_idx = vggt_model.aggregator(video_vggt.to(das.device))
                 
-            # Load mask image
-            mask_image = Image.open(args.object_mask).convert('L')  # Convert to grayscale
-            mask_image = transforms.Resize((480, 720))(mask_image)  # Resize to match video size
-            # Convert to binary mask
-            mask = torch.from_numpy(np.array(mask_image) > 127)  # Threshold at 127
-            
-            motion_generator = ObjectMotionGenerator(device=das.device)
+                    # Extrinsic and intrinsic matrices, following OpenCV convention (camera from world)
+                    extr, intr = pose_encoding_to_extri_intri(vggt_model.camera_head(aggregated_tokens_list)[-1], video_vggt.shape[-2:])
+
+            del vggt_model
+            return {"extrinsics": extr, "intrinsics": intr}
+
+        render_key = ArtifactCache.make_key(
+            "tracking_video", tracks=tracks_key, camera=camera_key,
+            override_extrinsics=args.override_extrinsics, **motion_params,
+        )
+
+        def render_tracks():
+            tracks = run_stage("tracks", tracks_key, run_tracks)
+            pred_tracks = tracks["tracks"].to(das.device)
+            pred_visibility = tracks["visibility"].to(das.device)
+
+            camera = run_stage("camera", camera_key, run_camera)
+            extr = camera["extrinsics"].to(das.device)
+            intr = camera["intrinsics"].to(das.device)
+            cam_motion.set_intr(intr)
+            cam_motion.set_extr(extr)
+
+            # Apply camera motion if specified
+            if args.camera_motion:
+                poses = cam_motion.get_default_motion() # shape: [T, 4, 4]
+                pred_tracks_world = cam_motion.s2w_vggt(pred_tracks, extr, intr)
+                pred_tracks = cam_motion.w2s_vggt(pred_tracks_world, extr, intr, poses, 
+                                     override_extrinsics=(args.override_extrinsics == "override"))
+                print("Camera motion applied")
             
-            pred_tracks = motion_generator.apply_motion(
-                pred_tracks=pred_tracks,
-                mask=mask,
-                motion_type=args.object_motion,
-                distance=50,
-                num_frames=49,
-                tracking_method="spatracker"
-            ).unsqueeze(0)
-            print(f"Object motion '{args.object_motion}' applied using mask from {args.object_mask}")
-    
-        if args.tracking_method == "cotracker":
-            _, tracking_tensor = das.visualize_tracking_cotracker(pred_tracks, pred_visibility)
-        else:
-            _, tracking_tensor = das.visualize_tracking_spatracker(video_tensor, pred_tracks, pred_visibility, T_Firsts)
+            # Apply object motion if specified
+            if args.object_motion:
+                if args.object_mask is None:
+                    raise ValueError("Object motion specified but no mask provided. Please provide a mask image with --object_mask")
+                    
+                # Load mask image
+                mask_image = Image.open(args.object_mask).convert('L')  # Convert to grayscale
+                mask_image = transforms.Resize((480, 720))(mask_image)  # Resize to match video size
+                # Convert to binary mask
+                mask = torch.from_numpy(np.array(mask_image) > 127)  # Threshold at 127
+                
+                motion_generator = ObjectMotionGenerator(device=das.device)
+                
+                pred_tracks = motion_generator.apply_motion(
+                    pred_tracks=pred_tracks,
+                    mask=mask,
+                    motion_type=args.object_motion,
+                    distance=50,
+                    num_frames=num_frames,
+                    tracking_method="spatracker"
+                ).unsqueeze(0)
+                print(f"Object motion '{args.object_motion}' applied using mask from {args.object_mask}")
+        
+            if args.tracking_method == "cotracker":
+                _, frames = das.visualize_tracking_cotracker(pred_tracks, pred_visibility, zero_copy=True)
+            else:
+                _, frames = das.visualize_tracking_spatracker(video_tensor, pred_tracks, pred_visibility, tracks["t_firsts"], zero_copy=True)
+            return {"frames": frames}
+
+        tracking_tensor = run_stage("tracking_video", render_key, render_tracks)["frames"]
+
+    latents_key = ArtifactCache.make_key(
+        "tracking_latents", tracking_video=render_key, checkpoint=args.checkpoint_path, dtype=str(das.dtype),
+    )
+    # Peak memory and wall time of the generation calibrate the cost model; batched jobs share both, so they do not record
+    measure = calibration is not None and spec is not None and torch.cuda.is_available() and das.job_scheduler is None
+    if measure:
+        torch.cuda.reset_peak_memory_stats(das.device)
+        start = time.perf_counter()
+
+    tracking_latents = None
+    report("Encoding the tracking video")
+    if tracking_tensor.shape[0] <= WINDOW_FRAMES:
+        # long videos encode their tracking latents per window while generating
+        tracking_latents = run_stage(
+            "tracking_latents", latents_key,
+            lambda: {"latents": das.encode_tracking(tracking_tensor, args.checkpoint_path, dtype=das.dtype)},
+        )["latents"]
     
-    das.apply_tracking(
+    report("Generating the video")
+    output_path = das.apply_tracking(
         video_tensor=video_tensor,
         fps=fps,
         tracking_tensor=tracking_tensor,
         img_cond_tensor=repaint_img_tensor,
         prompt=args.prompt,
         checkpoint_path=args.checkpoint_path,
-        num_inference_steps=args.num_inference_steps
+        num_inference_steps=args.num_inference_steps,
+        tracking_latents=tracking_latents,
+        cache_threshold=args.cache_threshold,
+        window_overlap=args.window_overlap,
+        progress_callback=lambda written, total: report(f"Wrote {written}/{total} frames"),
     )
+    if measure:
+        torch.cuda.synchronize(das.device)
+        calibration.record(spec, torch.cuda.max_memory_allocated(das.device), time.perf_counter() - start,
+                           torch.cuda.get_device_name(das.device))
+    das.wait_for_pending_writes()
+    print(f"Model cache stats: {das.model_registry.stats()}")
+    if artifacts is not None:
+        print(f"Artifact cache stats: {artifacts.stats()}")
+    return output_path
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
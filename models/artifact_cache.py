@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+# Bump to invalidate every stored artifact when a stage changes its outputs
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tensor_digest(tensor):
+    """sha256 of a tensor's shape, dtype and contents"""
+    tensor = torch.as_tensor(tensor).detach().cpu().contiguous()
+    digest = hashlib.sha256(f"{tuple(tensor.shape)}:{tensor.dtype}".encode("utf-8"))
+    digest.update(tensor.view(torch.uint8).numpy().tobytes() if tensor.numel() else b"")
+    return digest.hexdigest()
+
+
+def _jsonable(value):
+    if isinstance(value, torch.Tensor):
+        return tensor_digest(value)
+    if isinstance(value, np.ndarray):
+        return tensor_digest(torch.from_numpy(value))
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in sorted(value.items())}
+    return value
+
+
+class ArtifactCache:
+    """Content-addressed store for intermediate demo stages
+
+    Every artifact is a dict of tensors saved as one safetensors file under
+    ``<root>/<stage>/<key>.safetensors``. Keys are hashes of the stage name and its
+    parameters; a stage that depends on another one includes the parent key in its
+    parameters, so changing a later stage never invalidates the earlier ones.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Directory the artifacts are stored in
+        """
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(stage, **params):
+        """Hash a stage name and its parameters; tensors and arrays are hashed by content"""
+        payload = {"stage": stage, "version": CACHE_VERSION, "params": _jsonable(params)}
+        blob = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, stage, key):
+        return os.path.join(self.root, stage, f"{key}.safetensors")
+
+    def load(self, stage, key):
+        """Return the stored dict of tensors, or None"""
+        from safetensors.torch import load_file
+
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return load_file(path)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable artifact {path}: {e}")
+            return None
+
+    def save(self, stage, key, tensors):
+        """Store a dict of tensors for `stage` under `key`"""
+        from safetensors.torch import save_file
+
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tensors = {name: t.detach().cpu().contiguous() for name, t in tensors.items()}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        save_file(tensors, tmp_path, metadata={"stage": stage, "version": str(CACHE_VERSION)})
+        os.replace(tmp_path, path)
+
+    def get_or_compute(self, stage, key, compute_fn):
+        """Load `stage` for `key`, running `compute_fn` and storing its result on a miss
+
+        Args:
+            stage (str): Stage name, also the sub-directory of the artifacts
+            key (str): Key from `make_key`
+            compute_fn (callable): Returns a dict of tensors
+
+        Returns:
+            dict: Stage outputs as CPU tensors when loaded, as returned by `compute_fn` otherwise
+        """
+        tensors = self.load(stage, key)
+        if tensors is not None:
+            self.hits += 1
+            print(f"Reusing cached {stage} ({key[:8]})")
+            return tensors
+        self.misses += 1
+        tensors = compute_fn()
+        self.save(stage, key, tensors)
+        return tensors
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
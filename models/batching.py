@@ -0,0 +1,116 @@
+import torch
+
+# Peak activation bytes per token and hidden channel of one sample in a transformer block,
+# covering qkv, attention output, the 4x feed-forward and the tracking branch running alongside
+ACTIVATION_FACTOR = 24
+
+
+def latent_tokens(height, width, num_frames, vae_scale_factor_spatial=8, vae_scale_factor_temporal=4, patch_size=2):
+    """Number of video tokens the transformer sees for one sample"""
+    latent_frames = (num_frames - 1) // vae_scale_factor_temporal + 1
+    latent_h = height // vae_scale_factor_spatial // patch_size
+    latent_w = width // vae_scale_factor_spatial // patch_size
+    return latent_frames * latent_h * latent_w
+
+
+def estimate_item_bytes(height, width, num_frames, transformer_config, dtype=torch.bfloat16, do_classifier_free_guidance=True,
+                        max_text_seq_length=226):
+    """Rough peak activation memory of one batch item during denoising
+
+    Args:
+        height (int): Video height
+        width (int): Video width
+        num_frames (int): Number of frames
+        transformer_config: Config of the tracking transformer
+        dtype (torch.dtype): Computation dtype
+        do_classifier_free_guidance (bool): Whether every item runs twice (cond and uncond)
+        max_text_seq_length (int): Number of text tokens
+
+    Returns:
+        int: Estimated bytes per item
+    """
+    patch_size = getattr(transformer_config, "patch_size", 2)
+    hidden = transformer_config.num_attention_heads * transformer_config.attention_head_dim
+    tokens = latent_tokens(height, width, num_frames, patch_size=patch_size) + max_text_seq_length
+    element_size = torch.tensor([], dtype=dtype).element_size()
+    copies = 2 if do_classifier_free_guidance else 1
+    return int(tokens * hidden * element_size * ACTIVATION_FACTOR * copies)
+
+
+def available_bytes(device):
+    """Free memory on `device`, None when it cannot be queried"""
+    device = torch.device(device)
+    if device.type != "cuda" or not torch.cuda.is_available():
+        return None
+    free, _ = torch.cuda.mem_get_info(device)
+    return free
+
+
+def activation_budget_bytes(device, memory_budget_gb=None, resident_bytes=0):
+    """Memory left for activations on `device`
+
+    Args:
+        device (str): Device the generation runs on
+        memory_budget_gb (float): Device memory the generation may use in GB, resident weights included, None for
+            the free device memory
+        resident_bytes (int): Bytes of the weights already on the device, taken out of `memory_budget_gb`
+
+    Returns:
+        int: Bytes available for activations, capped by the free device memory; None when there is no budget and
+            the device cannot be queried
+    """
+    free = available_bytes(device)
+    if memory_budget_gb is None:
+        return free
+    budget = max(int(memory_budget_gb * 1024 ** 3) - resident_bytes, 0)
+    return min(budget, free) if free is not None else budget
+
+
+def total_bytes(device):
+    """Total memory of `device` from its properties, None when it is not a CUDA device; allocates nothing"""
+    device = torch.device(device)
+    if device.type != "cuda" or not torch.cuda.is_available():
+        return None
+    return torch.cuda.get_device_properties(device).total_memory
+
+
+def plan_batches(num_items, item_bytes=None, budget_bytes=None, max_batch_size=None):
+    """Split `num_items` into consecutive chunks that fit the memory budget
+
+    Args:
+        num_items (int): Number of items
+        item_bytes (int): Estimated memory of one item
+        budget_bytes (int): Memory available for activations, None for no limit
+        max_batch_size (int): Upper bound on the chunk size, None for no limit
+
+    Returns:
+        list[slice]: Chunks covering all items in order
+    """
+    chunk = num_items
+    if max_batch_size is not None:
+        chunk = min(chunk, max_batch_size)
+    if budget_bytes is not None and item_bytes:
+        chunk = min(chunk, budget_bytes // item_bytes)
+    chunk = max(1, int(chunk))
+    return [slice(start, min(start + chunk, num_items)) for start in range(0, num_items, chunk)]
+
+
+def needs_sequential_cfg(height, width, num_frames, batch_size, transformer_config, budget_bytes, dtype=torch.bfloat16):
+    """Whether the conditional and unconditional halves have to run as separate transformer passes
+
+    Args:
+        height (int): Video height
+        width (int): Video width
+        num_frames (int): Number of frames
+        batch_size (int): Number of videos generated together
+        transformer_config: Config of the tracking transformer
+        budget_bytes (int): Memory available for activations, see `activation_budget_bytes`, None for no limit
+        dtype (torch.dtype): Computation dtype
+
+    Returns:
+        bool: True when the CFG-doubled batch is estimated to exceed `budget_bytes`
+    """
+    if budget_bytes is None:
+        return False
+    batched_bytes = batch_size * estimate_item_bytes(height, width, num_frames, transformer_config, dtype, True)
+    return batched_bytes > budget_bytes
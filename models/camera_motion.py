@@ -0,0 +1,301 @@
+import math
+from functools import lru_cache
+
+import torch
+
+AXES = ("x", "y", "z")
+
+
+class MotionSegment:
+    """One parsed statement of a camera motion spec
+
+    `kind` is "trans" (params dx, dy, dz), "rot" (axis, angle in degrees), "spiral" (radius) or "keys"
+    (keyframes as (frame, tx, ty, tz, rx, ry, rz) tuples, which ignore `start` and `end`).
+    """
+
+    def __init__(self, kind, params, start, end):
+        self.kind = kind
+        self.params = params
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"MotionSegment({self.kind}, {self.params}, frames {self.start}-{self.end})"
+
+
+def _frame_range(params, last_frame):
+    start = max(0, min(last_frame, int(params[0])))
+    end = max(0, min(last_frame, int(params[1])))
+    return (end, start) if start > end else (start, end)
+
+
+def parse_motion(spec, frame_num):
+    """Parse a camera motion spec into segments, see `CameraMotionGenerator.get_default_motion` for the syntax
+
+    Besides `trans`, `rot` and `spiral`, the spec may place keyframes with `key <frame> <tx> <ty> <tz> [<rx> <ry> <rz>]`
+    (translation and XYZ rotation in degrees). All keyframes of a spec form one segment, at the position of the first.
+
+    Args:
+        spec (str): Motion statements separated by semicolons
+        frame_num (int): Number of frames of the trajectory
+
+    Returns:
+        list[MotionSegment]: Segments in the order they are composed
+    """
+    if not isinstance(spec, str):
+        raise ValueError(f'camera_motion must be a string, but got {type(spec)}')
+    last_frame = frame_num - 1
+    segments = []
+    keys = None
+    for statement in spec.split(';'):
+        params = statement.strip().lower().split()
+        if not params:
+            continue
+        motion_type = params[0]
+        start, end = 0, last_frame
+
+        if motion_type == 'trans':
+            if len(params) not in [4, 6]:
+                raise ValueError(f"trans motion requires 3 or 5 parameters: 'trans <dx> <dy> <dz>' or 'trans <dx> <dy> <dz> <start_frame> <end_frame>', got: {statement.strip()}")
+            if len(params) == 6:
+                start, end = _frame_range(params[4:6], last_frame)
+            segments.append(MotionSegment('trans', tuple(map(float, params[1:4])), start, end))
+
+        elif motion_type == 'rot':
+            if len(params) not in [3, 5]:
+                raise ValueError(f"rot motion requires 2 or 4 parameters: 'rot <axis> <angle>' or 'rot <axis> <angle> <start_frame> <end_frame>', got: {statement.strip()}")
+            axis = params[1]
+            if axis not in AXES:
+                raise ValueError(f"Invalid rotation axis '{axis}', must be 'x', 'y' or 'z'")
+            if len(params) == 5:
+                start, end = _frame_range(params[3:5], last_frame)
+            segments.append(MotionSegment('rot', (axis, float(params[2])), start, end))
+
+        elif motion_type == 'spiral':
+            if len(params) not in [2, 4]:
+                raise ValueError(f"spiral motion requires 1 or 3 parameters: 'spiral <radius>' or 'spiral <radius> <start_frame> <end_frame>', got: {statement.strip()}")
+            if len(params) == 4:
+                start, end = _frame_range(params[2:4], last_frame)
+            segments.append(MotionSegment('spiral', (float(params[1]),), start, end))
+
+        elif motion_type == 'key':
+            if len(params) not in [5, 8]:
+                raise ValueError(f"key requires 4 or 7 parameters: 'key <frame> <tx> <ty> <tz>' or 'key <frame> <tx> <ty> <tz> <rx> <ry> <rz>', got: {statement.strip()}")
+            frame = max(0, min(last_frame, int(params[1])))
+            values = tuple(map(float, params[2:])) + (0.0,) * (8 - len(params))
+            if keys is None:
+                keys = MotionSegment('keys', [], 0, last_frame)
+                segments.append(keys)
+            keys.params.append((frame,) + values)
+
+        else:
+            raise ValueError(f'camera_motion type must be in [trans, spiral, rot, key], but got {motion_type}')
+
+    if keys is not None:
+        frames = [key[0] for key in keys.params]
+        if len(set(frames)) != len(frames):
+            raise ValueError(f"Keyframes must be at distinct frames, got {frames}")
+        keys.params = tuple(sorted(keys.params))
+    return segments
+
+
+def segment_progress(start, end, frame_num, dtype=torch.float64):
+    """Progress of every frame through [start, end]: 0 before, 1 from `end` on
+
+    Returns:
+        torch.Tensor: [frame_num]
+    """
+    frames = torch.arange(frame_num, dtype=dtype)
+    if end == start:
+        return (frames >= start).to(dtype)
+    return ((frames - start) / (end - start)).clamp(0, 1)
+
+
+def translation_matrices(offsets):
+    """[T, 4, 4] translations by `offsets` [T, 3]"""
+    mats = torch.eye(4, dtype=offsets.dtype).repeat(offsets.shape[0], 1, 1)
+    mats[:, :3, 3] = offsets
+    return mats
+
+
+def axis_rotation_matrices(axis, angles):
+    """[T, 4, 4] rotations by `angles` [T] (radians) about the x, y or z axis"""
+    if axis not in AXES:
+        raise ValueError("Invalid axis value. Choose 'x', 'y', or 'z'.")
+    cos, sin = torch.cos(angles), torch.sin(angles)
+    mats = torch.eye(4, dtype=angles.dtype).repeat(angles.shape[0], 1, 1)
+    i, j = {"x": (1, 2), "y": (2, 0), "z": (0, 1)}[axis]
+    mats[:, i, i] = cos
+    mats[:, i, j] = -sin
+    mats[:, j, i] = sin
+    mats[:, j, j] = cos
+    return mats
+
+
+def look_at_rotations(positions, target):
+    """[T, 3, 3] camera-to-world rotations of cameras at `positions` [T, 3] looking at `target` [3], y up"""
+    direction = target.unsqueeze(0) - positions
+    direction = direction / direction.norm(dim=-1, keepdim=True)
+    up = torch.tensor([0.0, 1.0, 0.0], dtype=positions.dtype).expand_as(direction)
+    right = torch.cross(up, direction, dim=-1)
+    right = right / right.norm(dim=-1, keepdim=True)
+    up = torch.cross(direction, right, dim=-1)
+    # the rows right, up, direction are orthonormal, so the inverse is the transpose
+    return torch.stack([right, up, direction], dim=1).transpose(1, 2)
+
+
+def spiral_matrices(radius, frame_num, forward_ratio=0.5, backward_ratio=0.5, rotation_times=0.1, look_at_times=0.5,
+                    dtype=torch.float64):
+    """[frame_num, 4, 4] poses of a camera spiralling out and back while looking ahead, see `CameraMotionGenerator.spiral_poses`"""
+    t = torch.linspace(0, 1, frame_num, dtype=dtype)
+    r = torch.sin(math.pi * t) * radius * rotation_times
+    theta = 2 * math.pi * t
+    # Limit y motion for better floor/sky view
+    y = r * torch.cos(theta) * 0.3
+    x = r * torch.sin(theta)
+    z = -r
+    z = torch.where(z < 0, z * forward_ratio, torch.where(z > 0, z * backward_ratio, z))
+    positions = torch.stack([x, y, z], dim=-1)
+    target = torch.tensor([0.0, 0.0, radius * look_at_times], dtype=dtype)
+
+    poses = torch.eye(4, dtype=dtype).repeat(frame_num, 1, 1)
+    poses[:, :3, :3] = look_at_rotations(positions, target)
+    poses[:, :3, 3] = positions
+    return poses
+
+
+def _quaternion_multiply(a, b):
+    aw, ax, ay, az = a.unbind(-1)
+    bw, bx, by, bz = b.unbind(-1)
+    return torch.stack([
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ], dim=-1)
+
+
+def euler_quaternions(angles):
+    """Unit quaternions (w, x, y, z) [K, 4] of the rotations x, then y, then z by `angles` [K, 3] in radians
+
+    The rotation matches `rot x a; rot y b; rot z c`, i.e. the matrix Rx @ Ry @ Rz.
+    """
+    half = angles / 2
+    zeros = torch.zeros_like(half[:, 0])
+    quaternions = [
+        torch.stack([torch.cos(half[:, k]), *[torch.sin(half[:, k]) if i == k else zeros for i in range(3)]], dim=-1)
+        for k in range(3)
+    ]
+    return _quaternion_multiply(_quaternion_multiply(quaternions[0], quaternions[1]), quaternions[2])
+
+
+def quaternion_slerp(q0, q1, u):
+    """Spherical linear interpolation between unit quaternions q0, q1 [T, 4] at `u` [T], along the shorter arc"""
+    dot = (q0 * q1).sum(-1)
+    q1 = torch.where(dot.unsqueeze(-1) < 0, -q1, q1)
+    dot = dot.abs().clamp(max=1.0)
+    theta = torch.acos(dot)
+    sin_theta = torch.sin(theta)
+    # nearly parallel quaternions fall back to a normalized lerp
+    close = sin_theta < 1e-6
+    safe = torch.where(close, torch.ones_like(sin_theta), sin_theta)
+    w0 = torch.where(close, 1 - u, torch.sin((1 - u) * theta) / safe)
+    w1 = torch.where(close, u, torch.sin(u * theta) / safe)
+    q = w0.unsqueeze(-1) * q0 + w1.unsqueeze(-1) * q1
+    return q / q.norm(dim=-1, keepdim=True)
+
+
+def quaternion_matrices(q):
+    """[T, 3, 3] rotation matrices of unit quaternions (w, x, y, z) [T, 4]"""
+    w, x, y, z = q.unbind(-1)
+    return torch.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], dim=-1).reshape(-1, 3, 3)
+
+
+def keyframe_matrices(keys, frame_num, dtype=torch.float64):
+    """[frame_num, 4, 4] poses through keyframes: Catmull-Rom translations and SLERP rotations
+
+    Frames before the first keyframe hold its pose, frames after the last hold the last pose.
+
+    Args:
+        keys (tuple): (frame, tx, ty, tz, rx, ry, rz) tuples sorted by frame, angles in degrees
+        frame_num (int): Number of frames
+    """
+    keys = torch.tensor(keys, dtype=dtype)
+    key_frames, translations = keys[:, 0].contiguous(), keys[:, 1:4]
+    rotations = euler_quaternions(torch.deg2rad(keys[:, 4:7]))
+    num_keys = keys.shape[0]
+
+    frames = torch.arange(frame_num, dtype=dtype)
+    # span s covers key_frames[s] .. key_frames[s + 1]
+    span = (torch.searchsorted(key_frames, frames, right=True) - 1).clamp(0, max(num_keys - 2, 0))
+    if num_keys == 1:
+        u = torch.zeros_like(frames)
+        nxt = span
+    else:
+        nxt = span + 1
+        u = ((frames - key_frames[span]) / (key_frames[nxt] - key_frames[span])).clamp(0, 1)
+
+    # Catmull-Rom through the neighbouring keys, the end keys are repeated
+    p0 = translations[(span - 1).clamp(min=0)]
+    p1, p2 = translations[span], translations[nxt]
+    p3 = translations[(nxt + 1).clamp(max=num_keys - 1)]
+    u1 = u.unsqueeze(-1)
+    offsets = 0.5 * (2 * p1 + (p2 - p0) * u1 + (2 * p0 - 5 * p1 + 4 * p2 - p3) * u1 ** 2
+                     + (3 * p1 - p0 - 3 * p2 + p3) * u1 ** 3)
+
+    poses = torch.eye(4, dtype=dtype).repeat(frame_num, 1, 1)
+    poses[:, :3, :3] = quaternion_matrices(quaternion_slerp(rotations[span], rotations[nxt], u))
+    poses[:, :3, 3] = offsets
+    return poses
+
+
+def segment_matrices(segment, frame_num, dtype=torch.float64):
+    """[frame_num, 4, 4] motion of one segment, identity before its start and holding its end pose after"""
+    if segment.kind == 'keys':
+        return keyframe_matrices(segment.params, frame_num, dtype)
+    t = segment_progress(segment.start, segment.end, frame_num, dtype)
+    started = torch.arange(frame_num) >= segment.start
+    if segment.kind == 'trans':
+        return translation_matrices(t.unsqueeze(-1) * torch.tensor(segment.params, dtype=dtype))
+    if segment.kind == 'rot':
+        axis, angle = segment.params
+        return axis_rotation_matrices(axis, torch.deg2rad(angle * t))
+    if segment.kind == 'spiral':
+        spiral = spiral_matrices(segment.params[0], frame_num, dtype=dtype)
+        indices = (t * (frame_num - 1)).long()
+        poses = spiral[indices]
+        poses[~started] = torch.eye(4, dtype=dtype)
+        return poses
+    raise ValueError(f"Unknown motion segment {segment.kind}")
+
+
+@lru_cache(maxsize=64)
+def _compiled_motion(spec, frame_num, device):
+    poses = torch.eye(4, dtype=torch.float64).repeat(frame_num, 1, 1)
+    for segment in parse_motion(spec, frame_num):
+        poses = torch.matmul(poses, segment_matrices(segment, frame_num))
+    return poses.to(device=device, dtype=torch.float32)
+
+
+def compile_motion(spec, frame_num, device="cpu"):
+    """Camera poses of a motion spec, composed in the order of its statements
+
+    All frames of a segment are evaluated at once in float64 on CPU. Trajectories are memoized by
+    (spec, frame count, device), so repeated requests only copy the cached poses.
+
+    Args:
+        spec (str): Motion statements, see `parse_motion`
+        frame_num (int): Number of frames
+        device (str or torch.device): Device of the returned poses
+
+    Returns:
+        torch.Tensor: float32 poses [frame_num, 4, 4]
+    """
+    if not isinstance(spec, str):
+        raise ValueError(f'camera_motion must be a string, but got {type(spec)}')
+    normalized = "; ".join(" ".join(statement.lower().split()) for statement in spec.split(';') if statement.strip())
+    return _compiled_motion(normalized, int(frame_num), str(torch.device(device))).clone()
@@ -0,0 +1,185 @@
+import json
+import os
+import re
+
+import torch
+
+WEIGHTS_NAME = "diffusion_pytorch_model"
+
+_MAIN_BLOCK = re.compile(r"^transformer_blocks\.(\d+)\.(.+)$")
+
+
+def safetensors_files(checkpoint_dir, variant=None):
+    """Safetensors shards of a diffusers model directory, None if it has none
+
+    Args:
+        checkpoint_dir (str): Directory holding `config.json` and the weights
+        variant (str): Weight variant, e.g. "fp16"
+
+    Returns:
+        list[str]: Shard paths in index order
+    """
+    name = f"{WEIGHTS_NAME}.{variant}" if variant else WEIGHTS_NAME
+    index_path = os.path.join(checkpoint_dir, f"{name}.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            weight_map = json.load(f)["weight_map"]
+        return [os.path.join(checkpoint_dir, shard) for shard in sorted(set(weight_map.values()))]
+    single_path = os.path.join(checkpoint_dir, f"{name}.safetensors")
+    if os.path.exists(single_path):
+        return [single_path]
+    return None
+
+
+def checkpoint_keys(files):
+    """Tensor names stored in the shards, read from the headers only"""
+    from safetensors import safe_open
+
+    keys = set()
+    for path in files:
+        with safe_open(path, framework="pt", device="cpu") as f:
+            keys.update(f.keys())
+    return keys
+
+
+def iter_tensors(files):
+    """Yield `(name, tensor)` one tensor at a time from memory-mapped shards"""
+    from safetensors import safe_open
+
+    for path in files:
+        with safe_open(path, framework="pt", device="cpu") as f:
+            for key in f.keys():
+                yield key, f.get_tensor(key)
+
+
+def stream_into(model, files, dtype=None, device="cpu", key_map=None):
+    """Load shard tensors straight into the parameters and buffers of a model built on the meta device
+
+    Only one source tensor is resident besides the model at any time.
+
+    Args:
+        model (nn.Module): Target model, typically created under `accelerate.init_empty_weights`
+        files (list[str]): Safetensors shards
+        dtype (torch.dtype): Dtype of the floating point tensors, None to keep the stored dtype
+        device (str): Device the tensors are placed on
+        key_map (callable): Maps a stored name to the list of target names, defaults to the name itself
+
+    Returns:
+        set[str]: Target names that were loaded
+    """
+    from accelerate.utils import set_module_tensor_to_device
+
+    expected = set(model.state_dict().keys())
+    loaded = set()
+    for key, tensor in iter_tensors(files):
+        if dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        targets = [name for name in (key_map(key) if key_map is not None else [key]) if name in expected]
+        for n, name in enumerate(targets):
+            # every target owns its storage, the tracking copies are trained independently
+            value = tensor if n == 0 else tensor.clone()
+            # an explicit dtype keeps accelerate from casting to the dtype of the meta tensor
+            set_module_tensor_to_device(model, name, device, value=value, dtype=value.dtype)
+            loaded.add(name)
+        del tensor
+    return loaded
+
+
+def tracking_copy_key_map(num_tracking_blocks):
+    """Key map that also loads `transformer_blocks.i.*` into `transformer_blocks_copy.i.*` for the first blocks"""
+
+    def key_map(key):
+        match = _MAIN_BLOCK.match(key)
+        if match is not None and int(match.group(1)) < num_tracking_blocks:
+            return [key, f"transformer_blocks_copy.{match.group(1)}.{match.group(2)}"]
+        return [key]
+
+    return key_map
+
+
+def materialize_meta(model, names, device="cpu", dtype=None):
+    """Allocate zero tensors for the meta parameters and buffers in `names`"""
+    from accelerate.utils import set_module_tensor_to_device
+
+    state = dict(model.named_parameters())
+    state.update(model.named_buffers())
+    for name in names:
+        tensor = state[name]
+        target_dtype = dtype if dtype is not None and tensor.is_floating_point() else tensor.dtype
+        set_module_tensor_to_device(model, name, device, value=torch.zeros(tensor.shape, dtype=target_dtype), dtype=target_dtype)
+
+
+def meta_tensor_names(model):
+    """Names of parameters and buffers still on the meta device"""
+    tensors = list(model.named_parameters()) + list(model.named_buffers())
+    return [name for name, tensor in tensors if tensor.is_meta]
+
+
+DELTA_MANIFEST = "delta_manifest.json"
+DELTA_WEIGHTS = "tracking_delta.safetensors"
+DELTA_FORMAT = "das-tracking-delta"
+DELTA_VERSION = 1
+
+
+def read_delta_manifest(checkpoint_dir):
+    """Manifest of a delta checkpoint directory, None for full checkpoints"""
+    path = os.path.join(checkpoint_dir, DELTA_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != DELTA_FORMAT or manifest.get("version", 0) > DELTA_VERSION:
+        raise ValueError(f"Unsupported delta checkpoint {checkpoint_dir}: {manifest.get('format')} v{manifest.get('version')}")
+    return manifest
+
+
+def write_delta(save_directory, tensors, manifest):
+    """Write the delta tensors and the manifest pointing at their base model
+
+    Args:
+        save_directory (str): Target directory
+        tensors (dict[str, torch.Tensor]): Tensors to store
+        manifest (dict): Base model and config entries, completed with the format fields
+    """
+    from safetensors.torch import save_file
+
+    os.makedirs(save_directory, exist_ok=True)
+    tensors = {name: t.detach().cpu().contiguous() for name, t in tensors.items()}
+    weights_path = os.path.join(save_directory, DELTA_WEIGHTS)
+    save_file(tensors, f"{weights_path}.tmp", metadata={"format": DELTA_FORMAT})
+    os.replace(f"{weights_path}.tmp", weights_path)
+    manifest = {"format": DELTA_FORMAT, "version": DELTA_VERSION, "weights": DELTA_WEIGHTS, **manifest}
+    with open(os.path.join(save_directory, DELTA_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_delta_into(model, checkpoint_dir, manifest):
+    """Copy the delta tensors into the existing parameters of `model` in place
+
+    The tensors are read straight to the device of their parameter, so switching deltas on a resident model
+    only moves the tracking branch and keeps references to the parameters (e.g. compiled graphs) valid.
+
+    Returns:
+        int: Number of tensors loaded
+    """
+    from safetensors import safe_open
+
+    state = model.state_dict(keep_vars=True)
+    path = os.path.join(checkpoint_dir, manifest.get("weights", DELTA_WEIGHTS))
+    devices = {}
+    for name, tensor in state.items():
+        devices.setdefault(str(tensor.device), []).append(name)
+    with safe_open(path, framework="pt", device="cpu") as f:
+        keys = set(f.keys())
+    unknown = keys - set(state)
+    if unknown:
+        raise ValueError(f"Delta {checkpoint_dir} has tensors the model lacks: {sorted(unknown)[:8]}")
+    with torch.no_grad():
+        for device, names in devices.items():
+            wanted = [name for name in names if name in keys]
+            if not wanted:
+                continue
+            with safe_open(path, framework="pt", device=device) as f:
+                for name in wanted:
+                    state[name].copy_(f.get_tensor(name))
+    return len(keys)
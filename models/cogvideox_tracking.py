@@ -1,3 +1,4 @@
+from contextlib import contextmanager, nullcontext
 from typing import Any, Dict, Optional, Tuple, Union, List, Callable
 
 import torch, os, math
@@ -20,8 +21,30 @@ from diffusers.schedulers import CogVideoXDDIMScheduler, CogVideoXDPMScheduler
 from diffusers.pipelines import DiffusionPipeline   
 from diffusers.models.modeling_utils import ModelMixin
 
+from models.batching import activation_budget_bytes, needs_sequential_cfg
+from models.model_cache import pipeline_nbytes
+from models.checkpoint_io import (
+    checkpoint_keys,
+    load_delta_into,
+    materialize_meta,
+    meta_tensor_names,
+    read_delta_manifest,
+    safetensors_files,
+    write_delta,
+    stream_into,
+    tracking_copy_key_map,
+)
+from models.prompt_cache import PromptCacheMixin
+from models.profiling import HostSyncCounter
+from models.quantization import DEFAULT_EXCLUDE, quantize_linears
+from models.token_reduction import pool_rotary_emb, pool_tokens, unpool_tokens
+from models.feature_cache import BlockResidualCache, TrackingBranchCache
+
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
+# Parameters trained by DaS; everything else comes frozen from the base CogVideoX transformer
+TRACKING_BRANCH_PREFIXES = ("initial_combine_linear.", "combine_linears.", "transformer_blocks_copy.")
+
 class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixin):
     """
     Add tracking maps to the CogVideoX transformer model.
@@ -59,6 +82,8 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         temporal_interpolation_scale: float = 1.0,
         use_rotary_positional_embeddings: bool = False,
         use_learned_positional_embeddings: bool = False,
+        tracking_token_stride: int = 1,
+        quantization: Optional[Dict[str, Any]] = None,
         **kwargs
     ):
         super().__init__(
@@ -92,6 +117,7 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
 
         inner_dim = num_attention_heads * attention_head_dim
         self.num_tracking_blocks = num_tracking_blocks
+        self.set_tracking_token_stride(tracking_token_stride)
 
         # Ensure num_tracking_blocks is not greater than num_layers
         if num_tracking_blocks > num_layers:
@@ -120,7 +146,7 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
                     attention_bias=self.config.attention_bias,
                     norm_elementwise_affine=self.config.norm_elementwise_affine,
                     norm_eps=self.config.norm_eps,
-                ).to_empty(device="cpu")
+                )
                 for _ in range(num_tracking_blocks)
             ]
         )
@@ -146,6 +172,115 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         for param in self.initial_combine_linear.parameters():
             param.requires_grad = True
 
+        # Opt-in reuse of features across denoising steps, see `enable_tracking_cache` and `enable_block_cache`
+        self.tracking_cache = None
+        self.block_cache = None
+
+        # A quantized checkpoint rebuilds its quantized layers empty so that the state dict loads into them
+        self.quantization = None
+        if quantization is not None:
+            self.quantization = quantize_linears(
+                self,
+                bits=quantization["bits"],
+                group_size=quantization["group_size"],
+                modules=quantization["modules"],
+                convert_weights=False,
+            )
+
+    def quantize(
+        self,
+        bits: int = 8,
+        group_size: Optional[int] = 128,
+        include: Optional[Tuple[str, ...]] = None,
+        exclude: Tuple[str, ...] = DEFAULT_EXCLUDE,
+    ):
+        """
+        Convert the linear layers to weight-only int8 / int4 with on-the-fly dequantization, in place.
+
+        `combine_linears`, `initial_combine_linear`, the norms and the embedding / output projections stay in the
+        checkpoint dtype by default. `save_pretrained` stores the quantized weights and `from_pretrained` loads them
+        back without requantizing.
+
+        Args:
+            bits (`int`): 8 or 4 (two values per byte).
+            group_size (`int`, *optional*): Input channels sharing one scale, None for one scale per output channel.
+            include (`Tuple[str]`, *optional*):
+                Module name prefixes to quantize, e.g. `("transformer_blocks.",)` for the main blocks only.
+            exclude (`Tuple[str]`): Module name fragments kept in higher precision.
+        """
+        if self.quantization is not None:
+            raise ValueError("The transformer is already quantized")
+        self.quantization = quantize_linears(self, bits=bits, group_size=group_size, include=include, exclude=exclude)
+        return self
+
+    def set_tracking_token_stride(self, stride: int):
+        """
+        Run the tracking branch on spatially pooled tokens.
+
+        The tracking tokens are average-pooled over `stride` x `stride` latent patches before `transformer_blocks_copy`
+        and every `combine_linears[i]` output is copied back to full resolution before it is added to the hidden
+        states, so attention in the branch costs about `stride ** 4` times less. A stride the checkpoint was not
+        trained with changes the output; fine-tune with `--tracking_token_stride` first. The value is saved with the
+        config.
+
+        Args:
+            stride (`int`): Spatial pooling factor, 1 disables pooling.
+        """
+        if stride < 1:
+            raise ValueError("tracking_token_stride must be at least 1")
+        self.tracking_token_stride = stride
+
+    def enable_tracking_cache(self, interval: Optional[int] = None, threshold: Optional[float] = None):
+        """
+        Reuse the tracking-branch residuals of a previous denoising step during inference.
+
+        Args:
+            interval (`int`, *optional*):
+                Recompute the tracking branch every `interval` steps.
+            threshold (`float`, *optional*):
+                Recompute when the time embedding changed by more than `threshold` (relative mean absolute change)
+                since the last recompute.
+        """
+        self.tracking_cache = TrackingBranchCache(interval=interval, threshold=threshold)
+        return self.tracking_cache
+
+    def disable_tracking_cache(self):
+        self.tracking_cache = None
+
+    def enable_block_cache(self, threshold: float, rescale_coefficients: Optional[List[float]] = None):
+        """
+        Reuse the residual of the whole block stack on steps whose input barely changed (TeaCache) during inference.
+
+        Args:
+            threshold (`float`):
+                Accumulated relative L1 change of the first block's modulated input below which a step is skipped.
+                Larger values skip more steps at a higher quality cost; 0 disables skipping.
+            rescale_coefficients (`List[float]`, *optional*):
+                Polynomial mapping the raw input change to the expected output change.
+        """
+        self.block_cache = BlockResidualCache(threshold=threshold, rescale_coefficients=rescale_coefficients)
+        return self.block_cache
+
+    def disable_block_cache(self):
+        self.block_cache = None
+
+    def reset_feature_caches(self, num_steps: Optional[int] = None):
+        """Drop features cached from a previous generation, called by the pipelines before denoising"""
+        if self.tracking_cache is not None:
+            self.tracking_cache.reset()
+        if self.block_cache is not None:
+            self.block_cache.reset(num_steps)
+
+    @contextmanager
+    def feature_caches_suspended(self):
+        """Evaluate every step in full inside the block, for loops calling the transformer more than once per step"""
+        caches = self.tracking_cache, self.block_cache
+        self.tracking_cache = self.block_cache = None
+        try:
+            yield
+        finally:
+            self.tracking_cache, self.block_cache = caches
+
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -156,6 +291,7 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         image_rotary_emb: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
         attention_kwargs: Optional[Dict[str, Any]] = None,
         return_dict: bool = True,
+        tracking_embeds: Optional[torch.Tensor] = None,
     ):
         if attention_kwargs is not None:
             attention_kwargs = attention_kwargs.copy()
@@ -188,20 +324,92 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         hidden_states = self.patch_embed(encoder_hidden_states, hidden_states)
         hidden_states = self.embedding_dropout(hidden_states)
 
-        # Process tracking maps
-        prompt_embed = encoder_hidden_states.clone()
-        tracking_maps_hidden_states = self.patch_embed(prompt_embed, tracking_maps)
-        tracking_maps_hidden_states = self.embedding_dropout(tracking_maps_hidden_states)
-        del prompt_embed
+        # Process tracking maps, unless their patch embeddings were prepared for the whole generation
+        if tracking_embeds is None:
+            tracking_embeds = self.prepare_tracking_embeds(encoder_hidden_states, tracking_maps)
 
         text_seq_length = encoder_hidden_states.shape[1]
         encoder_hidden_states = hidden_states[:, :text_seq_length]
         hidden_states = hidden_states[:, text_seq_length:]
-        tracking_maps = tracking_maps_hidden_states[:, text_seq_length:]
+        tracking_maps = tracking_embeds
+
+        # Skip the whole block stack when the input barely changed since the last step, see `enable_block_cache`
+        block_cache = self.block_cache if not self.training else None
+        compute_blocks = True
+        if block_cache is not None:
+            modulated_input = self.transformer_blocks[0].norm1(hidden_states, encoder_hidden_states, emb)[0]
+            compute_blocks = block_cache.should_compute(modulated_input)
+
+        if compute_blocks:
+            hidden_states_in, encoder_hidden_states_in = hidden_states, encoder_hidden_states
+            hidden_states, encoder_hidden_states = self._forward_blocks(
+                hidden_states, encoder_hidden_states, tracking_maps, emb, image_rotary_emb,
+                grid=(num_frames, height // self.config.patch_size, width // self.config.patch_size),
+            )
+            if block_cache is not None:
+                block_cache.store(
+                    hidden_states - hidden_states_in,
+                    encoder_hidden_states - encoder_hidden_states_in,
+                    modulated_input.shape,
+                )
+        else:
+            hidden_states = hidden_states + block_cache.residual
+            encoder_hidden_states = encoder_hidden_states + block_cache.encoder_residual
+
+        if block_cache is not None:
+            block_cache.finish_step(compute_blocks)
+
+        if not self.config.use_rotary_positional_embeddings:
+            # CogVideoX-2B
+            hidden_states = self.norm_final(hidden_states)
+        else:
+            # CogVideoX-5B
+            hidden_states = torch.cat([encoder_hidden_states, hidden_states], dim=1)
+            hidden_states = self.norm_final(hidden_states)
+            hidden_states = hidden_states[:, text_seq_length:]
+
+        # 4. Final block
+        hidden_states = self.norm_out(hidden_states, temb=emb)
+        hidden_states = self.proj_out(hidden_states)
+
+        # 5. Unpatchify
+        # Note: we use `-1` instead of `channels`:
+        #   - It is okay to `channels` use for CogVideoX-2b and CogVideoX-5b (number of input channels is equal to output channels)
+        #   - However, for CogVideoX-5b-I2V also takes concatenated input image latents (number of input channels is twice the output channels)
+        p = self.config.patch_size
+        output = hidden_states.reshape(batch_size, num_frames, height // p, width // p, -1, p, p)
+        output = output.permute(0, 1, 4, 2, 5, 3, 6).flatten(5, 6).flatten(3, 4)
+
+        if USE_PEFT_BACKEND:
+            # remove `lora_scale` from each PEFT layer
+            unscale_lora_layers(self, lora_scale)
+
+        if not return_dict:
+            return (output,)
+        return Transformer2DModelOutput(sample=output)
+
+    def _forward_blocks(self, hidden_states, encoder_hidden_states, tracking_maps, emb, image_rotary_emb, grid):
+        """Run the main blocks with the tracking branch mixed in, returns (hidden_states, encoder_hidden_states)
+
+        `grid` is the `(frames, height, width)` layout of the video tokens, used to pool the tracking tokens.
+        """
+        # Decide whether the tracking branch runs this step or its cached residuals are reused
+        tracking_cache = self.tracking_cache if not self.training else None
+        compute_tracking = True
+        if tracking_cache is not None:
+            compute_tracking = tracking_cache.should_recompute(emb, hidden_states.shape)
+            if compute_tracking:
+                tracking_cache.start_compute(emb, hidden_states.shape)
 
         # Combine hidden states and tracking maps initially
-        combined = hidden_states + tracking_maps
-        tracking_maps = self.initial_combine_linear(combined)
+        stride = self.tracking_token_stride
+        tracking_rotary_emb = image_rotary_emb
+        if compute_tracking:
+            combined = hidden_states + tracking_maps
+            tracking_maps = self.initial_combine_linear(combined)
+            if stride > 1:
+                tracking_maps = pool_tokens(tracking_maps, grid, stride)
+                tracking_rotary_emb = pool_rotary_emb(image_rotary_emb, grid, stride)
 
         # Process transformer blocks
         for i in range(len(self.transformer_blocks)):
@@ -229,7 +437,10 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
                     image_rotary_emb=image_rotary_emb,
                 )
             
-            if i < len(self.transformer_blocks_copy):
+            if i < len(self.transformer_blocks_copy) and not compute_tracking:
+                # Reuse the residual of the last step the tracking branch was evaluated at
+                hidden_states = hidden_states + tracking_cache.residuals[i]
+            elif i < len(self.transformer_blocks_copy):
                 if self.training and self.gradient_checkpointing:
                     # Gradient checkpointing logic for tracking maps
                     tracking_maps, _ = torch.utils.checkpoint.checkpoint(
@@ -237,7 +448,7 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
                         tracking_maps,
                         encoder_hidden_states,
                         emb,
-                        image_rotary_emb,
+                        tracking_rotary_emb,
                         **ckpt_kwargs,
                     )
                 else:
@@ -245,45 +456,102 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
                         hidden_states=tracking_maps,
                         encoder_hidden_states=encoder_hidden_states,
                         temb=emb,
-                        image_rotary_emb=image_rotary_emb,
+                        image_rotary_emb=tracking_rotary_emb,
                     )
                 
                 # Combine hidden states and tracking maps
                 tracking_maps = self.combine_linears[i](tracking_maps)
-                hidden_states = hidden_states + tracking_maps
-                
+                residual = unpool_tokens(tracking_maps, grid, stride) if stride > 1 else tracking_maps
+                hidden_states = hidden_states + residual
+                if tracking_cache is not None:
+                    tracking_cache.store(residual)
 
-        if not self.config.use_rotary_positional_embeddings:
-            # CogVideoX-2B
-            hidden_states = self.norm_final(hidden_states)
-        else:
-            # CogVideoX-5B
-            hidden_states = torch.cat([encoder_hidden_states, hidden_states], dim=1)
-            hidden_states = self.norm_final(hidden_states)
-            hidden_states = hidden_states[:, text_seq_length:]
+        if tracking_cache is not None:
+            tracking_cache.finish_step(compute_tracking, len(self.transformer_blocks_copy))
 
-        # 4. Final block
-        hidden_states = self.norm_out(hidden_states, temb=emb)
-        hidden_states = self.proj_out(hidden_states)
+        return hidden_states, encoder_hidden_states
 
-        # 5. Unpatchify
-        # Note: we use `-1` instead of `channels`:
-        #   - It is okay to `channels` use for CogVideoX-2b and CogVideoX-5b (number of input channels is equal to output channels)
-        #   - However, for CogVideoX-5b-I2V also takes concatenated input image latents (number of input channels is twice the output channels)
-        p = self.config.patch_size
-        output = hidden_states.reshape(batch_size, num_frames, height // p, width // p, -1, p, p)
-        output = output.permute(0, 1, 4, 2, 5, 3, 6).flatten(5, 6).flatten(3, 4)
+    def prepare_tracking_embeds(self, encoder_hidden_states: torch.Tensor, tracking_maps: torch.Tensor) -> torch.Tensor:
+        """
+        Patch-embed the tracking maps.
 
-        if USE_PEFT_BACKEND:
-            # remove `lora_scale` from each PEFT layer
-            unscale_lora_layers(self, lora_scale)
+        The result only depends on the tracking latents, so pipelines compute it once per generation and pass it to
+        `forward` as `tracking_embeds` instead of re-embedding the same tracking maps at every denoising step.
 
-        if not return_dict:
-            return (output,)
-        return Transformer2DModelOutput(sample=output)
+        Args:
+            encoder_hidden_states (`torch.Tensor`): Prompt embeddings `[B, L, D_text]`, only used for their length.
+            tracking_maps (`torch.Tensor`): Tracking latents `[B, F, C, H, W]`.
+
+        Returns:
+            `torch.Tensor`: Tracking tokens `[B, N, D]` without the text tokens.
+        """
+        text_seq_length = encoder_hidden_states.shape[1]
+        tracking_maps_hidden_states = self.patch_embed(encoder_hidden_states, tracking_maps)
+        tracking_maps_hidden_states = self.embedding_dropout(tracking_maps_hidden_states)
+        return tracking_maps_hidden_states[:, text_seq_length:]
+
+    _STREAMING_KWARGS = {"subfolder", "torch_dtype", "variant", "revision", "num_tracking_blocks", "tracking_token_stride"}
+
+    def _set_trainable_parameters(self):
+        """Freeze everything except the tracking branch"""
+        for param in self.parameters():
+            param.requires_grad = False
+        for module in [self.initial_combine_linear, *self.combine_linears, *self.transformer_blocks_copy]:
+            for param in module.parameters():
+                param.requires_grad = True
+
+    @classmethod
+    def _from_safetensors_streaming(cls, checkpoint_dir, files, torch_dtype=None, **config_overrides):
+        """
+        Build the model on the meta device and stream every tensor from the safetensors shards into it.
+
+        Works for DaS checkpoints and for plain CogVideoX transformers; for the latter the first `num_tracking_blocks`
+        main blocks are also loaded into `transformer_blocks_copy` from the same source tensors and the combine
+        linears are created at zero. Peak memory is one model plus one tensor instead of two full models.
+        """
+        from accelerate import init_empty_weights
+
+        dtype = torch_dtype or torch.float32
+        config = cls.load_config(checkpoint_dir)
+        with init_empty_weights():
+            model = cls.from_config(config, **config_overrides)
+
+        convert = not any(key.startswith("transformer_blocks_copy.") for key in checkpoint_keys(files))
+        key_map = tracking_copy_key_map(model.num_tracking_blocks) if convert else None
+        stream_into(model, files, dtype=dtype, key_map=key_map)
+
+        missing = meta_tensor_names(model)
+        zero_init = [name for name in missing if name.startswith(("initial_combine_linear.", "combine_linears."))]
+        if len(zero_init) != len(missing) or (zero_init and not convert):
+            raise ValueError(f"Checkpoint {checkpoint_dir} is missing {sorted(set(missing) - set(zero_init))[:8]}")
+        materialize_meta(model, zero_init, dtype=dtype)
+
+        model._set_trainable_parameters()
+        model.eval()
+        print(f"{'Converted CogVideoX' if convert else 'Loaded DiffusionAsShader'} checkpoint by streaming safetensors.")
+        return model
 
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path: Optional[Union[str, os.PathLike]], **kwargs):
+        # Local safetensors checkpoints are streamed into a meta-initialized model, see `_from_safetensors_streaming`
+        stream_weights = kwargs.pop("stream_weights", True)
+        checkpoint_dir = os.path.join(str(pretrained_model_name_or_path), kwargs.get("subfolder") or "")
+        # Delta checkpoints load their base model and apply the tracking branch on top, see `save_delta`
+        manifest = read_delta_manifest(checkpoint_dir) if os.path.isdir(checkpoint_dir) else None
+        if manifest is not None:
+            base_kwargs = {k: v for k, v in kwargs.items() if k not in ("subfolder", "variant")}
+            base_kwargs["num_tracking_blocks"] = manifest["num_tracking_blocks"]
+            model = cls.from_pretrained(
+                manifest["base_model"], subfolder=manifest["base_subfolder"], stream_weights=stream_weights, **base_kwargs
+            )
+            print(f"Applying tracking delta {checkpoint_dir} to {manifest['base_model']}.")
+            return model.load_delta(checkpoint_dir)
+
+        files = safetensors_files(checkpoint_dir, kwargs.get("variant")) if os.path.isdir(checkpoint_dir) else None
+        if stream_weights and files and set(kwargs) <= cls._STREAMING_KWARGS:
+            overrides = {k: kwargs[k] for k in ("num_tracking_blocks", "tracking_token_stride") if k in kwargs}
+            return cls._from_safetensors_streaming(checkpoint_dir, files, kwargs.get("torch_dtype"), **overrides)
+
         try:
             model = super().from_pretrained(pretrained_model_name_or_path, **kwargs)
             print("Loaded DiffusionAsShader checkpoint directly.")
@@ -307,11 +575,13 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         except Exception as e:
             print(f"Failed to load as DiffusionAsShader: {e}")
             print("Attempting to load as CogVideoXTransformer3DModel and convert...")
+            tracking_token_stride = kwargs.pop("tracking_token_stride", 1)
 
             base_model = CogVideoXTransformer3DModel.from_pretrained(pretrained_model_name_or_path, **kwargs)
             
             config = dict(base_model.config)
             config["num_tracking_blocks"] = kwargs.pop("num_tracking_blocks", 18)
+            config["tracking_token_stride"] = tracking_token_stride
             
             model = cls(**config)
             model.load_state_dict(base_model.state_dict(), strict=False)
@@ -366,18 +636,169 @@ class CogVideoXTransformer3DModelTracking(CogVideoXTransformer3DModel, ModelMixi
         )
         
         if is_main_process:
-            config_dict = dict(self.config)
-            config_dict.pop("_name_or_path", None)
-            config_dict.pop("_use_default_values", None)
-            config_dict["_class_name"] = "CogVideoXTransformer3DModelTracking"
-            config_dict["num_tracking_blocks"] = self.num_tracking_blocks
-            
-            os.makedirs(save_directory, exist_ok=True)
-            with open(os.path.join(save_directory, "config.json"), "w", encoding="utf-8") as f:
-                import json
-                json.dump(config_dict, f, indent=2)
+            self._save_tracking_config(save_directory)
+
+    def _save_tracking_config(self, save_directory: Union[str, os.PathLike]):
+        # `config.json` with the tracking-specific entries that the base config does not register
+        config_dict = dict(self.config)
+        config_dict.pop("_name_or_path", None)
+        config_dict.pop("_use_default_values", None)
+        config_dict["_class_name"] = "CogVideoXTransformer3DModelTracking"
+        config_dict["num_tracking_blocks"] = self.num_tracking_blocks
+        config_dict["tracking_token_stride"] = self.tracking_token_stride
+        config_dict["quantization"] = self.quantization
+
+        os.makedirs(save_directory, exist_ok=True)
+        with open(os.path.join(save_directory, "config.json"), "w", encoding="utf-8") as f:
+            import json
+            json.dump(config_dict, f, indent=2)
+
+    def tracking_state_dict(self) -> Dict[str, torch.Tensor]:
+        """State dict of the trainable tracking branch: `initial_combine_linear`, `combine_linears`, `transformer_blocks_copy`"""
+        return {name: tensor for name, tensor in self.state_dict().items() if name.startswith(TRACKING_BRANCH_PREFIXES)}
+
+    def save_delta(
+        self,
+        save_directory: Union[str, os.PathLike],
+        base_model_name_or_path: Union[str, os.PathLike],
+        base_subfolder: Optional[str] = "transformer",
+        is_main_process: bool = True,
+    ):
+        """
+        Save only the tracking branch, with a manifest pointing at the base CogVideoX (or DaS) transformer.
+
+        The main blocks are frozen during training, so the base checkpoint provides them; a delta is about 40% of a
+        full checkpoint. `from_pretrained` composes base + delta, `load_delta` swaps deltas on a loaded model.
+
+        Args:
+            save_directory (`str`): Directory to write `config.json`, the delta weights and `delta_manifest.json` to.
+            base_model_name_or_path (`str`): Model the frozen weights are loaded from, local directories are stored
+                as absolute paths.
+            base_subfolder (`str`, *optional*): Subfolder of the transformer in `base_model_name_or_path`.
+            is_main_process (`bool`): Only the main process writes.
+        """
+        if self.quantization is not None:
+            raise ValueError("Delta checkpoints of quantized transformers are not supported, save the full model")
+        if not is_main_process:
+            return
+        if os.path.isdir(base_model_name_or_path):
+            base_model_name_or_path = os.path.abspath(base_model_name_or_path)
+        write_delta(
+            save_directory,
+            self.tracking_state_dict(),
+            {
+                "base_model": str(base_model_name_or_path),
+                "base_subfolder": base_subfolder,
+                "num_tracking_blocks": self.num_tracking_blocks,
+                "tracking_token_stride": self.tracking_token_stride,
+            },
+        )
+        self._save_tracking_config(save_directory)
+
+    def load_delta(self, delta_directory: Union[str, os.PathLike]):
+        """
+        Replace the tracking branch with the one of a delta checkpoint, in place.
+
+        Only the tracking tensors are read, directly to the device of the model, so switching between DaS deltas on
+        one resident base model costs a fraction of a full load and keeps compiled graphs valid.
+        """
+        manifest = read_delta_manifest(delta_directory)
+        if manifest is None:
+            raise ValueError(f"{delta_directory} is not a delta checkpoint")
+        if manifest["num_tracking_blocks"] != self.num_tracking_blocks:
+            raise ValueError(
+                f"Delta has {manifest['num_tracking_blocks']} tracking blocks, the model {self.num_tracking_blocks}"
+            )
+        load_delta_into(self, delta_directory, manifest)
+        self.set_tracking_token_stride(manifest.get("tracking_token_stride", 1))
+        return self
+
+def guidance_schedule(timesteps, num_inference_steps, guidance_scale, use_dynamic_cfg):
+    """Guidance scale of every denoising step, computed up front
+
+    The timesteps are copied to the host once here, so the loop never calls `t.item()`.
+
+    Returns:
+        list[float]: One guidance scale per timestep
+    """
+    if not use_dynamic_cfg:
+        return [float(guidance_scale)] * len(timesteps)
+    t = timesteps.detach().to("cpu", torch.float64)
+    scales = 1 + guidance_scale * ((1 - torch.cos(math.pi * ((num_inference_steps - t) / num_inference_steps) ** 5.0)) / 2)
+    return scales.tolist()
+
+
+def cfg_forward(transformer, sequential, hidden_states, encoder_hidden_states, timestep, tracking_embeds, **kwargs):
+    """Predict noise for a CFG-doubled batch `[uncond, cond]`
+
+    With `sequential` the unconditional and conditional halves run as two transformer passes, which halves the
+    activation memory of the step. No op of the transformer mixes samples, so with batch-invariant kernels
+    (deterministic CPU execution) the result is bitwise identical to the batched pass, see testing/cfg_equivalence.py.
+
+    Returns:
+        torch.Tensor: Noise prediction of the whole batch in float32
+    """
+    if not sequential:
+        return transformer(
+            hidden_states=hidden_states,
+            encoder_hidden_states=encoder_hidden_states,
+            timestep=timestep,
+            tracking_maps=None,
+            tracking_embeds=tracking_embeds,
+            return_dict=False,
+            **kwargs,
+        )[0].float()
+    halves = []
+    for half in range(2):
+        halves.append(transformer(
+            hidden_states=hidden_states.chunk(2)[half],
+            encoder_hidden_states=encoder_hidden_states.chunk(2)[half],
+            timestep=timestep.chunk(2)[half],
+            tracking_maps=None,
+            tracking_embeds=tracking_embeds.chunk(2)[half] if tracking_embeds is not None else None,
+            return_dict=False,
+            **kwargs,
+        )[0].float())
+    return torch.cat(halves)
+
 
-class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
+def cfg_step_plan(timesteps, guidance_interval=None, uncond_interval=1):
+    """Transformer passes of every denoising step under classifier-free guidance, computed up front
+
+    Args:
+        timesteps (torch.Tensor): Denoising timesteps
+        guidance_interval (tuple[float, float]): Timestep range `(low, high)` guidance is applied in, None for all steps
+        uncond_interval (int): Inside the interval, evaluate the unconditional branch every `uncond_interval` steps
+
+    Returns:
+        list[str]: Per step, "full" for the batched cond + uncond pass, "reuse" for a conditional pass that reuses
+            the last guidance difference, "cond" for a conditional pass without guidance
+    """
+    if uncond_interval < 1:
+        raise ValueError("uncond_interval must be at least 1")
+    if guidance_interval is not None and guidance_interval[0] > guidance_interval[1]:
+        raise ValueError(f"guidance_interval must be (low, high), got {guidance_interval}")
+    plan = []
+    steps_since_uncond = None
+    for t in timesteps.detach().to("cpu").tolist():
+        if guidance_interval is not None and not guidance_interval[0] <= t <= guidance_interval[1]:
+            # the difference of an earlier interval is stale once guidance resumes
+            plan.append("cond")
+            steps_since_uncond = None
+        elif steps_since_uncond is None or steps_since_uncond + 1 >= uncond_interval:
+            plan.append("full")
+            steps_since_uncond = 0
+        else:
+            plan.append("reuse")
+            steps_since_uncond += 1
+    return plan
+
+
+class CogVideoXPipelineTracking(PromptCacheMixin, CogVideoXPipeline, DiffusionPipeline):
+
+    # Set to True to record the host synchronizations of every denoising step in `host_syncs_per_step`
+    count_host_syncs = False
+    host_syncs_per_step = None
 
     def __init__(
         self,
@@ -487,15 +908,22 @@ class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
         )
 
         num_warmup_steps = max(len(timesteps) - num_inference_steps * self.scheduler.order, 0)
+        guidance_scales = guidance_schedule(timesteps, num_inference_steps, guidance_scale, use_dynamic_cfg)
+        self.transformer.reset_feature_caches(len(timesteps))
+
+        # Step-invariant conditioning, built once for all denoising steps
+        tracking_maps_latent = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
+        tracking_embeds = self.transformer.prepare_tracking_embeds(prompt_embeds, tracking_maps_latent)
+        del tracking_maps_latent
 
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        with self.progress_bar(total=num_inference_steps) as progress_bar, \
+                HostSyncCounter(enabled=self.count_host_syncs) as sync_counter:
             old_pred_original_sample = None
             for i, t in enumerate(timesteps):
                 if self.interrupt:
                     continue
 
                 latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                tracking_maps_latent = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
                 latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
 
                 timestep = t.expand(latent_model_input.shape[0])
@@ -506,15 +934,13 @@ class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
                     timestep=timestep,
                     image_rotary_emb=image_rotary_emb,
                     attention_kwargs=attention_kwargs,
-                    tracking_maps=tracking_maps_latent,
+                    tracking_maps=None,
+                    tracking_embeds=tracking_embeds,
                     return_dict=False,
                 )[0]
                 noise_pred = noise_pred.float()
 
-                if use_dynamic_cfg:
-                    self._guidance_scale = 1 + guidance_scale * (
-                        (1 - math.cos(math.pi * ((num_inference_steps - t.item()) / num_inference_steps) ** 5.0)) / 2
-                    )
+                self._guidance_scale = guidance_scales[i]
                 if do_classifier_free_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
@@ -534,9 +960,12 @@ class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
                 latents = latents.to(prompt_embeds.dtype)
 
                 if callback_on_step_end is not None:
-                    callback_kwargs = {}
-                    for k in callback_on_step_end_tensor_inputs:
-                        callback_kwargs[k] = locals()[k]
+                    step_state = {
+                        "latents": latents,
+                        "prompt_embeds": prompt_embeds,
+                        "negative_prompt_embeds": negative_prompt_embeds,
+                    }
+                    callback_kwargs = {k: step_state[k] for k in callback_on_step_end_tensor_inputs}
                     callback_outputs = callback_on_step_end(self, i, t, callback_kwargs)
 
                     latents = callback_outputs.pop("latents", latents)
@@ -545,6 +974,9 @@ class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
 
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
+                sync_counter.step()
+
+        self.host_syncs_per_step = sync_counter.per_step if self.count_host_syncs else None
 
         if not output_type == "latent":
             video = self.decode_latents(latents)
@@ -558,7 +990,11 @@ class CogVideoXPipelineTracking(CogVideoXPipeline, DiffusionPipeline):
             return (video,)
         return CogVideoXPipelineOutput(frames=video)
 
-class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, DiffusionPipeline):
+class CogVideoXImageToVideoPipelineTracking(PromptCacheMixin, CogVideoXImageToVideoPipeline, DiffusionPipeline):
+
+    # Set to True to record the host synchronizations of every denoising step in `host_syncs_per_step`
+    count_host_syncs = False
+    host_syncs_per_step = None
 
     def __init__(
         self,
@@ -605,9 +1041,23 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
         max_sequence_length: int = 226,
         tracking_maps: Optional[torch.Tensor] = None,
         tracking_image: Optional[torch.Tensor] = None,
+        guidance_interval: Optional[Tuple[float, float]] = None,
+        uncond_interval: int = 1,
+        sequential_cfg: Optional[bool] = None,
+        memory_budget_gb: Optional[float] = None,
     ) -> Union[CogVideoXPipelineOutput, Tuple]:
         # Most of the implementation remains the same as the parent class
         # We will modify the parts that need to handle tracking_maps
+        #
+        # `guidance_interval=(low, high)` applies classifier-free guidance only to timesteps in [low, high]; outside
+        # it the conditional pass runs alone at half the transformer batch. `uncond_interval=k` evaluates the
+        # unconditional pass on every k-th guided step only and, in between, extrapolates the guided prediction
+        # from the conditional one with the last measured difference `noise_pred_text - noise_pred_uncond`.
+        # The defaults run the batched pass on every step.
+        #
+        # `sequential_cfg=True` runs the unconditional and conditional halves of a guided step as two transformer
+        # passes instead of one doubled batch; None decides from the activation memory left in `memory_budget_gb`
+        # (device memory in GB, the resident weights of this pipeline included) or in the free device memory.
 
         # 1. Check inputs and set default values
         self.check_inputs(
@@ -651,7 +1101,7 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
         )
         if do_classifier_free_guidance:
             prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds], dim=0)
-            del negative_prompt_embeds
+            negative_prompt_embeds = None
 
         # 4. Prepare timesteps
         timesteps, num_inference_steps = retrieve_timesteps(self.scheduler, num_inference_steps, device, timesteps)
@@ -707,59 +1157,92 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
             else None
         )
 
-        # 8. Denoising loop
+        # 8. Prepare step-invariant conditioning once: CFG-doubled image latents and tracking patch embeddings
+        # The transformer is placed in the latent dtype here instead of at every step
+        if self.transformer.dtype != prompt_embeds.dtype:
+            self.transformer.to(dtype=prompt_embeds.dtype)
+        latent_image_input = torch.cat([image_latents] * 2) if do_classifier_free_guidance else image_latents
+        if tracking_maps is not None:
+            latents_tracking_image = torch.cat([tracking_image_latents] * 2) if do_classifier_free_guidance else tracking_image_latents
+            tracking_maps_input = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
+            tracking_maps_input = torch.cat([tracking_maps_input, latents_tracking_image], dim=2)
+            tracking_embeds = self.transformer.prepare_tracking_embeds(prompt_embeds, tracking_maps_input)
+            del latents_tracking_image, tracking_maps_input
+        else:
+            tracking_embeds = None
+
+        # Conditional halves for the steps that skip the unconditional pass
+        cfg_plan = cfg_step_plan(timesteps, guidance_interval, uncond_interval) if do_classifier_free_guidance else None
+        if cfg_plan is not None and any(mode != "full" for mode in cfg_plan):
+            prompt_embeds_cond = prompt_embeds.chunk(2)[1]
+            latent_image_cond = latent_image_input.chunk(2)[1]
+            tracking_embeds_cond = tracking_embeds.chunk(2)[1] if tracking_embeds is not None else None
+        guidance_delta = None
+
+        if sequential_cfg is None:
+            resident_bytes = pipeline_nbytes(self) if memory_budget_gb is not None else 0
+            budget_bytes = activation_budget_bytes(device, memory_budget_gb, resident_bytes)
+            sequential_cfg = do_classifier_free_guidance and needs_sequential_cfg(
+                latents.size(3) * self.vae_scale_factor_spatial,
+                latents.size(4) * self.vae_scale_factor_spatial,
+                num_frames,
+                latents.size(0),
+                self.transformer.config,
+                budget_bytes,
+                prompt_embeds.dtype,
+            )
+        if sequential_cfg and (self.transformer.tracking_cache is not None or self.transformer.block_cache is not None):
+            logger.warning("Feature caches expect one transformer call per step and are not used with sequential CFG.")
+        feature_caches = self.transformer.feature_caches_suspended() if sequential_cfg else nullcontext()
+
+        # 9. Denoising loop
         num_warmup_steps = max(len(timesteps) - num_inference_steps * self.scheduler.order, 0)
+        guidance_scales = guidance_schedule(timesteps, num_inference_steps, guidance_scale, use_dynamic_cfg)
+        self.transformer.reset_feature_caches(len(timesteps))
 
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        with self.progress_bar(total=num_inference_steps) as progress_bar, \
+                HostSyncCounter(enabled=self.count_host_syncs) as sync_counter, feature_caches:
             old_pred_original_sample = None
             for i, t in enumerate(timesteps):
                 if self.interrupt:
                     continue
 
-                latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-
-                latent_image_input = torch.cat([image_latents] * 2) if do_classifier_free_guidance else image_latents
-                latent_model_input = torch.cat([latent_model_input, latent_image_input], dim=2)
-                del latent_image_input
-
-                # Handle tracking maps
-                if tracking_maps is not None:
-                    latents_tracking_image = torch.cat([tracking_image_latents] * 2) if do_classifier_free_guidance else tracking_image_latents
-                    tracking_maps_input = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
-                    tracking_maps_input = torch.cat([tracking_maps_input, latents_tracking_image], dim=2)
-                    del latents_tracking_image
+                cfg_mode = cfg_plan[i] if do_classifier_free_guidance else None
+                if cfg_mode is None or cfg_mode == "full":
+                    step_prompt_embeds, step_image_input, step_tracking_embeds = prompt_embeds, latent_image_input, tracking_embeds
                 else:
-                    tracking_maps_input = None
+                    step_prompt_embeds, step_image_input, step_tracking_embeds = prompt_embeds_cond, latent_image_cond, tracking_embeds_cond
+
+                latent_model_input = torch.cat([latents] * 2) if cfg_mode == "full" else latents
+                latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+                latent_model_input = torch.cat([latent_model_input, step_image_input], dim=2)
 
                 # broadcast to batch dimension in a way that's compatible with ONNX/Core ML
                 timestep = t.expand(latent_model_input.shape[0])
 
                 # Predict noise
-                self.transformer.to(dtype=latent_model_input.dtype)
-                noise_pred = self.transformer(
+                noise_pred = cfg_forward(
+                    self.transformer,
+                    sequential_cfg and cfg_mode == "full",
                     hidden_states=latent_model_input,
-                    encoder_hidden_states=prompt_embeds,
+                    encoder_hidden_states=step_prompt_embeds,
                     timestep=timestep,
+                    tracking_embeds=step_tracking_embeds,
                     image_rotary_emb=image_rotary_emb,
                     attention_kwargs=attention_kwargs,
-                    tracking_maps=tracking_maps_input,
-                    return_dict=False,
-                )[0]
+                )
                 del latent_model_input
-                if tracking_maps_input is not None:
-                    del tracking_maps_input
-                noise_pred = noise_pred.float()
 
                 # perform guidance
-                if use_dynamic_cfg:
-                    self._guidance_scale = 1 + guidance_scale * (
-                        (1 - math.cos(math.pi * ((num_inference_steps - t.item()) / num_inference_steps) ** 5.0)) / 2
-                    )
-                if do_classifier_free_guidance:
+                self._guidance_scale = guidance_scales[i]
+                if cfg_mode == "full":
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
+                    if uncond_interval > 1:
+                        guidance_delta = noise_pred_text - noise_pred_uncond
                     del noise_pred_uncond, noise_pred_text
+                elif cfg_mode == "reuse":
+                    noise_pred = noise_pred + (self.guidance_scale - 1) * guidance_delta
 
                 # compute the previous noisy sample x_t -> x_t-1
                 if not isinstance(self.scheduler, CogVideoXDPMScheduler):
@@ -779,9 +1262,12 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
 
                 # call the callback, if provided
                 if callback_on_step_end is not None:
-                    callback_kwargs = {}
-                    for k in callback_on_step_end_tensor_inputs:
-                        callback_kwargs[k] = locals()[k]
+                    step_state = {
+                        "latents": latents,
+                        "prompt_embeds": prompt_embeds,
+                        "negative_prompt_embeds": negative_prompt_embeds,
+                    }
+                    callback_kwargs = {k: step_state[k] for k in callback_on_step_end_tensor_inputs}
                     callback_outputs = callback_on_step_end(self, i, t, callback_kwargs)
 
                     latents = callback_outputs.pop("latents", latents)
@@ -790,8 +1276,11 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
 
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
+                sync_counter.step()
 
-        # 9. Post-processing
+        self.host_syncs_per_step = sync_counter.per_step if self.count_host_syncs else None
+
+        # 10. Post-processing
         if not output_type == "latent":
             video = self.decode_latents(latents)
             video = self.video_processor.postprocess_video(video=video, output_type=output_type)
@@ -806,7 +1295,11 @@ class CogVideoXImageToVideoPipelineTracking(CogVideoXImageToVideoPipeline, Diffu
 
         return CogVideoXPipelineOutput(frames=video)
 
-class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, DiffusionPipeline):
+class CogVideoXVideoToVideoPipelineTracking(PromptCacheMixin, CogVideoXVideoToVideoPipeline, DiffusionPipeline):
+
+    # Set to True to record the host synchronizations of every denoising step in `host_syncs_per_step`
+    count_host_syncs = False
+    host_syncs_per_step = None
 
     def __init__(
         self,
@@ -937,10 +1430,18 @@ class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, Diffu
             else None
         )
 
-        # 8. Denoising loop
+        # 8. Prepare step-invariant conditioning once
+        tracking_maps_input = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
+        tracking_embeds = self.transformer.prepare_tracking_embeds(prompt_embeds, tracking_maps_input)
+        del tracking_maps_input
+
+        # 9. Denoising loop
         num_warmup_steps = max(len(timesteps) - num_inference_steps * self.scheduler.order, 0)
+        guidance_scales = guidance_schedule(timesteps, num_inference_steps, guidance_scale, use_dynamic_cfg)
+        self.transformer.reset_feature_caches(len(timesteps))
 
-        with self.progress_bar(total=num_inference_steps) as progress_bar:
+        with self.progress_bar(total=num_inference_steps) as progress_bar, \
+                HostSyncCounter(enabled=self.count_host_syncs) as sync_counter:
             # for DPM-solver++
             old_pred_original_sample = None
             for i, t in enumerate(timesteps):
@@ -948,7 +1449,6 @@ class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, Diffu
                     continue
 
                 latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                tracking_maps_input = torch.cat([tracking_maps] * 2) if do_classifier_free_guidance else tracking_maps
                 latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
 
                 # broadcast to batch dimension in a way that's compatible with ONNX/Core ML
@@ -961,16 +1461,14 @@ class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, Diffu
                     timestep=timestep,
                     image_rotary_emb=image_rotary_emb,
                     attention_kwargs=attention_kwargs,
-                    tracking_maps=tracking_maps_input,
+                    tracking_maps=None,
+                    tracking_embeds=tracking_embeds,
                     return_dict=False,
                 )[0]
                 noise_pred = noise_pred.float()
 
                 # perform guidance
-                if use_dynamic_cfg:
-                    self._guidance_scale = 1 + guidance_scale * (
-                        (1 - math.cos(math.pi * ((num_inference_steps - t.item()) / num_inference_steps) ** 5.0)) / 2
-                    )
+                self._guidance_scale = guidance_scales[i]
                 if do_classifier_free_guidance:
                     noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
                     noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
@@ -992,9 +1490,12 @@ class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, Diffu
 
                 # call the callback, if provided
                 if callback_on_step_end is not None:
-                    callback_kwargs = {}
-                    for k in callback_on_step_end_tensor_inputs:
-                        callback_kwargs[k] = locals()[k]
+                    step_state = {
+                        "latents": latents,
+                        "prompt_embeds": prompt_embeds,
+                        "negative_prompt_embeds": negative_prompt_embeds,
+                    }
+                    callback_kwargs = {k: step_state[k] for k in callback_on_step_end_tensor_inputs}
                     callback_outputs = callback_on_step_end(self, i, t, callback_kwargs)
 
                     latents = callback_outputs.pop("latents", latents)
@@ -1003,6 +1504,9 @@ class CogVideoXVideoToVideoPipelineTracking(CogVideoXVideoToVideoPipeline, Diffu
 
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
+                sync_counter.step()
+
+        self.host_syncs_per_step = sync_counter.per_step if self.count_host_syncs else None
 
         if not output_type == "latent":
             video = self.decode_latents(latents)
@@ -0,0 +1,464 @@
+import json
+import os
+import threading
+import time
+
+from models.batching import ACTIVATION_FACTOR, latent_tokens
+
+GIB = 1024 ** 3
+
+# CogVideoX-5B-I2V transformer with the DaS tracking branch
+DEFAULT_TRANSFORMER = {"num_layers": 42, "num_tracking_blocks": 18, "hidden_size": 3072, "patch_size": 2}
+
+# Output pixels of one causal decode chunk: 2 latent frames are decoded at a time, tiles are 240x360 plus overlap
+DECODE_CHUNK_FRAMES = 8
+TILE_PIXELS = 300 * 450
+
+# Defaults before any run is recorded, roughly an 80GB A100/H100 in bfloat16
+DEFAULT_MEMORY_COEFFICIENTS = {
+    "resident": 10.5 * GIB,  # T5 encoder, VAE and the CUDA context
+    "weights": 1.0,  # transformer parameter bytes
+    "activations": 1.0,  # denoising activations, see `models.batching.ACTIVATION_FACTOR`
+    "vae": 2048.0,  # bytes per decoded pixel of one chunk or tile
+}
+DEFAULT_LATENCY_COEFFICIENTS = {
+    "overhead": 5.0,  # seconds per job
+    "transformer": 1.0 / 150e12,  # seconds per transformer FLOP
+    "vae": 2.0e-6,  # seconds per encoded and decoded output pixel
+}
+
+
+class AdmissionError(RuntimeError):
+    """A job is predicted not to fit the device, or to run longer than allowed"""
+
+
+class JobSpec:
+    """Shape of a DaS generation job, everything the cost model needs to know without touching the device"""
+
+    def __init__(self, num_frames=49, height=480, width=720, batch_size=1, guidance=True, num_inference_steps=50,
+                 num_windows=1, num_tracking_blocks=18, num_layers=42, hidden_size=3072, patch_size=2,
+                 vae_tiling=True, vae_slicing=True, sequential_cfg=False, dtype_bytes=2, max_text_seq_length=226):
+        """
+        Args:
+            num_frames (int): Frames of one generated window
+            height (int): Video height
+            width (int): Video width
+            batch_size (int): Videos denoised together
+            guidance (bool): Whether classifier-free guidance doubles the transformer batch
+            num_inference_steps (int): Denoising steps
+            num_windows (int): Windows of a long video, generated one after the other
+            num_tracking_blocks (int): Transformer blocks copied into the tracking branch
+            num_layers (int): Transformer blocks of the main branch
+            hidden_size (int): Attention heads times head dimension
+            patch_size (int): Spatial patch size of the transformer
+            vae_tiling (bool): Whether the VAE encodes and decodes in spatial tiles
+            vae_slicing (bool): Whether the VAE decodes one batch item at a time
+            sequential_cfg (bool): Whether the CFG halves run as two transformer passes
+            dtype_bytes (int): Bytes per element of the computation dtype
+            max_text_seq_length (int): Number of text tokens
+        """
+        self.num_frames = num_frames
+        self.height = height
+        self.width = width
+        self.batch_size = batch_size
+        self.guidance = guidance
+        self.num_inference_steps = num_inference_steps
+        self.num_windows = num_windows
+        self.num_tracking_blocks = num_tracking_blocks
+        self.num_layers = num_layers
+        self.hidden_size = hidden_size
+        self.patch_size = patch_size
+        self.vae_tiling = vae_tiling
+        self.vae_slicing = vae_slicing
+        self.sequential_cfg = sequential_cfg
+        self.dtype_bytes = dtype_bytes
+        self.max_text_seq_length = max_text_seq_length
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, values):
+        known = cls().to_dict()
+        return cls(**{key: value for key, value in values.items() if key in known})
+
+    def replace(self, **changes):
+        """Copy of the spec with some fields changed"""
+        values = self.to_dict()
+        values.update(changes)
+        return JobSpec(**values)
+
+    def tokens(self):
+        """Video and text tokens of one transformer sample"""
+        return latent_tokens(self.height, self.width, self.num_frames, patch_size=self.patch_size) + self.max_text_seq_length
+
+    def __repr__(self):
+        return (f"JobSpec({self.num_frames}x{self.height}x{self.width}, batch={self.batch_size}, "
+                f"steps={self.num_inference_steps}, windows={self.num_windows}, cfg={self.guidance}, "
+                f"sequential_cfg={self.sequential_cfg}, tiling={self.vae_tiling}, slicing={self.vae_slicing})")
+
+
+def read_transformer_config(checkpoint_path):
+    """Transformer shape of a DaS checkpoint from its config file, without loading weights
+
+    Local checkpoints and checkpoints already in the hub cache are read; anything else falls back to
+    `DEFAULT_TRANSFORMER` rather than downloading.
+
+    Returns:
+        dict: num_layers, num_tracking_blocks, hidden_size and patch_size
+    """
+    path = os.path.join(checkpoint_path, "transformer", "config.json")
+    if not os.path.isfile(path):
+        try:
+            from huggingface_hub import try_to_load_from_cache
+
+            path = try_to_load_from_cache(checkpoint_path, "config.json", subfolder="transformer")
+        except ImportError:
+            path = None
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return dict(DEFAULT_TRANSFORMER)
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return {
+        "num_layers": config.get("num_layers", DEFAULT_TRANSFORMER["num_layers"]),
+        "num_tracking_blocks": config.get("num_tracking_blocks", DEFAULT_TRANSFORMER["num_tracking_blocks"]),
+        "hidden_size": config.get("num_attention_heads", 48) * config.get("attention_head_dim", 64),
+        "patch_size": config.get("patch_size", DEFAULT_TRANSFORMER["patch_size"]),
+    }
+
+
+def _fit_multipliers(rows, targets, regularization):
+    """Non-negative multipliers m minimizing the relative error of sum_k m_k * rows[i][k] against targets[i]
+
+    Coordinate descent with a ridge pull towards 1, so terms the recorded runs say little about keep their
+    default coefficient.
+    """
+    num_terms = len(rows[0])
+    multipliers = [1.0] * num_terms
+    weights = [1.0 / target ** 2 for target in targets]
+    for _ in range(200):
+        for k in range(num_terms):
+            numerator, denominator = regularization, regularization
+            for row, target, weight in zip(rows, targets, weights):
+                residual = target - sum(m * x for j, (m, x) in enumerate(zip(multipliers, row)) if j != k)
+                numerator += weight * row[k] * residual
+                denominator += weight * row[k] * row[k]
+            multipliers[k] = max(0.0, numerator / denominator)
+    return multipliers
+
+
+class CostModel:
+    """Predicts the peak device memory and the latency of a `JobSpec`
+
+    Both predictions are sums of analytic terms (resident models, transformer weights, denoising activations,
+    VAE chunks; fixed overhead, transformer FLOPs, VAE pixels) scaled by coefficients that `fit` calibrates
+    against recorded runs. The denoising and VAE terms are summed although the phases do not overlap, which
+    keeps the uncalibrated prediction on the safe side. Plain arithmetic on CPU, no device is queried.
+    """
+
+    def __init__(self, memory_coefficients=None, latency_coefficients=None):
+        self.memory_coefficients = dict(DEFAULT_MEMORY_COEFFICIENTS, **(memory_coefficients or {}))
+        self.latency_coefficients = dict(DEFAULT_LATENCY_COEFFICIENTS, **(latency_coefficients or {}))
+        self.num_records = 0
+
+    @staticmethod
+    def memory_features(spec):
+        """Unscaled memory terms of a job"""
+        blocks = spec.num_layers + spec.num_tracking_blocks
+        # attention and feed-forward weights per block, plus the zero-initialized linears joining the branches
+        parameters = blocks * 12 * spec.hidden_size ** 2 + spec.num_tracking_blocks * spec.hidden_size ** 2
+        copies = 2 if spec.guidance and not spec.sequential_cfg else 1
+        activations = spec.tokens() * spec.hidden_size * spec.dtype_bytes * ACTIVATION_FACTOR * copies * spec.batch_size
+        chunk_pixels = min(spec.height * spec.width, TILE_PIXELS) if spec.vae_tiling else spec.height * spec.width
+        decoded_together = 1 if spec.vae_slicing else spec.batch_size
+        vae = DECODE_CHUNK_FRAMES * chunk_pixels * decoded_together * spec.dtype_bytes
+        return {"resident": 1.0, "weights": parameters * spec.dtype_bytes, "activations": activations, "vae": vae}
+
+    @staticmethod
+    def latency_features(spec):
+        """Unscaled latency terms of a job"""
+        tokens = spec.tokens()
+        blocks = spec.num_layers + spec.num_tracking_blocks
+        passes = spec.batch_size * (2 if spec.guidance else 1)
+        # projections and feed-forward, plus attention scores and values
+        block_flops = 24 * tokens * spec.hidden_size ** 2 + 4 * tokens ** 2 * spec.hidden_size
+        transformer = spec.num_windows * spec.num_inference_steps * passes * blocks * block_flops
+        # tiles overlap by a quarter of their size
+        pixels = spec.num_windows * spec.batch_size * spec.num_frames * spec.height * spec.width
+        vae = pixels * (1.25 if spec.vae_tiling else 1.0)
+        return {"overhead": 1.0, "transformer": transformer, "vae": vae}
+
+    def memory_breakdown(self, spec):
+        """Predicted bytes per memory term"""
+        return {name: self.memory_coefficients[name] * value for name, value in self.memory_features(spec).items()}
+
+    def predict_memory(self, spec):
+        """Predicted peak device memory in bytes"""
+        return int(sum(self.memory_breakdown(spec).values()))
+
+    def predict_latency(self, spec):
+        """Predicted wall time in seconds"""
+        return sum(self.latency_coefficients[name] * value for name, value in self.latency_features(spec).items())
+
+    def fit(self, records, regularization=0.01):
+        """Calibrate the coefficients against recorded runs
+
+        Every term's default coefficient is scaled by a non-negative multiplier fitted to the relative error
+        of the predictions, pulled towards 1 by `regularization`.
+
+        Args:
+            records (list[dict]): Runs as stored by `CalibrationStore.record`
+            regularization (float): Strength of the pull towards the default coefficients
+
+        Returns:
+            CostModel: self
+        """
+        for kind, features_fn, coefficients, target_key in (
+            ("memory", self.memory_features, self.memory_coefficients, "peak_bytes"),
+            ("latency", self.latency_features, self.latency_coefficients, "seconds"),
+        ):
+            defaults = DEFAULT_MEMORY_COEFFICIENTS if kind == "memory" else DEFAULT_LATENCY_COEFFICIENTS
+            rows, targets = [], []
+            for record in records:
+                if record.get(target_key):
+                    features = features_fn(JobSpec.from_dict(record["spec"]))
+                    rows.append([defaults[name] * features[name] for name in defaults])
+                    targets.append(float(record[target_key]))
+            if not rows:
+                continue
+            multipliers = _fit_multipliers(rows, targets, regularization)
+            for name, multiplier in zip(defaults, multipliers):
+                coefficients[name] = defaults[name] * multiplier
+        self.num_records = len(records)
+        return self
+
+    @classmethod
+    def from_store(cls, store, device_name=None):
+        """Cost model calibrated with the runs `store` recorded on `device_name` (all runs if None)"""
+        model = cls()
+        if store is not None:
+            records = store.records(device_name)
+            if records:
+                model.fit(records)
+        return model
+
+
+class CalibrationStore:
+    """Recorded runs (spec, measured peak memory and wall time) in a JSON lines file
+
+    Appends are serialized within the process and every record is a single line, so concurrent jobs and
+    processes sharing the file do not corrupt it.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): JSON lines file, created on the first record
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, spec, peak_bytes=None, seconds=None, device_name=None):
+        """Append a finished run
+
+        Args:
+            spec (JobSpec): What ran, including the down-shifts applied
+            peak_bytes (int): Peak device memory of the run, None if not measured
+            seconds (float): Wall time of the run, None if not measured
+            device_name (str): Device the run was measured on
+        """
+        entry = {
+            "spec": spec.to_dict(),
+            "peak_bytes": int(peak_bytes) if peak_bytes is not None else None,
+            "seconds": float(seconds) if seconds is not None else None,
+            "device": device_name,
+            "time": time.time(),
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def records(self, device_name=None):
+        """Recorded runs, only those measured on `device_name` if given; unreadable lines are skipped"""
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with self._lock, open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if device_name is None or record.get("device") == device_name:
+                    records.append(record)
+        return records
+
+
+class AdmissionDecision:
+    """Outcome of `AdmissionController.plan`
+
+    `action` is "admit" (run `spec` as submitted), "downshift" (run `spec`, which has memory-saving options
+    enabled), "queue" (`spec` fits the device once running jobs release memory) or "reject".
+    """
+
+    def __init__(self, action, spec, peak_bytes, seconds, reason=""):
+        self.action = action
+        self.spec = spec
+        self.peak_bytes = peak_bytes
+        self.seconds = seconds
+        self.reason = reason
+        self.reservation = None  # (shared bytes, per-job bytes) while acquired
+
+    def __repr__(self):
+        return (f"AdmissionDecision({self.action}, peak {self.peak_bytes / GIB:.1f}GB, ~{self.seconds:.0f}s"
+                + (f", {self.reason}" if self.reason else "") + ")")
+
+
+class AdmissionController:
+    """Admits, queues, down-shifts or rejects jobs by their predicted cost, before any model is loaded
+
+    A job that does not fit gets, in order, VAE slicing, VAE tiling and sequential CFG enabled until it does.
+    Resident models and transformer weights are shared by concurrent jobs of one process and counted once,
+    activations and VAE chunks are reserved per job between `acquire` and `release`.
+
+    Example:
+        controller = AdmissionController(CostModel.from_store(store), capacity_bytes=80 * GIB)
+        decision = controller.acquire(spec)
+        try:
+            ...  # run decision.spec
+        finally:
+            controller.release(decision)
+    """
+
+    # memory-saving options in the order they are tried, cheapest in quality and speed first
+    DOWNSHIFTS = ("vae_slicing", "vae_tiling", "sequential_cfg")
+
+    def __init__(self, cost_model, capacity_bytes, max_seconds=None, headroom=0.95):
+        """
+        Args:
+            cost_model (CostModel): Predictor of memory and latency
+            capacity_bytes (int): Device memory jobs may use
+            max_seconds (float): Reject jobs predicted to run longer, None for no limit
+            headroom (float): Fraction of `capacity_bytes` planned with, the rest absorbs fragmentation
+        """
+        self.cost_model = cost_model
+        self.capacity_bytes = int(capacity_bytes * headroom)
+        self.max_seconds = max_seconds
+        self._active = []  # (shared bytes, per-job bytes) of admitted jobs
+        self._cond = threading.Condition()
+        self.counts = {"admit": 0, "downshift": 0, "queue": 0, "reject": 0}
+
+    def _split(self, spec):
+        breakdown = self.cost_model.memory_breakdown(spec)
+        shared = breakdown["resident"] + breakdown["weights"]
+        return shared, breakdown["activations"] + breakdown["vae"]
+
+    def _needed(self, spec, active):
+        shared, job = self._split(spec)
+        return max([shared] + [s for s, _ in active]) + job + sum(j for _, j in active)
+
+    def _candidates(self, spec):
+        yield spec
+        for option in self.DOWNSHIFTS:
+            if getattr(spec, option):
+                continue
+            if option == "vae_slicing" and spec.batch_size == 1:
+                continue
+            if option == "sequential_cfg" and not spec.guidance:
+                continue
+            spec = spec.replace(**{option: True})
+            yield spec
+
+    def plan(self, spec, active=None):
+        """Decide what to do with a job given the jobs running now
+
+        Args:
+            spec (JobSpec): Job as submitted
+            active (list): Reservations of running jobs, defaults to those acquired and not released
+
+        Returns:
+            AdmissionDecision: The decision and the spec to run
+        """
+        active = self._active if active is None else active
+        seconds = self.cost_model.predict_latency(spec)
+        if self.max_seconds is not None and seconds > self.max_seconds:
+            return AdmissionDecision("reject", spec, self.cost_model.predict_memory(spec), seconds,
+                                     f"predicted {seconds:.0f}s exceeds the {self.max_seconds:.0f}s limit")
+        fits_idle = None
+        for candidate in self._candidates(spec):
+            peak = self.cost_model.predict_memory(candidate)
+            seconds = self.cost_model.predict_latency(candidate)
+            if self._needed(candidate, active) <= self.capacity_bytes:
+                action = "admit" if candidate is spec else "downshift"
+                return AdmissionDecision(action, candidate, peak, seconds)
+            if fits_idle is None and self._needed(candidate, []) <= self.capacity_bytes:
+                fits_idle = AdmissionDecision("queue", candidate, peak, seconds, "waiting for running jobs to release memory")
+        if fits_idle is not None:
+            return fits_idle
+        return AdmissionDecision("reject", spec, self.cost_model.predict_memory(spec), self.cost_model.predict_latency(spec),
+                                 f"predicted peak {self.cost_model.predict_memory(spec) / GIB:.1f}GB exceeds the "
+                                 f"{self.capacity_bytes / GIB:.1f}GB device budget even with all down-shifts")
+
+    def acquire(self, spec, timeout=None, on_queue=None):
+        """Reserve memory for a job, waiting while it only fits once running jobs finish
+
+        Args:
+            spec (JobSpec): Job as submitted
+            timeout (float): Seconds to wait in the queue, None to wait as long as it takes
+            on_queue (callable): Called with the decision when the job has to wait
+
+        Returns:
+            AdmissionDecision: "admit" or "downshift" decision, pass it to `release` when the job is done
+
+        Raises:
+            AdmissionError: The job can never fit, or the wait timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            decision = self.plan(spec)
+            if decision.action == "queue":
+                self.counts["queue"] += 1
+                if on_queue is not None:
+                    on_queue(decision)
+            while decision.action == "queue":
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise AdmissionError(f"Timed out after {timeout:.0f}s waiting for device memory")
+                self._cond.wait(remaining)
+                decision = self.plan(spec)
+            self.counts[decision.action] += 1
+            if decision.action == "reject":
+                raise AdmissionError(decision.reason)
+            decision.reservation = self._split(decision.spec)
+            self._active.append(decision.reservation)
+            return decision
+
+    def release(self, decision):
+        """Return the memory reserved by `acquire`"""
+        with self._cond:
+            self._active.remove(decision.reservation)
+            self._cond.notify_all()
+
+    def max_batch_size(self, spec, limit):
+        """Largest batch up to `limit` that is not rejected when running alone
+
+        Returns:
+            Tuple[int, AdmissionDecision]: Batch size and the decision for it, a reject decision if even one item does not fit
+        """
+        batch_size = max(1, limit)
+        while True:
+            decision = self.plan(spec.replace(batch_size=batch_size), active=[])
+            if decision.action != "reject" or batch_size == 1:
+                return batch_size, decision
+            batch_size = max(1, batch_size // 2)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "capacity_gb": self.capacity_bytes / GIB,
+                "reserved_gb": (max(s for s, _ in self._active) + sum(j for _, j in self._active)) / GIB if self._active else 0.0,
+                "active_jobs": len(self._active),
+                "decisions": dict(self.counts),
+                "calibration_runs": self.cost_model.num_records,
+            }
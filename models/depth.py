@@ -0,0 +1,138 @@
+import weakref
+
+import torch
+import torch.nn.functional as F
+import torchvision.transforms.functional as TF
+import numpy as np
+from PIL import Image
+
+# Mean absolute difference allowed between the batched depth of a frame and its per-frame depth image,
+# which is quantized to uint8 and resampled by the preprocessor
+BATCHED_DEPTH_ATOL = 0.02
+
+# depth model -> whether its batched tensor output matched the per-frame depth images
+_batched_support = weakref.WeakKeyDictionary()
+
+
+def _model_device(depth_model):
+    model = getattr(depth_model, "model", depth_model)
+    if isinstance(model, torch.nn.Module):
+        try:
+            return next(model.parameters()).device
+        except StopIteration:
+            pass
+    return None
+
+
+def _to_depth_tensor(output, batch_size):
+    """Bring a batched depth model output to a float tensor of shape [B, 1, H, W]
+
+    Raises:
+        ValueError: The output is not one depth map per frame in a known layout
+    """
+    if isinstance(output, np.ndarray):
+        output = torch.from_numpy(output)
+    if not isinstance(output, torch.Tensor) or output.shape[0] != batch_size:
+        raise ValueError(f"Expected one depth map per frame, got {type(output).__name__} "
+                         f"{tuple(getattr(output, 'shape', ()))} for {batch_size} frames")
+    output = output.float()
+    if output.ndim == 3:
+        return output.unsqueeze(1)
+    if output.ndim == 4 and output.shape[1] == 1:
+        return output
+    if output.ndim == 4 and output.shape[-1] == 1:
+        return output.permute(0, 3, 1, 2)
+    raise ValueError(f"Unknown depth layout {tuple(output.shape)} for {batch_size} frames")
+
+
+def normalize_depth(depth, eps=1e-8):
+    """Min-max normalize every frame of a [T, 1, H, W] depth tensor to [0, 1]"""
+    flat = depth.flatten(1)
+    d_min = flat.min(dim=1).values[:, None, None, None]
+    d_max = flat.max(dim=1).values[:, None, None, None]
+    return (depth - d_min) / (d_max - d_min + eps)
+
+
+def depth_per_frame(depth_model, video):
+    """Depth images of every frame, one PIL call per frame
+
+    Args:
+        depth_model (DepthPreprocessor): Depth estimator called with a PIL image, returning a list of depth images
+        video (torch.Tensor): Video tensor [T, C, H, W] in range [0,1]
+
+    Returns:
+        torch.Tensor: Depth tensor [T, 1, H, W] in range [0,1] on the device of `video`
+    """
+    depths = []
+    for frame in video:
+        frame = (frame.permute(1, 2, 0).float().cpu().numpy() * 255).astype(np.uint8)
+        depth = depth_model(Image.fromarray(frame))[0]
+        depths.append(TF.to_tensor(depth)[:1])  # [1, H, W]
+    return torch.stack(depths, dim=0).to(video.device)
+
+
+def _depth_batched(depth_model, frames, size, normalize):
+    depth = _to_depth_tensor(depth_model(frames, return_type="pt"), frames.shape[0])
+    if depth.shape[-2:] != size:
+        depth = F.interpolate(depth, size=size, mode="bilinear", align_corners=False)
+    return normalize_depth(depth) if normalize else depth
+
+
+def _supports_batched(depth_model, frame, normalize):
+    """Whether the batched call of `depth_model` reproduces its per-frame depth image, checked once per model"""
+    try:
+        return _batched_support[depth_model]
+    except (KeyError, TypeError):
+        pass
+    try:
+        batched = _depth_batched(depth_model, frame[None], tuple(frame.shape[-2:]), normalize).to(frame.device)
+        error = (batched - depth_per_frame(depth_model, frame[None])).abs().mean().item()
+        supported = error <= BATCHED_DEPTH_ATOL
+        reason = f"mean abs diff {error:.3f} to the per-frame depth"
+    except (TypeError, ValueError, RuntimeError) as e:
+        supported, reason = False, str(e)
+    if not supported:
+        print(f"Batched depth estimation unavailable ({reason}), estimating depth frame by frame")
+    try:
+        _batched_support[depth_model] = supported
+    except TypeError:
+        pass
+    return supported
+
+
+@torch.no_grad()
+def estimate_video_depth(depth_model, video, batch_size=8, normalize=True):
+    """Estimate depth for all frames of a video in micro-batches
+
+    The batched tensor call is used only once it has reproduced the per-frame depth image of a frame for this
+    model; otherwise, or if a batched call fails, the frames go through the depth model one PIL image at a time.
+
+    Args:
+        depth_model (DepthPreprocessor): Depth estimator, called with [B, C, H, W] tensors in range [0,1] and
+            `return_type="pt"`, or with one PIL image
+        video (torch.Tensor): Video tensor [T, C, H, W] in range [0,1]
+        batch_size (int): Number of frames per depth model call
+        normalize (bool): Min-max normalize every batched frame to [0,1] like the per-frame depth images
+
+    Returns:
+        torch.Tensor: Depth tensor [T, 1, H, W] on the device of `video`
+    """
+    T, _, H, W = video.shape
+    device = video.device
+    model_device = _model_device(depth_model) or device
+    batch_size = max(1, int(batch_size))
+
+    video = video.float().clamp(0, 1)
+    if not _supports_batched(depth_model, video[0].to(model_device), normalize):
+        return depth_per_frame(depth_model, video)
+
+    depths = []
+    for start in range(0, T, batch_size):
+        frames = video[start:start + batch_size].to(model_device)
+        try:
+            depth = _depth_batched(depth_model, frames, (H, W), normalize)
+        except (TypeError, ValueError, RuntimeError) as e:
+            print(f"Batched depth estimation failed ({e}), estimating depth frame by frame")
+            depth = depth_per_frame(depth_model, frames)
+        depths.append(depth.to(device))
+    return torch.cat(depths, dim=0)
@@ -0,0 +1,151 @@
+import torch
+
+
+def relative_change(current, reference):
+    """Mean absolute change of `current` relative to the mean magnitude of `reference`"""
+    return ((current - reference).abs().mean() / reference.abs().mean().clamp_min(1e-8)).item()
+
+
+class TrackingBranchCache:
+    """Reuse the tracking-branch residuals of CogVideoXTransformer3DModelTracking across denoising steps
+
+    The tracking branch (`transformer_blocks_copy` + `combine_linears`) adds one residual per
+    tracking block to the main hidden states. On a recompute step the residuals are stored;
+    on the other steps the stored residuals are added instead of evaluating the branch.
+
+    A step is recomputed when nothing is cached yet, when the input shape changed, every
+    `interval` steps, or when the time embedding moved by more than `threshold` relative to
+    the step the residuals were computed at. With both unset every step is recomputed.
+    The threshold test reads one scalar back to the host per step.
+
+    The cache holds one hidden-state sized tensor per tracking block.
+    """
+
+    def __init__(self, interval=None, threshold=None):
+        """
+        Args:
+            interval (int): Recompute every `interval` steps
+            threshold (float): Recompute when the relative change of the time embedding exceeds this value
+        """
+        if interval is not None and interval < 1:
+            raise ValueError("interval must be at least 1")
+        self.interval = interval
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        """Forget the cached residuals and counters, called at the start of every generation"""
+        self.skipped_blocks = 0
+        self.computed_blocks = 0
+        self.residuals = []
+        self._reference_emb = None
+        self._shape = None
+        self._steps_since_compute = 0
+
+    def should_recompute(self, emb, hidden_shape):
+        if not self.residuals or tuple(hidden_shape) != self._shape:
+            return True
+        if self.interval is not None and self._steps_since_compute + 1 >= self.interval:
+            return True
+        if self.threshold is not None and relative_change(emb, self._reference_emb) > self.threshold:
+            return True
+        return self.interval is None and self.threshold is None
+
+    def start_compute(self, emb, hidden_shape):
+        self.residuals = []
+        self._reference_emb = emb.detach()
+        self._shape = tuple(hidden_shape)
+        self._steps_since_compute = 0
+
+    def store(self, residual):
+        self.residuals.append(residual)
+
+    def finish_step(self, recomputed, num_blocks):
+        if recomputed:
+            self.computed_blocks += num_blocks
+        else:
+            self.skipped_blocks += num_blocks
+            self._steps_since_compute += 1
+
+    def stats(self):
+        total = self.skipped_blocks + self.computed_blocks
+        return {
+            "skipped_blocks": self.skipped_blocks,
+            "computed_blocks": self.computed_blocks,
+            "skip_ratio": self.skipped_blocks / total if total else 0.0,
+        }
+
+
+class BlockResidualCache:
+    """Skip the whole block stack of CogVideoXTransformer3DModelTracking on steps whose input barely changed
+
+    Following TeaCache, the change of a step's input is estimated from the modulated input of
+    the first block (its norm1 output, which carries the timestep modulation). The relative L1
+    change to the previous step is accumulated; while the sum stays below `threshold` the
+    residual the block stack added on the last computed step is added again instead of running
+    the blocks. Computing a step resets the sum. The first and last steps are always computed.
+    The change test reads one scalar back to the host per step.
+    """
+
+    def __init__(self, threshold, rescale_coefficients=None):
+        """
+        Args:
+            threshold (float): Accumulated relative change below which the block stack is skipped
+            rescale_coefficients (list[float]): Optional polynomial (highest degree first) mapping the
+                raw relative change to the expected change of the output
+        """
+        self.threshold = threshold
+        self.rescale_coefficients = rescale_coefficients
+        self.reset()
+
+    def reset(self, num_steps=None):
+        """Forget the cached residual and counters, called at the start of every generation"""
+        self.skipped_steps = 0
+        self.computed_steps = 0
+        self.num_steps = num_steps
+        self.step_index = 0
+        self.residual = None
+        self.encoder_residual = None
+        self._previous_input = None
+        self._accumulated = 0.0
+        self._shape = None
+
+    def _rescale(self, change):
+        if self.rescale_coefficients is None:
+            return change
+        value = 0.0
+        for coefficient in self.rescale_coefficients:
+            value = value * change + coefficient
+        return value
+
+    def should_compute(self, modulated_input):
+        """Decide for the current step, `modulated_input` is the first block's modulated hidden states"""
+        step_index = self.step_index
+        self.step_index += 1
+        previous, self._previous_input = self._previous_input, modulated_input.detach()
+
+        last_step = self.num_steps is not None and step_index >= self.num_steps - 1
+        if previous is None or self.residual is None or last_step or tuple(modulated_input.shape) != self._shape:
+            return True
+        self._accumulated += self._rescale(relative_change(modulated_input, previous))
+        return self._accumulated >= self.threshold
+
+    def store(self, residual, encoder_residual, shape):
+        self.residual = residual
+        self.encoder_residual = encoder_residual
+        self._shape = tuple(shape)
+        self._accumulated = 0.0
+
+    def finish_step(self, computed):
+        if computed:
+            self.computed_steps += 1
+        else:
+            self.skipped_steps += 1
+
+    def stats(self):
+        total = self.skipped_steps + self.computed_steps
+        return {
+            "skipped_steps": self.skipped_steps,
+            "computed_steps": self.computed_steps,
+            "skip_ratio": self.skipped_steps / total if total else 0.0,
+        }
@@ -0,0 +1,301 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+from diffusers.utils import export_to_video
+
+from models.artifact_cache import ArtifactCache
+
+
+class GenerationRequest:
+    """One video to denoise, as submitted to the `GenerationScheduler`"""
+
+    def __init__(
+        self,
+        prompt,
+        image_tensor,
+        tracking_tensor,
+        model_path,
+        seed=42,
+        num_inference_steps=50,
+        guidance_scale=6.0,
+        dtype=torch.bfloat16,
+        tracking_latents=None,
+        cache_threshold=None,
+        output_path=None,
+        fps=8,
+        sequential_cfg=None,
+        vae_slicing=None,
+        vae_tiling=None,
+    ):
+        """
+        Args:
+            prompt (str): Generation prompt
+            image_tensor (torch.Tensor): First frame [C, H, W] in range [0,1]
+            tracking_tensor (torch.Tensor): Tracking video [T, C, H, W] in range [0,1], or uint8 frames [T, H, W, C]
+            model_path (str): DaS checkpoint
+            seed (int): The seed for reproducibility
+            num_inference_steps (int): Denoising steps
+            guidance_scale (float): Classifier-free guidance scale
+            dtype (torch.dtype): Computation dtype
+            tracking_latents (torch.Tensor): Precomputed VAE latents of `tracking_tensor` [1, F, C, H, W], encoded if None
+            cache_threshold (float): TeaCache threshold, None to evaluate every step
+            output_path (str): Path the video is written to, None to only return the frames
+            fps (int): Frame rate of the written video
+            sequential_cfg (bool): True if admission control requires sequential CFG, None for the pipeline default
+            vae_slicing (bool): True if admission control requires VAE slicing
+            vae_tiling (bool): True if admission control requires VAE tiling
+        """
+        self.prompt = prompt
+        self.image_tensor = image_tensor
+        self.tracking_tensor = tracking_tensor
+        self.model_path = model_path
+        self.seed = seed
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
+        self.dtype = dtype
+        self.tracking_latents = tracking_latents
+        self.cache_threshold = cache_threshold
+        self.output_path = output_path
+        self.fps = fps
+        self.sequential_cfg = sequential_cfg
+        self.vae_slicing = vae_slicing
+        self.vae_tiling = vae_tiling
+
+    def shape(self):
+        """(frames, height, width) of the generated video"""
+        if self.tracking_tensor.dtype == torch.uint8:
+            num_frames, height, width = self.tracking_tensor.shape[:3]
+        else:
+            num_frames, _, height, width = self.tracking_tensor.shape
+        return num_frames, height, width
+
+    def batch_key(self):
+        """Requests with equal keys can share one `generate_batch` call"""
+        return (self.model_path, *self.shape(), self.num_inference_steps, float(self.guidance_scale),
+                str(self.dtype), self.cache_threshold)
+
+    def dedup_key(self):
+        """Requests with equal keys produce the same video, the output path does not take part"""
+        return ArtifactCache.make_key(
+            "generation", batch=self.batch_key(), prompt=self.prompt, seed=self.seed,
+            image=self.image_tensor, tracking=self.tracking_tensor,
+        )
+
+
+def _strictest(requests, option):
+    """True if any request requires the memory-saving `option`, None to leave it to the pipeline"""
+    return True if any(getattr(request, option) for request in requests) else None
+
+
+class _Entry:
+    """A unique request waiting for or running in a batch, with the submissions sharing its result"""
+
+    def __init__(self, request, dedup_key, submitted):
+        self.request = request
+        self.dedup_key = dedup_key
+        self.submitted = submitted
+        self.future = Future()
+        self.waiters = [(request, submitted)]
+        self.dispatched = False
+
+
+class SchedulerMetrics:
+    """Queue depth, batch size histogram and wait times of a `GenerationScheduler`"""
+
+    def __init__(self, max_samples=1024):
+        self.queue_depth = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.failed_batches = 0
+        self.batch_sizes = Counter()
+        self._wait_seconds = []
+        self._max_samples = max_samples
+
+    def record_wait(self, seconds):
+        self._wait_seconds.append(seconds)
+        if len(self._wait_seconds) > self._max_samples:
+            del self._wait_seconds[:len(self._wait_seconds) - self._max_samples]
+
+    def snapshot(self):
+        """Metrics as a plain dict; wait times cover the last `max_samples` requests"""
+        waits = np.array(self._wait_seconds) if self._wait_seconds else np.zeros(1)
+        return {
+            "queue_depth": self.queue_depth,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "batches": sum(self.batch_sizes.values()),
+            "failed_batches": self.failed_batches,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "wait_seconds": {
+                "count": len(self._wait_seconds),
+                "mean": float(waits.mean()),
+                "p50": float(np.percentile(waits, 50)),
+                "p95": float(np.percentile(waits, 95)),
+                "max": float(waits.max()),
+            },
+        }
+
+
+class GenerationScheduler:
+    """Coalesces compatible generation requests into batched pipeline calls
+
+    A request waits up to `window` seconds for others with the same `batch_key`; the group is then denoised
+    through `DiffusionAsShaderPipeline.generate_batch` and every submission gets its own result back. Identical
+    submissions (same `dedup_key`) that are queued or running share one item of the batch.
+
+    Example:
+        scheduler = GenerationScheduler(das, window=0.5)
+        frames = scheduler.submit(GenerationRequest(prompt, image, tracking, model_path)).result()
+    """
+
+    def __init__(self, das, window=0.5, max_batch_size=None):
+        """
+        Args:
+            das (DiffusionAsShaderPipeline): Pipeline the batches run on
+            window (float): Seconds a request waits for compatible ones
+            max_batch_size (int): Dispatch a group as soon as it has this many requests, None for no limit
+        """
+        self.das = das
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.metrics = SchedulerMetrics()
+        self._groups = OrderedDict()  # batch key -> entries waiting, in arrival order
+        self._inflight = {}  # dedup key -> entry, until its batch is done
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="generation_scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        """Queue a request
+
+        Returns:
+            concurrent.futures.Future: Resolves to the generated frames once `request.output_path` is written
+        """
+        dedup_key = request.dedup_key()
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The scheduler is closed")
+            self.metrics.submitted += 1
+            entry = self._inflight.get(dedup_key)
+            if entry is not None:
+                self.metrics.deduplicated += 1
+                if entry.dispatched:
+                    self.metrics.record_wait(0.0)
+                entry.waiters.append((request, now))
+                return entry.future
+            entry = _Entry(request, dedup_key, now)
+            self._inflight[dedup_key] = entry
+            self._groups.setdefault(request.batch_key(), []).append(entry)
+            self.metrics.queue_depth += 1
+            self._cond.notify()
+        return entry.future
+
+    def stats(self):
+        with self._cond:
+            return self.metrics.snapshot()
+
+    def close(self, wait=True):
+        """Dispatch what is queued without waiting for the window and stop"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+
+    def _next_batch(self):
+        # called with the condition held, blocks until a group is due
+        while True:
+            if self._closed and not self._groups:
+                return None
+            now = time.monotonic()
+            timeout = None
+            for key, entries in self._groups.items():
+                due = entries[0].submitted + self.window
+                full = self.max_batch_size is not None and len(entries) >= self.max_batch_size
+                if full or due <= now or self._closed:
+                    size = self.max_batch_size or len(entries)
+                    batch, rest = entries[:size], entries[size:]
+                    if rest:
+                        self._groups[key] = rest
+                    else:
+                        del self._groups[key]
+                    return batch
+                timeout = due - now if timeout is None else min(timeout, due - now)
+            self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                now = time.monotonic()
+                for entry in batch:
+                    entry.dispatched = True
+                    for _, submitted in entry.waiters:
+                        self.metrics.record_wait(now - submitted)
+                self.metrics.queue_depth -= len(batch)
+                self.metrics.batch_sizes[len(batch)] += 1
+            try:
+                self._dispatch(batch)
+            finally:
+                with self._cond:
+                    for entry in batch:
+                        self._inflight.pop(entry.dedup_key, None)
+
+    def _dispatch(self, batch):
+        requests = [entry.request for entry in batch]
+        first = requests[0]
+        with self._cond:
+            submissions = [request for entry in batch for request, _ in entry.waiters]
+        try:
+            tracking_latents = None
+            if any(request.tracking_latents is not None for request in requests):
+                tracking_latents = [
+                    request.tracking_latents if request.tracking_latents is not None
+                    else self.das.encode_tracking(request.tracking_tensor, first.model_path, dtype=first.dtype)
+                    for request in requests
+                ]
+            videos = self.das.generate_batch(
+                prompts=[request.prompt for request in requests],
+                image_tensors=[request.image_tensor for request in requests],
+                tracking_tensors=[request.tracking_tensor for request in requests],
+                seeds=[request.seed for request in requests],
+                model_path=first.model_path,
+                num_inference_steps=first.num_inference_steps,
+                guidance_scale=first.guidance_scale,
+                dtype=first.dtype,
+                tracking_latents=tracking_latents,
+                cache_threshold=first.cache_threshold,
+                # a job admitted only with a memory-saving option keeps it inside the batch
+                sequential_cfg=_strictest(submissions, "sequential_cfg"),
+                vae_slicing=_strictest(submissions, "vae_slicing"),
+                vae_tiling=_strictest(submissions, "vae_tiling"),
+            )
+        except Exception as e:
+            with self._cond:
+                self.metrics.failed_batches += 1
+            for entry in batch:
+                entry.future.set_exception(e)
+            return
+
+        for entry, video in zip(batch, videos):
+            with self._cond:
+                # later identical submissions start a new item instead of joining one whose outputs are written
+                self._inflight.pop(entry.dedup_key, None)
+                waiters = list(entry.waiters)
+            try:
+                for request, _ in waiters:
+                    if request.output_path is not None:
+                        os.makedirs(os.path.dirname(os.path.abspath(request.output_path)), exist_ok=True)
+                        export_to_video(video, request.output_path, fps=request.fps)
+                entry.future.set_result(video)
+            except Exception as e:
+                entry.future.set_exception(e)
@@ -0,0 +1,73 @@
+import torch
+
+# Frames the DaS checkpoints are trained on
+WINDOW_FRAMES = 49
+
+
+def plan_windows(num_frames, window=WINDOW_FRAMES, overlap=9):
+    """Start frames of overlapping windows covering a long video
+
+    Consecutive windows share `overlap` frames; the last window is aligned to the end of the video,
+    so it may overlap its predecessor by more.
+
+    Args:
+        num_frames (int): Length of the video
+        window (int): Frames per window
+        overlap (int): Frames shared by consecutive windows, at least 1 (the conditioning frame)
+
+    Returns:
+        list[int]: Window start frames
+    """
+    if num_frames < window:
+        raise ValueError(f"A {num_frames}-frame video is shorter than one {window}-frame window")
+    if not 1 <= overlap < window:
+        raise ValueError(f"overlap must be in [1, {window - 1}], got {overlap}")
+    stride = window - overlap
+    starts = list(range(0, num_frames - window + 1, stride))
+    if starts[-1] + window < num_frames:
+        starts.append(num_frames - window)
+    return starts
+
+
+class WindowStitcher:
+    """Join window outputs into one video, cross-fading the frames consecutive windows share
+
+    Only the frames a later window can still overlap are kept in float; finished frames are
+    converted to uint8 as soon as the next window arrives.
+    """
+
+    def __init__(self):
+        self.frames = []  # finished uint8 [H, W, C] frames
+        self._tail = None  # float [N, H, W, C] frames of the last window
+        self._tail_start = 0
+
+    def add(self, start, frames):
+        """
+        Args:
+            start (int): Start frame of the window in the long video
+            frames (torch.Tensor): Window frames [N, H, W, C] in range [0,1]
+        """
+        frames = frames.float().cpu()
+        if self._tail is None:
+            self._tail, self._tail_start = frames, start
+            return
+        overlap = self._tail_start + len(self._tail) - start
+        if overlap < 0 or start < self._tail_start:
+            raise ValueError("Windows must be added in order without gaps")
+        keep = start - self._tail_start
+        self._emit(self._tail[:keep])
+        # weight of the new window ramps from 0 to 1 over the shared frames
+        weight = torch.linspace(0, 1, overlap + 2)[1:-1].view(-1, 1, 1, 1)
+        blended = self._tail[keep:] * (1 - weight) + frames[:overlap] * weight
+        self._tail = torch.cat([blended, frames[overlap:]])
+        self._tail_start = start
+
+    def _emit(self, frames):
+        self.frames.extend((frames.clamp(0, 1) * 255).round().to(torch.uint8).unbind(0))
+
+    def finish(self):
+        """Return the stitched video as uint8 [T, H, W, C]"""
+        if self._tail is not None:
+            self._emit(self._tail)
+            self._tail = None
+        return torch.stack(self.frames)
@@ -0,0 +1,236 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+from models.checkpoint_io import read_delta_manifest
+
+
+def module_nbytes(module):
+    """Count the bytes held by the parameters and buffers of a module
+
+    Args:
+        module (torch.nn.Module): Module to measure
+
+    Returns:
+        int: Number of bytes
+    """
+    if module is None or not isinstance(module, torch.nn.Module):
+        return 0
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def pipeline_nbytes(pipe):
+    """Count the bytes held by all model components of a diffusers pipeline"""
+    return sum(module_nbytes(component) for component in pipe.components.values())
+
+
+def load_das_pipeline(model_path, dtype, device):
+    """Assemble a DaS image-to-video pipeline ready for inference
+
+    Args:
+        model_path (str): Path or hub id of the DaS checkpoint
+        dtype (torch.dtype): Weight dtype
+        device (str): Target device
+
+    Returns:
+        CogVideoXImageToVideoPipelineTracking: Pipeline on `device` in `dtype`
+    """
+    from transformers import T5EncoderModel, T5Tokenizer
+    from diffusers import AutoencoderKLCogVideoX, CogVideoXDDIMScheduler, CogVideoXDPMScheduler
+    from models.cogvideox_tracking import CogVideoXImageToVideoPipelineTracking, CogVideoXTransformer3DModelTracking
+
+    vae = AutoencoderKLCogVideoX.from_pretrained(model_path, subfolder="vae")
+    text_encoder = T5EncoderModel.from_pretrained(model_path, subfolder="text_encoder")
+    tokenizer = T5Tokenizer.from_pretrained(model_path, subfolder="tokenizer")
+    transformer = CogVideoXTransformer3DModelTracking.from_pretrained(model_path, subfolder="transformer")
+    scheduler = CogVideoXDDIMScheduler.from_pretrained(model_path, subfolder="scheduler")
+
+    pipe = CogVideoXImageToVideoPipelineTracking(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        transformer=transformer,
+        scheduler=scheduler
+    )
+    pipe.scheduler = CogVideoXDPMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+
+    pipe.to(device, dtype=dtype)
+    # pipe.enable_sequential_cpu_offload()
+
+    pipe.vae.enable_slicing()
+    pipe.vae.enable_tiling()
+    pipe.transformer.eval()
+    pipe.text_encoder.eval()
+    pipe.vae.eval()
+
+    pipe.transformer.gradient_checkpointing = False
+    return pipe
+
+
+class ModelRegistry:
+    """Process-wide cache of assembled pipelines keyed by (checkpoint path, dtype, device)
+
+    Pipelines stay resident between calls. When the total size of the resident
+    pipelines exceeds `memory_budget_gb`, the least recently used ones are evicted.
+
+    Checkpoints whose transformer is a tracking delta (see `save_delta`) share one
+    resident pipeline per base model; requesting another delta of the same base
+    only swaps the tracking branch in place.
+
+    A pipeline carries request state (its scheduler, the transformer's block cache, the
+    active delta), so concurrent requests take its `pipeline_lock` around `get_pipeline`
+    and the generation.
+    """
+
+    def __init__(self, memory_budget_gb=None, loader=load_das_pipeline):
+        """
+        Args:
+            memory_budget_gb (float): Maximum size of resident pipelines in GB, None for unlimited
+            loader (callable): Function `(model_path, dtype, device) -> pipeline` used on a miss
+        """
+        self.memory_budget_gb = memory_budget_gb
+        self.loader = loader
+        self._entries = OrderedDict()  # key -> (pipeline, nbytes)
+        self._active_deltas = {}  # key -> transformer delta directory currently applied
+        self._pipeline_locks = {}  # key -> lock held by the request running the pipeline
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path, dtype, device):
+        return (str(model_path), str(dtype), str(device))
+
+    def _delta_key(self, model_path, dtype, device):
+        """(registry key of the base model, delta directory) for delta checkpoints, (None, None) otherwise"""
+        delta_dir = os.path.join(str(model_path), "transformer")
+        manifest = read_delta_manifest(delta_dir) if os.path.isdir(delta_dir) else None
+        if manifest is None:
+            return None, None
+        base = f"{manifest['base_model']}:{manifest['base_subfolder']}"
+        return self.make_key(base, dtype, device), delta_dir
+
+    def pipeline_lock(self, model_path, dtype=torch.bfloat16, device="cuda"):
+        """Return the lock serializing the requests that run the pipeline of a checkpoint
+
+        Delta checkpoints of one base model share the lock of their resident pipeline.
+
+        Args:
+            model_path (str): Path or hub id of the checkpoint
+            dtype (torch.dtype): Weight dtype
+            device (str): Target device
+
+        Returns:
+            threading.RLock: Lock to hold while using the pipeline
+        """
+        delta_key, _ = self._delta_key(model_path, dtype, device)
+        key = delta_key or self.make_key(model_path, dtype, device)
+        with self._lock:
+            return self._pipeline_locks.setdefault(key, threading.RLock())
+
+    def get_pipeline(self, model_path, dtype=torch.bfloat16, device="cuda"):
+        """Return a resident pipeline, loading it on a miss
+
+        Args:
+            model_path (str): Path or hub id of the checkpoint
+            dtype (torch.dtype): Weight dtype
+            device (str): Target device
+
+        Returns:
+            DiffusionPipeline: The cached pipeline
+        """
+        delta_key, delta_dir = self._delta_key(model_path, dtype, device)
+        key = delta_key or self.make_key(model_path, dtype, device)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                print(f"Model cache hit for {key} ({self.hits} hits, {self.misses} misses)")
+                pipe = self._entries[key][0]
+                if delta_dir is not None and self._active_deltas.get(key) != delta_dir:
+                    print(f"Switching tracking delta to {delta_dir}")
+                    pipe.transformer.load_delta(delta_dir)
+                    self._active_deltas[key] = delta_dir
+                return pipe
+
+            self.misses += 1
+            print(f"Model cache miss for {key} ({self.hits} hits, {self.misses} misses), loading...")
+            pipe = self.loader(model_path, dtype, device)
+            self._entries[key] = (pipe, pipeline_nbytes(pipe))
+            if delta_dir is not None:
+                self._active_deltas[key] = delta_dir
+            self._enforce_budget(keep=key)
+            return pipe
+
+    def _enforce_budget(self, keep=None):
+        if self.memory_budget_gb is None:
+            return
+        budget = self.memory_budget_gb * 1024**3
+        while self.resident_bytes() > budget:
+            victim = next((k for k in self._entries if k != keep), None)
+            if victim is None:
+                break
+            self.evict(victim)
+
+    def set_memory_budget(self, memory_budget_gb):
+        with self._lock:
+            self.memory_budget_gb = memory_budget_gb
+            self._enforce_budget()
+
+    def resident_bytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def evict(self, key):
+        """Drop a pipeline from the cache and release its device memory"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self._active_deltas.pop(key, None)
+            if entry is None:
+                return False
+            self.evictions += 1
+            print(f"Evicting {key} from model cache")
+            del entry
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            return True
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.evict(key)
+
+    def stats(self):
+        """Return cache hit/miss counters and resident size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident": len(self._entries),
+                "resident_gb": self.resident_bytes() / 1024**3,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry(memory_budget_gb=None):
+    """Return the process-wide model registry, creating it on first use
+
+    Args:
+        memory_budget_gb (float): If given, update the registry's memory budget
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(memory_budget_gb=memory_budget_gb)
+        elif memory_budget_gb is not None:
+            _registry.set_memory_budget(memory_budget_gb)
+        return _registry
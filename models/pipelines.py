@@ -1,6 +1,8 @@
 import os
 import sys
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from PIL import Image, ImageDraw
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,23 +23,40 @@ from diffusers.utils import export_to_video, load_image, load_video
 from models.spatracker.predictor import SpaTrackerPredictor
 from models.spatracker.utils.visualizer import Visualizer
 from models.cogvideox_tracking import CogVideoXImageToVideoPipelineTracking
+from models.model_cache import get_model_registry, pipeline_nbytes
+from models.tracker_pool import get_tracker_pool
+from models.depth import estimate_video_depth
+from models.rasterizer import splat_points
+from models.video_io import write_video, write_video_async
+from models.long_video import WINDOW_FRAMES, WindowStitcher, plan_windows
+from models.camera_motion import axis_rotation_matrices, compile_motion, spiral_matrices, translation_matrices
+from models.streaming_decode import stream_decode_to_video
+from models.prompt_cache import get_prompt_cache
+from models.batching import activation_budget_bytes, estimate_item_bytes, plan_batches
+from models.job_scheduler import GenerationRequest
 
 from submodules.MoGe.moge.model.v1 import MoGeModel
 
 from image_gen_aux import DepthPreprocessor
-from moviepy.editor import ImageSequenceClip
 
 class DiffusionAsShaderPipeline:
-    def __init__(self, gpu_id=0, output_dir='outputs'):
+    def __init__(self, gpu_id=0, output_dir='outputs', model_cache_gb=None, prompt_cache_dir=None, batch_memory_gb=None):
         """Initialize MotionTransfer class
         
         Args:
             gpu_id (int): GPU device ID
             output_dir (str): Output directory path
+            model_cache_gb (float): Memory budget of the resident model registry in GB, None for unlimited
+            prompt_cache_dir (str): Directory of the on-disk prompt embedding cache, None to cache in memory only
+            batch_memory_gb (float): Device memory budget in GB, the resident weights included, used to split
+                `generate_batch` and to run the CFG halves sequentially when a single video does not fit, None to use
+                the free GPU memory
         """
         # video parameters
         self.max_depth = 65.0
         self.fps = 8
+        self.depth_batch_size = 8
+        self.negative_prompt = "The video is not of a high quality, it has a low resolution. Watermark present in each frame. The background is solid. Strange body and strange trajectory. Distortion."
 
         # camera parameters
         self.camera_motion=None
@@ -48,9 +67,23 @@ class DiffusionAsShaderPipeline:
         torch.cuda.set_device(gpu_id)
         self.dtype = torch.bfloat16
 
+        # resident models, shared by every pipeline instance in this process
+        self.model_registry = get_model_registry(model_cache_gb)
+        self.tracker_pool = get_tracker_pool(self.device)
+        self.prompt_cache = get_prompt_cache(prompt_cache_dir)
+        self.batch_memory_gb = batch_memory_gb
+        # True forces the CFG halves into separate transformer passes (set by admission control), None decides by memory
+        self.sequential_cfg = None
+        # True requires VAE slicing / tiling (set by admission control), None keeps the pipeline's setting
+        self.vae_slicing = None
+        self.vae_tiling = None
+        # optional GenerationScheduler that batches apply_tracking with concurrent requests
+        self.job_scheduler = None
+
         # files
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
+        self.pending_writes = []
         
         # Initialize transform
         self.transform = transforms.Compose([
@@ -72,14 +105,20 @@ class DiffusionAsShaderPipeline:
         dtype: torch.dtype = torch.bfloat16,
         fps: int = 24,
         seed: int = 42,
+        tracking_latents: torch.Tensor = None,
+        cache_threshold: float = None,
+        progress_callback=None,
     ):
         """
         Generates a video based on the given prompt and saves it to the specified path.
 
+        The latents are decoded in causal temporal chunks that go straight into the mp4 file, so the first frames
+        are written before the decode finishes and only one chunk of decoded frames is held in memory.
+
         Parameters:
         - prompt (str): The description of the video to be generated.
         - model_path (str): The path of the pre-trained model to be used.
-        - tracking_tensor (torch.Tensor): Tracking video tensor [T, C, H, W] in range [0,1]
+        - tracking_tensor (torch.Tensor): Tracking video tensor [T, C, H, W] in range [0,1], or uint8 frames [T, H, W, C]
         - image_tensor (torch.Tensor): Input image tensor [C, H, W] in range [0,1]
         - output_path (str): The path where the generated video will be saved.
         - num_inference_steps (int): Number of steps for the inference process.
@@ -87,146 +126,438 @@ class DiffusionAsShaderPipeline:
         - num_videos_per_prompt (int): Number of videos to generate per prompt.
         - dtype (torch.dtype): The data type for computation.
         - seed (int): The seed for reproducibility.
+        - tracking_latents (torch.Tensor): Precomputed VAE latents of `tracking_tensor` [B, F, C, H, W], see `encode_tracking`
+        - cache_threshold (float): Skip the transformer blocks on steps whose input changed less than this (TeaCache), None to disable.
+        - progress_callback (callable): Called as `progress_callback(frames_written, total_frames)` while the video is written.
         """
-        from transformers import T5EncoderModel, T5Tokenizer
-        from diffusers import AutoencoderKLCogVideoX, CogVideoXDDIMScheduler
-        from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking
-        
-        vae = AutoencoderKLCogVideoX.from_pretrained(model_path, subfolder="vae")
-        text_encoder = T5EncoderModel.from_pretrained(model_path, subfolder="text_encoder")
-        tokenizer = T5Tokenizer.from_pretrained(model_path, subfolder="tokenizer")
-        transformer = CogVideoXTransformer3DModelTracking.from_pretrained(model_path, subfolder="transformer")
-        scheduler = CogVideoXDDIMScheduler.from_pretrained(model_path, subfolder="scheduler")
-        
-        pipe = CogVideoXImageToVideoPipelineTracking(
-            vae=vae,
-            text_encoder=text_encoder,
-            tokenizer=tokenizer,
-            transformer=transformer,
-            scheduler=scheduler
-        )
+        # the pipeline is shared through the model registry, concurrent requests run it one at a time
+        with self.model_registry.pipeline_lock(model_path, dtype=dtype, device=self.device):
+            pipe = self.model_registry.get_pipeline(model_path, dtype=dtype, device=self.device)
+            # repeated prompts and the fixed negative prompt skip the text encoder
+            pipe.set_prompt_cache(self.prompt_cache)
+            self._configure_block_cache(pipe, cache_threshold)
+            self._configure_vae(pipe, self.vae_slicing, self.vae_tiling)
+        
+            # Convert tensor to PIL Image
+            image_np = (image_tensor.permute(1, 2, 0).numpy() * 255).astype(np.uint8)
+            image = Image.fromarray(image_np)
+            height, width = image.height, image.width
+
+            self.dtype = dtype
+
+            tracking_maps = self._tracking_frames(tracking_tensor, dtype)
+            tracking_first_frame = tracking_maps[0:1]  # Get first frame as [1, C, H, W]
+            height, width = tracking_first_frame.shape[2], tracking_first_frame.shape[3]
+
+            if tracking_latents is None:
+                tracking_maps = self._encode_tracking(pipe, tracking_maps)
+            else:
+                tracking_maps = tracking_latents.to(device=self.device, dtype=dtype)
+
+            # 4. Generate the video latents based on the prompt.
+            latents = pipe(
+                prompt=prompt,
+                negative_prompt=self.negative_prompt,
+                image=image,
+                num_videos_per_prompt=num_videos_per_prompt,
+                num_inference_steps=num_inference_steps,
+                num_frames=49,
+                use_dynamic_cfg=True,
+                guidance_scale=guidance_scale,
+                generator=torch.Generator().manual_seed(seed),
+                tracking_maps=tracking_maps,
+                tracking_image=tracking_first_frame,
+                height=height,
+                width=width,
+                memory_budget_gb=self.batch_memory_gb,
+                sequential_cfg=self.sequential_cfg,
+                output_type="latent",
+            ).frames
+            self._report_block_cache(pipe)
+        
+            # 5. Decode the first video chunk by chunk into the video file. fps must be 8 for original video.
+            output_path = output_path if output_path else f"result.mp4"
+            stream_decode_to_video(pipe.vae, latents, output_path, fps=fps, progress_callback=progress_callback)
         
-        # Convert tensor to PIL Image
-        image_np = (image_tensor.permute(1, 2, 0).numpy() * 255).astype(np.uint8)
-        image = Image.fromarray(image_np)
-        height, width = image.height, image.width
+    @torch.no_grad()
+    def _infer_long(
+        self,
+        prompt: str,
+        model_path: str,
+        tracking_tensor: torch.Tensor,
+        image_tensor: torch.Tensor,
+        output_path: str = "./output.mp4",
+        num_inference_steps: int = 25,
+        guidance_scale: float = 6.0,
+        dtype: torch.dtype = torch.bfloat16,
+        fps: int = 8,
+        seed: int = 42,
+        window_overlap: int = 9,
+        cache_threshold: float = None,
+    ):
+        """
+        Generates a video longer than one window with overlapping 49-frame windows.
 
-        pipe.transformer.eval()
-        pipe.text_encoder.eval()
-        pipe.vae.eval()
+        Every window is conditioned on the frame of the previous window's output where it starts, and the frames
+        consecutive windows share are cross-faded. The VAE encode of window k+1's tracking video runs on a side
+        stream while window k is denoised.
 
-        self.dtype = dtype
+        Parameters:
+        - prompt (str): The description of the video to be generated.
+        - model_path (str): The path of the pre-trained model to be used.
+        - tracking_tensor (torch.Tensor): Tracking video tensor [T, C, H, W] in range [0,1], or uint8 frames [T, H, W, C], T >= 49
+        - image_tensor (torch.Tensor): Input image tensor [C, H, W] in range [0,1], conditions the first window
+        - output_path (str): The path where the generated video will be saved.
+        - num_inference_steps (int): Number of steps for the inference process.
+        - guidance_scale (float): The scale for classifier-free guidance.
+        - dtype (torch.dtype): The data type for computation.
+        - seed (int): The seed for reproducibility, window k uses `seed + k`.
+        - window_overlap (int): Frames shared by consecutive windows.
+        - cache_threshold (float): Skip the transformer blocks on steps whose input changed less than this (TeaCache), None to disable.
+        """
+        with self.model_registry.pipeline_lock(model_path, dtype=dtype, device=self.device):
+            pipe = self.model_registry.get_pipeline(model_path, dtype=dtype, device=self.device)
+            pipe.set_prompt_cache(self.prompt_cache)
+            self._configure_block_cache(pipe, cache_threshold)
+            self._configure_vae(pipe, self.vae_slicing, self.vae_tiling)
+            self.dtype = dtype
+
+            tracking_maps = self._tracking_frames(tracking_tensor, dtype)
+            height, width = tracking_maps.shape[2], tracking_maps.shape[3]
+            starts = plan_windows(tracking_maps.shape[0], WINDOW_FRAMES, window_overlap)
+            print(f"Generating {tracking_maps.shape[0]} frames in {len(starts)} windows")
+
+            # The VAE keeps a conv cache between calls, so encodes and decodes never run concurrently
+            vae_lock = threading.Lock()
+            use_side_stream = torch.device(self.device).type == "cuda" and torch.cuda.is_available()
+            side_stream = torch.cuda.Stream(device=self.device) if use_side_stream else None
+            main_stream = torch.cuda.current_stream(self.device) if use_side_stream else None
+
+            def encode_window(start):
+                with vae_lock:
+                    if side_stream is None:
+                        return self._encode_tracking(pipe, tracking_maps[start:start + WINDOW_FRAMES])
+                    side_stream.wait_stream(main_stream)
+                    with torch.cuda.stream(side_stream):
+                        latents = self._encode_tracking(pipe, tracking_maps[start:start + WINDOW_FRAMES])
+                    side_stream.synchronize()
+                    return latents
+
+            image = self._to_pil(image_tensor)
+            stitcher = WindowStitcher()
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="window_encoder") as encoder:
+                pending = None
+                for k, start in enumerate(starts):
+                    tracking_latents = pending.result() if pending is not None else encode_window(start)
+                    if side_stream is not None:
+                        tracking_latents.record_stream(main_stream)
+                    next_start = starts[k + 1] if k + 1 < len(starts) else None
+
+                    def submit_next(pipeline, step, timestep, callback_kwargs, next_start=next_start):
+                        # after the first step the pipeline's own image encodes are done and the VAE is free
+                        nonlocal pending
+                        if step == 0 and next_start is not None:
+                            pending = encoder.submit(encode_window, next_start)
+                        return {}
+
+                    pending = None
+                    latents = pipe(
+                        prompt=prompt,
+                        negative_prompt=self.negative_prompt,
+                        image=image,
+                        num_inference_steps=num_inference_steps,
+                        num_frames=WINDOW_FRAMES,
+                        use_dynamic_cfg=True,
+                        guidance_scale=guidance_scale,
+                        generator=torch.Generator().manual_seed(seed + k),
+                        tracking_maps=tracking_latents,
+                        tracking_image=tracking_maps[start:start + 1],
+                        height=height,
+                        width=width,
+                        memory_budget_gb=self.batch_memory_gb,
+                        sequential_cfg=self.sequential_cfg,
+                        output_type="latent",
+                        callback_on_step_end=submit_next,
+                    ).frames
+                    if pending is None and next_start is not None:
+                        pending = encoder.submit(encode_window, next_start)
+                    self._report_block_cache(pipe)
+
+                    with vae_lock:
+                        frames = pipe.decode_latents(latents)
+                    frames = pipe.video_processor.postprocess_video(video=frames, output_type="pt")[0]  # [F, C, H, W]
+                    del latents
+                    stitcher.add(start, frames.permute(0, 2, 3, 1))
+                    if next_start is not None:
+                        image = self._to_pil(frames[next_start - start])
+                    print(f"Window {k + 1}/{len(starts)} done (frames {start}-{start + WINDOW_FRAMES - 1})")
+
+            output_path = output_path if output_path else f"result.mp4"
+            write_video(stitcher.finish(), output_path, fps=fps)
 
-        # Process tracking tensor
-        tracking_maps = tracking_tensor.float() # [T, C, H, W]
-        tracking_maps = tracking_maps.to(device=self.device, dtype=dtype)
-        tracking_first_frame = tracking_maps[0:1]  # Get first frame as [1, C, H, W]
-        height, width = tracking_first_frame.shape[2], tracking_first_frame.shape[3]
+    @torch.no_grad()
+    def generate_batch(
+        self,
+        prompts,
+        image_tensors,
+        tracking_tensors,
+        seeds,
+        model_path: str,
+        num_inference_steps: int = 50,
+        guidance_scale: float = 6.0,
+        dtype: torch.dtype = torch.bfloat16,
+        tracking_latents=None,
+        output_paths=None,
+        fps: int = None,
+        max_batch_size: int = None,
+        memory_budget_gb: float = None,
+        cache_threshold: float = None,
+        sequential_cfg: bool = None,
+        vae_slicing: bool = None,
+        vae_tiling: bool = None,
+    ):
+        """
+        Generates several videos through the batch dimension of the pipeline.
 
-        # 2. Set Scheduler.
-        pipe.scheduler = CogVideoXDPMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+        All items must share the same resolution and frame count. Every item gets its own generator,
+        so an item produces the same video whatever batch it ends up in. Items are split into
+        consecutive chunks that fit the memory budget; a chunk that still runs out of memory is halved.
 
-        pipe.to(self.device, dtype=dtype)
-        # pipe.enable_sequential_cpu_offload()
+        Parameters:
+        - prompts (list[str]): One prompt per item.
+        - image_tensors (list[torch.Tensor]): First frames [C, H, W] in range [0,1].
+        - tracking_tensors (list[torch.Tensor]): Tracking videos [T, C, H, W] in range [0,1], or uint8 frames [T, H, W, C].
+        - seeds (list[int]): One seed per item.
+        - model_path (str): The path of the pre-trained model to be used.
+        - num_inference_steps (int): Number of steps for the inference process.
+        - guidance_scale (float): The scale for classifier-free guidance.
+        - dtype (torch.dtype): The data type for computation.
+        - tracking_latents (list[torch.Tensor]): Optional precomputed VAE latents per item, see `encode_tracking`.
+        - output_paths (list[str]): Optional paths the generated videos are saved to.
+        - fps (int): Frame rate of the saved videos, defaults to `self.fps`.
+        - max_batch_size (int): Upper bound on the number of items denoised together.
+        - memory_budget_gb (float): Device memory budget in GB, the resident weights included, defaults to `self.batch_memory_gb` or the free GPU memory.
+        - cache_threshold (float): Skip the transformer blocks on steps whose input changed less than this (TeaCache), None to disable.
+        - sequential_cfg (bool): True runs the CFG halves as separate transformer passes, defaults to `self.sequential_cfg`.
+        - vae_slicing (bool): True requires VAE slicing, defaults to `self.vae_slicing`.
+        - vae_tiling (bool): True requires VAE tiling, defaults to `self.vae_tiling`.
 
-        pipe.vae.enable_slicing()
-        pipe.vae.enable_tiling()
-        pipe.transformer.eval()
-        pipe.text_encoder.eval()
-        pipe.vae.eval()
+        Returns:
+        - list: Generated frames of every item, in input order.
+        """
+        num_items = len(prompts)
+        if not (len(image_tensors) == len(tracking_tensors) == len(seeds) == num_items):
+            raise ValueError("prompts, image_tensors, tracking_tensors and seeds must have the same length")
+        if output_paths is not None and len(output_paths) != num_items:
+            raise ValueError("output_paths must have one path per item")
+        if num_items == 0:
+            return []
+        sequential_cfg = sequential_cfg if sequential_cfg is not None else self.sequential_cfg
+        vae_slicing = vae_slicing if vae_slicing is not None else self.vae_slicing
+        vae_tiling = vae_tiling if vae_tiling is not None else self.vae_tiling
+
+        with self.model_registry.pipeline_lock(model_path, dtype=dtype, device=self.device):
+            pipe = self.model_registry.get_pipeline(model_path, dtype=dtype, device=self.device)
+            pipe.set_prompt_cache(self.prompt_cache)
+            self._configure_block_cache(pipe, cache_threshold)
+            self._configure_vae(pipe, vae_slicing, vae_tiling)
+            self.dtype = dtype
+
+            tracking_frames = [self._tracking_frames(tracking, dtype) for tracking in tracking_tensors]
+            num_frames, _, height, width = tracking_frames[0].shape
+            for image, frames in zip(image_tensors, tracking_frames):
+                if frames.shape[0] != num_frames or tuple(frames.shape[2:]) != (height, width):
+                    raise ValueError("All tracking videos must have the same resolution and frame count")
+                if tuple(image.shape[1:]) != (height, width):
+                    raise ValueError("First frames must match the resolution of the tracking videos")
+
+            if tracking_latents is None:
+                tracking_latents = [self._encode_tracking(pipe, frames) for frames in tracking_frames]
+            else:
+                tracking_latents = [latents.to(device=self.device, dtype=dtype) for latents in tracking_latents]
+
+            budget_gb = memory_budget_gb if memory_budget_gb is not None else self.batch_memory_gb
+            resident_bytes = pipeline_nbytes(pipe) if budget_gb is not None else 0
+            budget_bytes = activation_budget_bytes(self.device, budget_gb, resident_bytes)
+            item_bytes = estimate_item_bytes(height, width, num_frames, pipe.transformer.config, dtype, guidance_scale > 1.0)
+            chunks = plan_batches(num_items, item_bytes, budget_bytes, max_batch_size)
+            print(f"Generating {num_items} videos in {len(chunks)} batches")
+
+            videos = []
+            pending = list(chunks)
+            while pending:
+                chunk = pending.pop(0)
+                try:
+                    videos.extend(pipe(
+                        prompt=list(prompts[chunk]),
+                        negative_prompt=self.negative_prompt,
+                        image=[self._to_pil(image) for image in image_tensors[chunk]],
+                        num_inference_steps=num_inference_steps,
+                        num_frames=num_frames,
+                        use_dynamic_cfg=True,
+                        guidance_scale=guidance_scale,
+                        generator=[torch.Generator().manual_seed(seed) for seed in seeds[chunk]],
+                        tracking_maps=torch.cat(tracking_latents[chunk], dim=0),
+                        tracking_image=torch.cat([frames[0:1] for frames in tracking_frames[chunk]], dim=0),
+                        height=height,
+                        width=width,
+                        memory_budget_gb=budget_gb,
+                        sequential_cfg=sequential_cfg,
+                    ).frames)
+                    self._report_block_cache(pipe)
+                except torch.cuda.OutOfMemoryError:
+                    size = chunk.stop - chunk.start
+                    if size == 1:
+                        raise
+                    torch.cuda.empty_cache()
+                    half = chunk.start + size // 2
+                    print(f"Out of memory with {size} videos, retrying in halves")
+                    pending[:0] = [slice(chunk.start, half), slice(half, chunk.stop)]
+
+            if output_paths is not None:
+                for video, path in zip(videos, output_paths):
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                    export_to_video(video, path, fps=fps or self.fps)
+            return videos
+
+    @staticmethod
+    def _to_pil(image_tensor):
+        image_np = (image_tensor.detach().cpu().permute(1, 2, 0).float().numpy() * 255).astype(np.uint8)
+        return Image.fromarray(image_np)
+
+    @staticmethod
+    def _configure_block_cache(pipe, cache_threshold):
+        # the pipeline is shared through the model registry, so every request sets its own mode
+        if cache_threshold:
+            pipe.transformer.enable_block_cache(cache_threshold)
+        else:
+            pipe.transformer.disable_block_cache()
+
+    @staticmethod
+    def _configure_vae(pipe, vae_slicing, vae_tiling):
+        # only switched on: a request that needs less memory still runs with them
+        if vae_slicing:
+            pipe.vae.enable_slicing()
+        if vae_tiling:
+            pipe.vae.enable_tiling()
+
+    @staticmethod
+    def _report_block_cache(pipe):
+        if pipe.transformer.block_cache is not None:
+            stats = pipe.transformer.block_cache.stats()
+            print(f"Block cache skipped {stats['skipped_steps']}/{stats['skipped_steps'] + stats['computed_steps']} steps "
+                  f"(skip ratio {stats['skip_ratio']:.2f})")
+
+    def _tracking_frames(self, tracking_tensor, dtype):
+        """Bring a tracking video to [T, C, H, W] in range [0,1] on the device"""
+        if tracking_tensor.dtype == torch.uint8:
+            # uint8 frames [T, H, W, C] handed over by the visualizers
+            return tracking_tensor.to(device=self.device).permute(0, 3, 1, 2).to(dtype) / 255.0
+        tracking_maps = tracking_tensor.float() # [T, C, H, W]
+        return tracking_maps.to(device=self.device, dtype=dtype)
 
-        pipe.transformer.gradient_checkpointing = False
-        
+    def _encode_tracking(self, pipe, tracking_maps):
         print("Encoding tracking maps")
         tracking_maps = tracking_maps.unsqueeze(0) # [B, T, C, H, W]
         tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, C, T, H, W]
         tracking_latent_dist = pipe.vae.encode(tracking_maps).latent_dist
         tracking_maps = tracking_latent_dist.sample() * pipe.vae.config.scaling_factor
-        tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, F, C, H, W]
+        return tracking_maps.permute(0, 2, 1, 3, 4)  # [B, F, C, H, W]
 
-        # 4. Generate the video frames based on the prompt.
-        video_generate = pipe(
-            prompt=prompt,
-            negative_prompt="The video is not of a high quality, it has a low resolution. Watermark present in each frame. The background is solid. Strange body and strange trajectory. Distortion.",
-            image=image,
-            num_videos_per_prompt=num_videos_per_prompt,
-            num_inference_steps=num_inference_steps,
-            num_frames=49,
-            use_dynamic_cfg=True,
-            guidance_scale=guidance_scale,
-            generator=torch.Generator().manual_seed(seed),
-            tracking_maps=tracking_maps,
-            tracking_image=tracking_first_frame,
-            height=height,
-            width=width,
-        ).frames[0]
-        
-        # 5. Export the generated frames to a video file. fps must be 8 for original video.
-        output_path = output_path if output_path else f"result.mp4"
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        export_to_video(video_generate, output_path, fps=fps)
+    @torch.no_grad()
+    def encode_tracking(self, tracking_tensor, model_path, dtype=torch.bfloat16):
+        """Encode a tracking video to the VAE latents used as tracking condition
         
+        Args:
+            tracking_tensor (torch.Tensor): Tracking video tensor [T, C, H, W] in range [0,1], or uint8 frames [T, H, W, C]
+            model_path (str): Path of the DaS checkpoint whose VAE is used
+            dtype (torch.dtype): Computation dtype
+            
+        Returns:
+            torch.Tensor: Tracking latents [1, F, C, H, W]
+        """
+        with self.model_registry.pipeline_lock(model_path, dtype=dtype, device=self.device):
+            pipe = self.model_registry.get_pipeline(model_path, dtype=dtype, device=self.device)
+            return self._encode_tracking(pipe, self._tracking_frames(tracking_tensor, dtype))
+
     #========== camera parameters ==========#
 
     def _set_camera_motion(self, camera_motion):
         self.camera_motion = camera_motion
     
+    ##============= Depth =============##
+
+    def estimate_depth(self, video_tensor):
+        """Estimate normalized per-frame depth with ZoeDepth
+        
+        Args:
+            video_tensor (torch.Tensor): Input video tensor [T, C, H, W] in range [0,1]
+            
+        Returns:
+            torch.Tensor: Depth tensor [T, 1, H, W] on the device
+        """
+        with self.tracker_pool.use("zoedepth") as depth_preprocessor:
+            self.depth_preprocessor = depth_preprocessor
+            return estimate_video_depth(
+                self.depth_preprocessor, video_tensor.to(self.device), batch_size=self.depth_batch_size
+            )
+
     ##============= SpatialTracker =============##
     
-    def generate_tracking_spatracker(self, video_tensor, density=70):
+    def generate_tracking_spatracker(self, video_tensor, density=70, video_depth=None):
         """Generate tracking video
         
         Args:
             video_tensor (torch.Tensor): Input video tensor
+            density (int): Grid size of the tracked points
+            video_depth (torch.Tensor): Precomputed depth [T, 1, H, W], estimated if None
             
         Returns:
             str: Path to tracking video
         """
-        print("Loading tracking models...")
-        # Load tracking model
-        tracker = SpaTrackerPredictor(
-            checkpoint=os.path.join(project_root, 'checkpoints/spaT_final.pth'),
-            interp_shape=(384, 576),
-            seq_length=12
-        ).to(self.device)
-        
-        # Load depth model
-        self.depth_preprocessor = DepthPreprocessor.from_pretrained("Intel/zoedepth-nyu-kitti").to(self.device)
-        
         try:
             video = video_tensor.unsqueeze(0).to(self.device)
             
-            video_depths = []
-            for i in range(video_tensor.shape[0]):
-                frame = (video_tensor[i].permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
-                depth = self.depth_preprocessor(Image.fromarray(frame))[0]
-                depth_tensor = transforms.ToTensor()(depth)  # [1, H, W]
-                video_depths.append(depth_tensor)
-            video_depth = torch.stack(video_depths, dim=0).to(self.device)
+            if video_depth is None:
+                video_depth = self.estimate_depth(video[0])  # [T, 1, H, W]
+            video_depth = video_depth.to(self.device)
             # print("Video depth shape:", video_depth.shape)
             
             segm_mask = np.ones((480, 720), dtype=np.uint8)
             
-            pred_tracks, pred_visibility, T_Firsts = tracker(
-                video * 255, 
-                video_depth=video_depth,
-                grid_size=density,
-                backward_tracking=False,
-                depth_predictor=None,
-                grid_query_frame=0,
-                segm_mask=torch.from_numpy(segm_mask)[None, None].to(self.device),
-                wind_length=12,
-                progressive_tracking=False
-            )
+            with self.tracker_pool.use("spatracker") as tracker:
+                pred_tracks, pred_visibility, T_Firsts = tracker(
+                    video * 255, 
+                    video_depth=video_depth,
+                    grid_size=density,
+                    backward_tracking=False,
+                    depth_predictor=None,
+                    grid_query_frame=0,
+                    segm_mask=torch.from_numpy(segm_mask)[None, None].to(self.device),
+                    wind_length=12,
+                    progressive_tracking=False
+                )
 
             return pred_tracks.squeeze(0), pred_visibility.squeeze(0), T_Firsts
             
         finally:
-            # Clean up GPU memory
-            del tracker, self.depth_preprocessor
+            # The backends stay warm in the tracker pool, only drop cached activations
             torch.cuda.empty_cache()
 
-    def visualize_tracking_spatracker(self, video, pred_tracks, pred_visibility, T_Firsts, save_tracking=True):
+    def visualize_tracking_spatracker(self, video, pred_tracks, pred_visibility, T_Firsts, save_tracking=True, zero_copy=False):
+        """Visualize tracking results from SpaTracker
+        
+        Args:
+            video (torch.Tensor): Input video tensor [T, C, H, W]
+            pred_tracks (torch.Tensor): Tracking points [T, N, 3]
+            pred_visibility (torch.Tensor): Visibility mask [T, N]
+            T_Firsts (torch.Tensor): Query frame of every track
+            save_tracking (bool): Whether to save tracking video, written in the background
+            zero_copy (bool): Return the rendered uint8 frames [T, H, W, 3] instead of a float copy
+            
+        Returns:
+            tuple: (tracking_path, tracking_video)
+        """
         video = video.unsqueeze(0).to(self.device)
         pred_tracks = pred_tracks.unsqueeze(0).detach().cpu()
         pred_visibility = pred_visibility.unsqueeze(0).detach().cpu()
@@ -242,26 +573,50 @@ class DiffusionAsShaderPipeline:
                         visibility=pred_visibility, save_video=False,
                         filename="temp")
         
-        tracking_video = tracking_video.squeeze(0) # [T, C, H, W]
-        wide_list = list(tracking_video.unbind(0))
-        wide_list = [wide.permute(1, 2, 0).cpu().numpy() for wide in wide_list]
-        clip = ImageSequenceClip(wide_list, fps=self.fps)
+        frames = tracking_video.squeeze(0).permute(0, 2, 3, 1) # [T, H, W, C] uint8 view
+        return self._handoff_tracking(frames, "tracking_video.mp4", save_tracking, zero_copy)
+
+    def _handoff_tracking(self, frames, filename, save_tracking=True, zero_copy=False):
+        """Hand rendered tracking frames to generation, writing the mp4 in the background
+        
+        Args:
+            frames (torch.Tensor or numpy.ndarray): uint8 frames [T, H, W, 3]
+            filename (str): Name of the tracking video in the output directory
+            save_tracking (bool): Whether to save tracking video
+            zero_copy (bool): Return `frames` as a uint8 tensor instead of a float [T, C, H, W] copy in [0,1]
+            
+        Returns:
+            tuple: (tracking_path, tracking_video)
+        """
+        if isinstance(frames, np.ndarray):
+            frames = torch.from_numpy(frames)
 
         tracking_path = None
         if save_tracking:
-            try:
-                tracking_path = os.path.join(self.output_dir, "tracking_video.mp4")
-                clip.write_videofile(tracking_path, codec="libx264", fps=self.fps, logger=None)
-                print(f"Video saved to {tracking_path}")
-            except Exception as e:
-                print(f"Warning: Failed to save tracking video: {e}")
-                tracking_path = None
-        
-        # Convert tracking_video back to tensor in range [0,1]
-        tracking_frames = np.array(list(clip.iter_frames())) / 255.0
-        tracking_video = torch.from_numpy(tracking_frames).permute(0, 3, 1, 2).float()
+            tracking_path = os.path.join(self.output_dir, filename)
+            future = write_video_async(frames, tracking_path, fps=self.fps)
+            future.add_done_callback(self._report_tracking_write)
+            self.pending_writes.append(future)
+
+        if zero_copy:
+            return tracking_path, frames
         
+        # Convert tracking_video to tensor in range [0,1]
+        tracking_video = frames.permute(0, 3, 1, 2).float() / 255.0
         return tracking_path, tracking_video
+
+    @staticmethod
+    def _report_tracking_write(future):
+        try:
+            print(f"Video saved to {future.result()}")
+        except Exception as e:
+            print(f"Warning: Failed to save tracking video: {e}")
+
+    def wait_for_pending_writes(self):
+        """Block until all background tracking video writes are finished"""
+        for future in self.pending_writes:
+            future.exception()
+        self.pending_writes = []
     
     ##============= MoGe =============##
 
@@ -320,18 +675,20 @@ class DiffusionAsShaderPipeline:
             outline=tuple(color),
         )
     
-    def visualize_tracking_moge(self, points, mask, save_tracking=True):
+    def visualize_tracking_moge(self, points, mask, save_tracking=True, zero_copy=False):
         """Visualize tracking results from MoGe model
         
         Args:
-            points (numpy.ndarray): Points array of shape [T, H, W, 3]
+            points (numpy.ndarray or torch.Tensor): Points array of shape [T, H, W, 3], tensors are rendered on their device
             mask (numpy.ndarray): Binary mask of shape [H, W]
-            save_tracking (bool): Whether to save tracking video
+            save_tracking (bool): Whether to save tracking video, written in the background
+            zero_copy (bool): Return the rendered uint8 frames [T, H, W, 3] instead of a float copy
             
         Returns:
             tuple: (tracking_path, tracking_video)
                 - tracking_path (str): Path to saved tracking video, None if save_tracking is False
-                - tracking_video (torch.Tensor): Tracking visualization tensor of shape [T, C, H, W] in range [0,1]
+                - tracking_video (torch.Tensor): Tracking visualization tensor of shape [T, C, H, W] in range [0,1],
+                  or uint8 frames [T, H, W, 3] if zero_copy is True
         """
         # Create color array
         T, H, W, _ = points.shape
@@ -345,6 +702,8 @@ class DiffusionAsShaderPipeline:
 
         # Set B channel - based on depth
         z_values = points[0, :, :, 2]  # get z values
+        if isinstance(z_values, torch.Tensor):
+            z_values = z_values.cpu().numpy()
         inv_z = 1 / z_values  # calculate 1/z
         # Calculate 2% and 98% percentiles
         p2 = np.percentile(inv_z, 2)
@@ -356,92 +715,48 @@ class DiffusionAsShaderPipeline:
         
         points = points.reshape(T, -1, 3)
         colors = colors.reshape(-1, 3)
-        
-        # Initialize list to store frames
-        frames = []
-        
-        for i, pts_i in enumerate(tqdm(points, desc="rendering frames")):
-            pixels, depths = pts_i[..., :2], pts_i[..., 2]
-            pixels[..., 0] = pixels[..., 0] * W
-            pixels[..., 1] = pixels[..., 1] * H
-            pixels = pixels.astype(int)
-            
-            valid = self.valid_mask(pixels, W, H)
-            frame_rgb = colors[valid]
-            pixels = pixels[valid]
-            depths = depths[valid]
-            
-            img = Image.fromarray(np.uint8(np.zeros([H, W, 3])), mode="RGB")
-            sorted_pixels, _, sort_index = self.sort_points_by_depth(pixels, depths)
-            step = 1
-            sorted_pixels = sorted_pixels[::step]
-            sorted_rgb = frame_rgb[sort_index][::step]
-            
-            for j in range(sorted_pixels.shape[0]):
-                self.draw_rectangle(
-                    img,
-                    coord=(sorted_pixels[j, 0], sorted_pixels[j, 1]),
-                    side_length=2,
-                    color=sorted_rgb[j],
-                )
-            frames.append(np.array(img))
-
-        # Convert frames to video tensor in range [0,1]
-        tracking_video = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2).float() / 255.0
 
-        tracking_path = None
-        if save_tracking:
-            try:
-                tracking_path = os.path.join(self.output_dir, "tracking_video_moge.mp4")
-                # Convert back to uint8 for saving
-                uint8_frames = [frame.astype(np.uint8) for frame in frames]
-                clip = ImageSequenceClip(uint8_frames, fps=self.fps)
-                clip.write_videofile(tracking_path, codec="libx264", fps=self.fps, logger=None)
-                print(f"Video saved to {tracking_path}")
-            except Exception as e:
-                print(f"Warning: Failed to save tracking video: {e}")
-                tracking_path = None
+        # Scale normalized coordinates to pixels and splat every frame with a depth test
+        scale = np.array([W, H, 1], dtype=np.float32)
+        if isinstance(points, torch.Tensor):
+            pixels = points * torch.from_numpy(scale).to(points.device)
+        else:
+            pixels = points * scale
+        frames = splat_points(pixels, colors, H, W, point_size=2)
+        if isinstance(frames, torch.Tensor):
+            frames = frames.cpu()
 
-        return tracking_path, tracking_video
+        return self._handoff_tracking(frames, "tracking_video_moge.mp4", save_tracking, zero_copy)
 
 
     ##============= CoTracker =============##
 
-    def generate_tracking_cotracker(self, video_tensor, density=70):
+    def generate_tracking_cotracker(self, video_tensor, density=70, video_depth=None):
         """Generate tracking video
         
         Args:
             video_tensor (torch.Tensor): Input video tensor
+            density (int): Grid size of the tracked points
+            video_depth (torch.Tensor): Precomputed depth [T, 1, H, W], estimated if None
             
         Returns:
             tuple: (pred_tracks, pred_visibility)
                 - pred_tracks (torch.Tensor): Tracking points with depth [T, N, 3]
                 - pred_visibility (torch.Tensor): Visibility mask [T, N, 1]
         """
-        # Generate tracking points
-        if not hasattr(self, 'cotracker') or self.cotracker is None:
-            self.cotracker = torch.hub.load("facebookresearch/co-tracker", "cotracker3_offline").to(self.device)
-        
-        # Load depth model
-        if not hasattr(self, 'depth_preprocessor') or self.depth_preprocessor is None:
-            self.depth_preprocessor = DepthPreprocessor.from_pretrained("Intel/zoedepth-nyu-kitti").to(self.device)
-        
         try:
             video = video_tensor.unsqueeze(0).to(self.device)
             
             # Process all frames to get depth maps
-            video_depths = []
-            for i in tqdm(range(video_tensor.shape[0]), desc="estimating depth"):
-                frame = (video_tensor[i].permute(1, 2, 0).cpu().numpy() * 255).astype(np.uint8)
-                depth = self.depth_preprocessor(Image.fromarray(frame))[0]
-                depth_tensor = transforms.ToTensor()(depth)  # [1, H, W]
-                video_depths.append(depth_tensor)
-            
-            video_depth = torch.stack(video_depths, dim=0).to(self.device)  # [T, 1, H, W]
+            if video_depth is None:
+                video_depth = self.estimate_depth(video[0])  # [T, 1, H, W]
+            video_depth = video_depth.to(self.device)
             
             # Get tracking points and visibility
             print("tracking...")
-            pred_tracks, pred_visibility = self.cotracker(video, grid_size=density)  # B T N 2,  B T N 1
+            with self.tracker_pool.use("cotracker") as cotracker:
+                self.cotracker = cotracker
+                pred_tracks, pred_visibility = self.cotracker(video, grid_size=density)  # B T N 2,  B T N 1
             
             # Extract dimensions
             B, T, N, _ = pred_tracks.shape
@@ -472,19 +787,19 @@ class DiffusionAsShaderPipeline:
             return pred_tracks_with_depth.squeeze(0), pred_visibility.squeeze(0)
             
         finally:
-            del self.cotracker
-            del self.depth_preprocessor
+            # The backends stay warm in the tracker pool, only drop cached activations
             torch.cuda.empty_cache()
 
-    def visualize_tracking_cotracker(self, points, vis_mask=None, save_tracking=True, point_wise=4, video_size=(480, 720)):
+    def visualize_tracking_cotracker(self, points, vis_mask=None, save_tracking=True, point_wise=4, video_size=(480, 720), zero_copy=False):
         """Visualize tracking results from CoTracker
         
         Args:
             points (torch.Tensor): Points array of shape [T, N, 3]
             vis_mask (torch.Tensor): Visibility mask of shape [T, N, 1]
-            save_tracking (bool): Whether to save tracking video
+            save_tracking (bool): Whether to save tracking video, written in the background
             point_wise (int): Size of points in visualization
             video_size (tuple): Render size (height, width)
+            zero_copy (bool): Return the rendered uint8 frames [T, H, W, 3] instead of a float copy
             
         Returns:
             tuple: (tracking_path, tracking_video)
@@ -527,65 +842,30 @@ class DiffusionAsShaderPipeline:
             normalized_z = np.clip((inv_z - p2) / (p98 - p2 + 1e-10), 0, 1)
             colors[:, 2] = (normalized_z * 255).astype(np.uint8)
         
-        frames = []
-        
-        for i in tqdm(range(T), desc="rendering frames"):
-            pts_i = points[i]
-            
-            visibility = vis_mask[i]
-            
-            pixels, depths = pts_i[visibility, :2], pts_i[visibility, 2]
-            pixels = pixels.astype(int)
-            
-            in_frame = self.valid_mask(pixels, W, H) 
-            pixels = pixels[in_frame]
-            depths = depths[in_frame]
-            frame_rgb = colors[visibility][in_frame]
-            
-            img = Image.fromarray(np.zeros((H, W, 3), dtype=np.uint8), mode="RGB")
-            
-            sorted_pixels, _, sort_index = self.sort_points_by_depth(pixels, depths)
-            sorted_rgb = frame_rgb[sort_index]
-            
-            for j in range(sorted_pixels.shape[0]):
-                self.draw_rectangle(
-                    img,
-                    coord=(sorted_pixels[j, 0], sorted_pixels[j, 1]),
-                    side_length=point_wise,
-                    color=sorted_rgb[j],
-                )
-            
-            frames.append(np.array(img))
+        frames = splat_points(points, colors, H, W, point_size=point_wise, valid=vis_mask.astype(bool))
         
-        # Convert frames to video tensor in range [0,1]
-        tracking_video = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2).float() / 255.0
-
-        tracking_path = None
-        if save_tracking:
-            try:
-                tracking_path = os.path.join(self.output_dir, "tracking_video_cotracker.mp4")
-                # Convert back to uint8 for saving
-                uint8_frames = [frame.astype(np.uint8) for frame in frames]
-                clip = ImageSequenceClip(uint8_frames, fps=self.fps)
-                clip.write_videofile(tracking_path, codec="libx264", fps=self.fps, logger=None)
-                print(f"Video saved to {tracking_path}")
-            except Exception as e:
-                print(f"Warning: Failed to save tracking video: {e}")
-                tracking_path = None
-
-        return tracking_path, tracking_video
+        return self._handoff_tracking(frames, "tracking_video_cotracker.mp4", save_tracking, zero_copy)
 
     
-    def apply_tracking(self, video_tensor, fps=8, tracking_tensor=None, img_cond_tensor=None, prompt=None, checkpoint_path=None, num_inference_steps=50):
+    def apply_tracking(self, video_tensor, fps=8, tracking_tensor=None, img_cond_tensor=None, prompt=None, checkpoint_path=None, num_inference_steps=50, tracking_latents=None, cache_threshold=None, window_overlap=9, progress_callback=None):
         """Generate final video with motion transfer
         
         Args:
             video_tensor (torch.Tensor): Input video tensor [T,C,H,W]
             fps (float): Input video FPS
-            tracking_tensor (torch.Tensor): Tracking video tensor [T,C,H,W]
+            tracking_tensor (torch.Tensor): Tracking video tensor [T,C,H,W], or uint8 frames [T,H,W,C]
             image_tensor (torch.Tensor): First frame tensor [C,H,W] to use for generation
             prompt (str): Generation prompt
             checkpoint_path (str): Path to model checkpoint
+            tracking_latents (torch.Tensor): Precomputed VAE latents of `tracking_tensor`, encoded if None
+            cache_threshold (float): Reuse the transformer block residual on steps whose input changed less than this,
+                trading a little quality for speed (e.g. 0.1-0.2), None to evaluate every step
+            window_overlap (int): Frames shared by consecutive windows when the tracking video is longer than 49 frames
+            progress_callback (callable): Called as `progress_callback(frames_written, total_frames)` while a 49-frame
+                result is streamed to disk, not called when `self.job_scheduler` batches the request
+
+        Returns:
+            str: Path of the generated video
         """
         self.fps = fps
 
@@ -595,18 +875,61 @@ class DiffusionAsShaderPipeline:
         
         # Generate final video
         final_output = os.path.join(os.path.abspath(self.output_dir), "result.mp4")
+        if tracking_tensor.shape[0] > WINDOW_FRAMES:
+            # Long videos are generated in overlapping windows, the tracking latents are encoded per window
+            self._infer_long(
+                prompt=prompt,
+                model_path=checkpoint_path,
+                tracking_tensor=tracking_tensor,
+                image_tensor=img_cond_tensor,
+                output_path=final_output,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=6.0,
+                dtype=torch.bfloat16,
+                fps=self.fps,
+                window_overlap=window_overlap,
+                cache_threshold=cache_threshold,
+            )
+            print(f"Final video generated successfully at: {final_output}")
+            return final_output
+
+        if self.job_scheduler is not None:
+            # Compatible requests of other jobs may share the denoising batch
+            self.job_scheduler.submit(GenerationRequest(
+                prompt=prompt,
+                image_tensor=img_cond_tensor,
+                tracking_tensor=tracking_tensor,
+                model_path=checkpoint_path,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=6.0,
+                dtype=torch.bfloat16,
+                tracking_latents=tracking_latents,
+                cache_threshold=cache_threshold,
+                output_path=final_output,
+                fps=self.fps,
+                sequential_cfg=self.sequential_cfg,
+                vae_slicing=self.vae_slicing,
+                vae_tiling=self.vae_tiling,
+            )).result()
+            print(f"Final video generated successfully at: {final_output}")
+            return final_output
+
         self._infer(
             prompt=prompt,
             model_path=checkpoint_path,
             tracking_tensor=tracking_tensor,
             image_tensor=img_cond_tensor,
             output_path=final_output,
-            num_inference_steps=50,
+            num_inference_steps=num_inference_steps,
             guidance_scale=6.0,
             dtype=torch.bfloat16,
-            fps=self.fps
+            fps=self.fps,
+            tracking_latents=tracking_latents,
+            cache_threshold=cache_threshold,
+            progress_callback=progress_callback,
         )
         print(f"Final video generated successfully at: {final_output}")
+        return final_output
 
     def _set_object_motion(self, motion_type):
         """Set object motion type
@@ -627,6 +950,7 @@ class FirstFrameRepainter:
         self.device = f"cuda:{gpu_id}"
         self.output_dir = output_dir
         self.max_depth = 65.0
+        self.tracker_pool = get_tracker_pool(self.device)
         os.makedirs(output_dir, exist_ok=True)
         
     def repaint(self, image_tensor, prompt, depth_path=None, method="dav"):
@@ -651,23 +975,24 @@ class FirstFrameRepainter:
         # Get depth map
         if depth_path is None:
             if method == "moge":
-                self.moge_model = MoGeModel.from_pretrained("Ruicheng/moge-vitl").to(self.device)
-                depth_map = self.moge_model.infer(image_tensor.to(self.device))["depth"]
+                with self.tracker_pool.use("moge") as moge_model:
+                    self.moge_model = moge_model
+                    depth_map = self.moge_model.infer(image_tensor.to(self.device))["depth"]
                 depth_map = torch.clamp(depth_map, max=self.max_depth)
                 depth_normalized = 1.0 - (depth_map / self.max_depth)
                 depth_rgb = (depth_normalized * 255).cpu().numpy().astype(np.uint8)
                 control_image = Image.fromarray(depth_rgb).convert("RGB")
             elif method == "zoedepth":
-                self.depth_preprocessor = DepthPreprocessor.from_pretrained("Intel/zoedepth-nyu-kitti")
-                self.depth_preprocessor.to(self.device)
                 image_np = (image_tensor.permute(1, 2, 0).numpy() * 255).astype(np.uint8)
-                control_image = self.depth_preprocessor(Image.fromarray(image_np))[0].convert("RGB")
+                with self.tracker_pool.use("zoedepth") as depth_preprocessor:
+                    self.depth_preprocessor = depth_preprocessor
+                    control_image = self.depth_preprocessor(Image.fromarray(image_np))[0].convert("RGB")
                 control_image = control_image.point(lambda x: 255 - x) # the zoedepth depth is inverted
             else:
-                self.depth_preprocessor = DepthPreprocessor.from_pretrained("depth-anything/Depth-Anything-V2-Large-hf")
-                self.depth_preprocessor.to(self.device)
                 image_np = (image_tensor.permute(1, 2, 0).numpy() * 255).astype(np.uint8)
-                control_image = self.depth_preprocessor(Image.fromarray(image_np))[0].convert("RGB")
+                with self.tracker_pool.use("depth_anything") as depth_preprocessor:
+                    self.depth_preprocessor = depth_preprocessor
+                    control_image = self.depth_preprocessor(Image.fromarray(image_np))[0].convert("RGB")
         else:
             control_image = Image.open(depth_path).convert("RGB")
 
@@ -693,12 +1018,8 @@ class FirstFrameRepainter:
             return repainted_tensor
             
         finally:
-            # Clean up GPU memory
+            # Clean up GPU memory, depth backends stay warm in the tracker pool
             del flux_pipe
-            if method == "moge":
-                del self.moge_model
-            else:
-                del self.depth_preprocessor
             torch.cuda.empty_cache()
 
 class CameraMotionGenerator:
@@ -920,35 +1241,8 @@ class CameraMotionGenerator:
         Returns:
             torch.Tensor: Single rotation matrix [4, 4]
         """
-        angle_rad = math.radians(angle)
-        cos_theta = torch.cos(torch.tensor(angle_rad))
-        sin_theta = torch.sin(torch.tensor(angle_rad))
-        
-        if axis == 'x':
-            rot_mat = torch.tensor([
-                [1, 0, 0, 0],
-                [0, cos_theta, -sin_theta, 0],
-                [0, sin_theta, cos_theta, 0],
-                [0, 0, 0, 1]
-            ], dtype=torch.float32)
-        elif axis == 'y':
-            rot_mat = torch.tensor([
-                [cos_theta, 0, sin_theta, 0],
-                [0, 1, 0, 0],
-                [-sin_theta, 0, cos_theta, 0],
-                [0, 0, 0, 1]
-            ], dtype=torch.float32)
-        elif axis == 'z':
-            rot_mat = torch.tensor([
-                [cos_theta, -sin_theta, 0, 0],
-                [sin_theta, cos_theta, 0, 0],
-                [0, 0, 1, 0],
-                [0, 0, 0, 1]
-            ], dtype=torch.float32)
-        else:
-            raise ValueError("Invalid axis value. Choose 'x', 'y', or 'z'.")
-            
-        return rot_mat.to(self.device)
+        angles = torch.tensor([math.radians(angle)], dtype=torch.float64)
+        return axis_rotation_matrices(axis, angles)[0].float().to(self.device)
 
     def trans_poses(self, dx, dy, dz):
         """
@@ -960,32 +1254,9 @@ class CameraMotionGenerator:
         ret:
         - matrices: torch.Tensor
         """
-        trans_mats = torch.eye(4).unsqueeze(0).repeat(self.frame_num, 1, 1)  # (n, 4, 4)
-
-        delta_x = dx / (self.frame_num - 1)
-        delta_y = dy / (self.frame_num - 1)
-        delta_z = dz / (self.frame_num - 1)
-
-        for i in range(self.frame_num):
-            trans_mats[i, 0, 3] = i * delta_x
-            trans_mats[i, 1, 3] = i * delta_y
-            trans_mats[i, 2, 3] = i * delta_z
-
-        return trans_mats.to(self.device)
-    
-
-    def _look_at(self, camera_position, target_position):
-        # look at direction
-        direction = target_position - camera_position
-        direction /= np.linalg.norm(direction)
-        # calculate rotation matrix
-        up = np.array([0, 1, 0])
-        right = np.cross(up, direction)
-        right /= np.linalg.norm(right)
-        up = np.cross(direction, right)
-        rotation_matrix = np.vstack([right, up, direction])
-        rotation_matrix = np.linalg.inv(rotation_matrix)
-        return rotation_matrix
+        t = torch.linspace(0, 1, self.frame_num, dtype=torch.float64).unsqueeze(-1)
+        offsets = t * torch.tensor([dx, dy, dz], dtype=torch.float64)
+        return translation_matrices(offsets).float().to(self.device)
 
     def spiral_poses(self, radius, forward_ratio = 0.5, backward_ratio = 0.5, rotation_times = 0.1, look_at_times = 0.5):
         """Generate spiral camera poses
@@ -1000,33 +1271,8 @@ class CameraMotionGenerator:
         Returns:
             torch.Tensor: Camera poses of shape [num_frames, 4, 4]
         """
-        # Generate spiral trajectory
-        t = np.linspace(0, 1, self.frame_num)
-        r = np.sin(np.pi * t) * radius * rotation_times
-        theta = 2 * np.pi * t
-        
-        # Calculate camera positions
-        # Limit y motion for better floor/sky view
-        y = r * np.cos(theta) * 0.3  
-        x = r * np.sin(theta)
-        z = -r
-        z[z < 0] *= forward_ratio
-        z[z > 0] *= backward_ratio
-        
-        # Set look-at target
-        target_pos = np.array([0, 0, radius * look_at_times])
-        cam_pos = np.vstack([x, y, z]).T
-        cam_poses = []
-        
-        for pos in cam_pos:
-            rot_mat = self._look_at(pos, target_pos)
-            trans_mat = np.eye(4)
-            trans_mat[:3, :3] = rot_mat
-            trans_mat[:3, 3] = pos
-            cam_poses.append(trans_mat[None])
-            
-        camera_poses = np.concatenate(cam_poses, axis=0)
-        return torch.from_numpy(camera_poses).to(self.device)
+        poses = spiral_matrices(radius, self.frame_num, forward_ratio, backward_ratio, rotation_times, look_at_times)
+        return poses.to(self.device)
 
     def get_default_motion(self):
         """Parse motion parameters and generate corresponding motion matrices
@@ -1035,131 +1281,26 @@ class CameraMotionGenerator:
         - trans <dx> <dy> <dz> [start_frame] [end_frame]: Translation motion
         - rot <axis> <angle> [start_frame] [end_frame]: Rotation motion
         - spiral <radius> [start_frame] [end_frame]: Spiral motion
+        - key <frame> <tx> <ty> <tz> [<rx> <ry> <rz>]: Keyframe pose, translation and XYZ rotation in degrees
         
         Multiple transformations can be combined using semicolon (;) as separator:
         e.g., "trans 0 0 0.5 0 30; rot x 25 0 30; trans 0.1 0 0 30 48"
         
         Note:
             - start_frame and end_frame are optional
-            - frame range: 0-49 (will be clamped to this range)
-            - if not specified, defaults to 0-49
+            - frame range: 0 to frame_num - 1 (will be clamped to this range)
+            - if not specified, defaults to the whole range
             - frames after end_frame will maintain the final transformation
             - for combined transformations, they are applied in sequence
             - moving left, up and zoom out is positive in video
+            - all keyframes form one smooth trajectory (Catmull-Rom translation, SLERP rotation), applied
+              at the position of the first keyframe; frames outside the keyframes hold the nearest one
+            - the spec is compiled once per (spec, frame_num, device), see models/camera_motion.py
         
         Returns:
             torch.Tensor: Motion matrices [num_frames, 4, 4]
         """
-        if not isinstance(self.motion_type, str):
-            raise ValueError(f'camera_motion must be a string, but got {type(self.motion_type)}')
-        
-        # Split combined transformations
-        transform_sequences = [s.strip() for s in self.motion_type.split(';')]
-        
-        # Initialize the final motion matrices
-        final_motion = torch.eye(4, device=self.device).unsqueeze(0).repeat(49, 1, 1)
-        
-        # Process each transformation in sequence
-        for transform in transform_sequences:
-            params = transform.lower().split()
-            if not params:
-                continue
-                
-            motion_type = params[0]
-            
-            # Default frame range
-            start_frame = 0
-            end_frame = 48  # 49 frames in total (0-48)
-            
-            if motion_type == 'trans':
-                # Parse translation parameters
-                if len(params) not in [4, 6]:
-                    raise ValueError(f"trans motion requires 3 or 5 parameters: 'trans <dx> <dy> <dz>' or 'trans <dx> <dy> <dz> <start_frame> <end_frame>', got: {transform}")
-                
-                dx, dy, dz = map(float, params[1:4])
-                
-                if len(params) == 6:
-                    start_frame = max(0, min(48, int(params[4])))
-                    end_frame = max(0, min(48, int(params[5])))
-                    if start_frame > end_frame:
-                        start_frame, end_frame = end_frame, start_frame
-                
-                # Generate current transformation
-                current_motion = torch.eye(4, device=self.device).unsqueeze(0).repeat(49, 1, 1)
-                for frame_idx in range(49):
-                    if frame_idx < start_frame:
-                        continue
-                    elif frame_idx <= end_frame:
-                        t = (frame_idx - start_frame) / (end_frame - start_frame)
-                        current_motion[frame_idx, :3, 3] = torch.tensor([dx, dy, dz], device=self.device) * t
-                    else:
-                        current_motion[frame_idx] = current_motion[end_frame]
-                
-                # Combine with previous transformations
-                final_motion = torch.matmul(final_motion, current_motion)
-                
-            elif motion_type == 'rot':
-                # Parse rotation parameters
-                if len(params) not in [3, 5]:
-                    raise ValueError(f"rot motion requires 2 or 4 parameters: 'rot <axis> <angle>' or 'rot <axis> <angle> <start_frame> <end_frame>', got: {transform}")
-                
-                axis = params[1]
-                if axis not in ['x', 'y', 'z']:
-                    raise ValueError(f"Invalid rotation axis '{axis}', must be 'x', 'y' or 'z'")
-                angle = float(params[2])
-                
-                if len(params) == 5:
-                    start_frame = max(0, min(48, int(params[3])))
-                    end_frame = max(0, min(48, int(params[4])))
-                    if start_frame > end_frame:
-                        start_frame, end_frame = end_frame, start_frame
-                
-                current_motion = torch.eye(4, device=self.device).unsqueeze(0).repeat(49, 1, 1)
-                for frame_idx in range(49):
-                    if frame_idx < start_frame:
-                        continue
-                    elif frame_idx <= end_frame:
-                        t = (frame_idx - start_frame) / (end_frame - start_frame)
-                        current_angle = angle * t
-                        current_motion[frame_idx] = self.rot_poses(current_angle, axis)
-                    else:
-                        current_motion[frame_idx] = current_motion[end_frame]
-                
-                # Combine with previous transformations
-                final_motion = torch.matmul(final_motion, current_motion)
-                
-            elif motion_type == 'spiral':
-                # Parse spiral motion parameters
-                if len(params) not in [2, 4]:
-                    raise ValueError(f"spiral motion requires 1 or 3 parameters: 'spiral <radius>' or 'spiral <radius> <start_frame> <end_frame>', got: {transform}")
-                
-                radius = float(params[1])
-                
-                if len(params) == 4:
-                    start_frame = max(0, min(48, int(params[2])))
-                    end_frame = max(0, min(48, int(params[3])))
-                    if start_frame > end_frame:
-                        start_frame, end_frame = end_frame, start_frame
-                
-                current_motion = torch.eye(4, device=self.device).unsqueeze(0).repeat(49, 1, 1)
-                spiral_motion = self.spiral_poses(radius)
-                for frame_idx in range(49):
-                    if frame_idx < start_frame:
-                        continue
-                    elif frame_idx <= end_frame:
-                        t = (frame_idx - start_frame) / (end_frame - start_frame)
-                        idx = int(t * (len(spiral_motion) - 1))
-                        current_motion[frame_idx] = spiral_motion[idx]
-                    else:
-                        current_motion[frame_idx] = current_motion[end_frame]
-                
-                # Combine with previous transformations
-                final_motion = torch.matmul(final_motion, current_motion)
-                
-            else:
-                raise ValueError(f'camera_motion type must be in [trans, spiral, rot], but got {motion_type}')
-        
-        return final_motion
+        return compile_motion(self.motion_type, self.frame_num, self.device)
 
 class ObjectMotionGenerator:
     def __init__(self, device="cuda:0"):
@@ -0,0 +1,60 @@
+import warnings
+
+import torch
+
+
+class HostSyncCounter:
+    """Count host-device synchronizations per denoising step
+
+    Uses the CUDA sync debug mode, which warns on every operation that blocks the host
+    on the device (``.item()``, ``nonzero``, blocking copies to the CPU, ...). The warnings
+    are captured and counted instead of printed. Does nothing when disabled or without CUDA.
+
+    Example:
+        with HostSyncCounter() as counter:
+            for step in steps:
+                ...
+                counter.step()
+        print(counter.per_step)
+    """
+
+    _MESSAGE = "called a synchronizing CUDA operation"
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled and torch.cuda.is_available()
+        self.per_step = []
+        self._records = None
+        self._seen = 0
+
+    def __enter__(self):
+        if self.enabled:
+            self._previous_mode = torch.cuda.get_sync_debug_mode()
+            self._catcher = warnings.catch_warnings(record=True)
+            self._records = self._catcher.__enter__()
+            warnings.simplefilter("always")
+            torch.cuda.set_sync_debug_mode("warn")
+        return self
+
+    def _count(self):
+        if self._records is None:
+            return 0
+        return sum(1 for record in self._records if self._MESSAGE in str(record.message))
+
+    def step(self):
+        """Close the current step and record its number of synchronizations"""
+        if not self.enabled:
+            return
+        total = self._count()
+        self.per_step.append(total - self._seen)
+        self._seen = total
+
+    @property
+    def total(self):
+        return sum(self.per_step)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.enabled:
+            torch.cuda.set_sync_debug_mode(self._previous_mode)
+            self._catcher.__exit__(exc_type, exc, tb)
+            self._records = None
+        return False
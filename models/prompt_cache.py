@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def encoder_id(tokenizer=None, text_encoder=None):
+    """Identify the text encoder an embedding was produced with
+
+    The tokenizer path is preferred so the id stays the same while the text encoder is unloaded.
+    """
+    name = getattr(tokenizer, "name_or_path", None)
+    if not name and text_encoder is not None:
+        name = getattr(text_encoder.config, "_name_or_path", None)
+    return str(name or "t5")
+
+
+class PromptEmbeddingCache:
+    """Two-tier cache of T5 prompt embeddings
+
+    Entries are keyed by (encoder id, max_sequence_length, dtype, prompt text) and hold a
+    single [L, D] embedding. Recently used entries stay in memory, every entry is also written
+    to `cache_dir` (if given) as a raw .npy file that is memory-mapped back on a memory miss.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=64):
+        """
+        Args:
+            cache_dir (str): Directory of the on-disk tier, None to keep embeddings in memory only
+            max_entries (int): Number of embeddings kept in the in-memory LRU tier
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_id, max_sequence_length, dtype, prompt):
+        return (str(model_id), int(max_sequence_length), str(dtype).replace("torch.", ""), prompt)
+
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npy")
+
+    def _remember(self, key, embeds):
+        self._entries[key] = embeds
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            # copy-on-write mapping, pages are only read when the embedding is used
+            raw = np.load(path, mmap_mode="c")
+        except (OSError, ValueError):
+            return None
+        dtype = getattr(torch, key[2])
+        return torch.from_numpy(raw).view(dtype)
+
+    def _store(self, key, embeds):
+        path = self._path(key)
+        # numpy has no bfloat16, store the raw bytes and reinterpret them on load
+        raw = embeds.detach().cpu().contiguous().view(torch.uint8).numpy()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, raw)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        """Return the cached [L, D] embedding for `key` on CPU, or None"""
+        with self._lock:
+            embeds = self._entries.get(key)
+            if embeds is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embeds
+            if self.cache_dir is not None:
+                embeds = self._load(key)
+                if embeds is not None:
+                    self._remember(key, embeds)
+                    self.disk_hits += 1
+                    return embeds
+            self.misses += 1
+            return None
+
+    def put(self, key, embeds):
+        """Cache a single [L, D] embedding"""
+        embeds = embeds.detach().to("cpu")
+        with self._lock:
+            self._remember(key, embeds)
+            if self.cache_dir is not None:
+                self._store(key, embeds)
+
+    def fetch(self, prompts, encode_fn, model_id, max_sequence_length, dtype, device=None):
+        """Look up embeddings for a batch of prompts, encoding only the missing ones
+
+        Args:
+            prompts (list[str]): Prompt texts
+            encode_fn (callable): Maps a list of prompts to embeddings [B, L, D], only called on misses
+            model_id (str): Identifier of the tokenizer / text encoder, see `encoder_id`
+            max_sequence_length (int): Tokenizer max length
+            dtype (torch.dtype): Embedding dtype
+            device (torch.device): Device of the returned embeddings
+
+        Returns:
+            torch.Tensor: Prompt embeddings [B, L, D]
+        """
+        keys = [self.make_key(model_id, max_sequence_length, dtype, prompt) for prompt in prompts]
+        embeds = [self.get(key) for key in keys]
+
+        missing = [i for i, e in enumerate(embeds) if e is None]
+        if missing:
+            # the same prompt may appear several times in a batch, encode it once
+            unique = list(OrderedDict.fromkeys(prompts[i] for i in missing))
+            encoded = encode_fn(unique).to(dtype=dtype)
+            by_prompt = {}
+            for prompt, embed in zip(unique, encoded):
+                by_prompt[prompt] = embed
+                self.put(self.make_key(model_id, max_sequence_length, dtype, prompt), embed)
+            for i in missing:
+                embeds[i] = by_prompt[prompts[i]]
+
+        return torch.stack([e.to(device=device, dtype=dtype) for e in embeds], dim=0)
+
+    def clear(self, disk=False):
+        """Drop the in-memory tier, and the on-disk tier if `disk` is True"""
+        with self._lock:
+            self._entries.clear()
+            if disk and self.cache_dir is not None:
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(".npy"):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "resident": len(self._entries),
+            }
+
+
+class PromptCacheMixin:
+    """Route the T5 prompt encoding of a CogVideoX pipeline through a `PromptEmbeddingCache`
+
+    The text encoder is only called for prompts that miss the cache, so it can stay unloaded
+    (``text_encoder=None``) as long as every prompt hits.
+    """
+
+    prompt_cache = None
+
+    def set_prompt_cache(self, prompt_cache):
+        self.prompt_cache = prompt_cache
+
+    def _get_t5_prompt_embeds(
+        self,
+        prompt=None,
+        num_videos_per_prompt=1,
+        max_sequence_length=226,
+        device=None,
+        dtype=None,
+    ):
+        if self.prompt_cache is None:
+            return super()._get_t5_prompt_embeds(
+                prompt=prompt,
+                num_videos_per_prompt=num_videos_per_prompt,
+                max_sequence_length=max_sequence_length,
+                device=device,
+                dtype=dtype,
+            )
+
+        device = device or self._execution_device
+        if dtype is None:
+            dtype = self.text_encoder.dtype if self.text_encoder is not None else self.transformer.dtype
+        prompt = [prompt] if isinstance(prompt, str) else prompt
+
+        def encode(prompts):
+            if self.text_encoder is None:
+                raise ValueError("Prompt embeddings are not cached and no text encoder is loaded.")
+            return super(PromptCacheMixin, self)._get_t5_prompt_embeds(
+                prompt=prompts,
+                num_videos_per_prompt=1,
+                max_sequence_length=max_sequence_length,
+                device=device,
+                dtype=dtype,
+            )
+
+        prompt_embeds = self.prompt_cache.fetch(
+            prompt,
+            encode,
+            encoder_id(self.tokenizer, self.text_encoder),
+            max_sequence_length,
+            dtype,
+            device=device,
+        )
+
+        # duplicate text embeddings for each generation per prompt, using mps friendly method
+        batch_size, seq_len, _ = prompt_embeds.shape
+        prompt_embeds = prompt_embeds.repeat(1, num_videos_per_prompt, 1)
+        return prompt_embeds.view(batch_size * num_videos_per_prompt, seq_len, -1)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_prompt_cache(cache_dir=None, max_entries=64):
+    """Return the process-wide prompt embedding cache for `cache_dir`"""
+    key = os.path.abspath(cache_dir) if cache_dir is not None else None
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PromptEmbeddingCache(cache_dir=cache_dir, max_entries=max_entries)
+        return _caches[key]
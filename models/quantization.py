@@ -0,0 +1,145 @@
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+# Kept in the checkpoint dtype: the zero-initialized tracking mixers, the AdaLN modulation of the norms and the
+# embedding / output projections, which are small but sensitive
+DEFAULT_EXCLUDE = ("combine_linears", "initial_combine_linear", "norm", "patch_embed", "time_embedding", "proj_out")
+
+
+class WeightOnlyLinear(nn.Module):
+    """`nn.Linear` with int8 or packed int4 weights, dequantized to the input dtype on every call
+
+    Weights are quantized symmetrically with one scale per output channel and group of `group_size`
+    input channels. int4 values are stored two per byte.
+    """
+
+    def __init__(self, in_features, out_features, bias=True, bits=8, group_size=128, dtype=torch.bfloat16):
+        """
+        Args:
+            in_features (int): Input channels
+            out_features (int): Output channels
+            bias (bool): Whether the layer has a bias, kept in `dtype`
+            bits (int): 8 or 4
+            group_size (int): Input channels sharing one scale, None for one scale per output channel
+            dtype (torch.dtype): Dtype of the scales and bias
+        """
+        super().__init__()
+        if bits not in (4, 8):
+            raise ValueError(f"bits must be 4 or 8, got {bits}")
+        group_size = group_size or in_features
+        if in_features % group_size:
+            raise ValueError(f"in_features {in_features} is not divisible by group_size {group_size}")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size
+
+        packed_in = in_features // 2 if bits == 4 else in_features
+        self.register_buffer("qweight", torch.zeros(out_features, packed_in, dtype=torch.uint8 if bits == 4 else torch.int8))
+        self.register_buffer("scale", torch.ones(out_features, in_features // group_size, dtype=dtype))
+        self.bias = nn.Parameter(torch.zeros(out_features, dtype=dtype), requires_grad=False) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear, bits=8, group_size=128):
+        """Quantize the weights of an `nn.Linear`"""
+        module = cls(
+            linear.in_features, linear.out_features, linear.bias is not None, bits, group_size, linear.weight.dtype
+        )
+        module.quantize_(linear.weight.data)
+        if linear.bias is not None:
+            module.bias.data.copy_(linear.bias.data)
+        return module.to(linear.weight.device)
+
+    @torch.no_grad()
+    def quantize_(self, weight):
+        qmax = 2 ** (self.bits - 1) - 1
+        grouped = weight.float().reshape(self.out_features, -1, self.group_size)
+        scale = grouped.abs().amax(dim=-1, keepdim=True).clamp_min(1e-8) / qmax
+        q = torch.round(grouped / scale).clamp_(-qmax - 1, qmax).to(torch.int8).reshape(self.out_features, -1)
+        if self.bits == 4:
+            q = (q + 8).to(torch.uint8)
+            q = q[:, 0::2] | (q[:, 1::2] << 4)
+        self.qweight.copy_(q)
+        self.scale.copy_(scale.squeeze(-1))
+
+    def dequantize(self, dtype=None):
+        """Weight `[out_features, in_features]` in `dtype`, defaults to the scale dtype"""
+        q = self.qweight
+        if self.bits == 4:
+            q = torch.stack([q & 0xF, q >> 4], dim=-1).reshape(self.out_features, self.in_features).to(torch.int8) - 8
+        dtype = dtype or self.scale.dtype
+        weight = q.to(dtype).reshape(self.out_features, -1, self.group_size) * self.scale.to(dtype).unsqueeze(-1)
+        return weight.reshape(self.out_features, self.in_features)
+
+    def forward(self, x):
+        bias = self.bias.to(x.dtype) if self.bias is not None else None
+        return F.linear(x, self.dequantize(x.dtype), bias)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}, group_size={self.group_size}"
+
+
+def quantizable_linears(model, include=None, exclude=DEFAULT_EXCLUDE):
+    """Names of the `nn.Linear` modules selected for quantization
+
+    Args:
+        model (nn.Module): Model to search
+        include (tuple[str]): Name prefixes to quantize, e.g. ("transformer_blocks.",), None for every linear
+        exclude (tuple[str]): Name fragments kept in higher precision
+
+    Returns:
+        list[str]: Qualified module names
+    """
+    names = []
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Linear):
+            continue
+        if include is not None and not name.startswith(tuple(include)):
+            continue
+        if any(fragment in part for part in name.split(".") for fragment in exclude):
+            continue
+        names.append(name)
+    return names
+
+
+def _replace(model, name, module):
+    parent_name, _, child_name = name.rpartition(".")
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+
+def quantize_linears(model, bits=8, group_size=128, include=None, exclude=DEFAULT_EXCLUDE, modules=None, convert_weights=True):
+    """Replace `nn.Linear` modules with `WeightOnlyLinear` in place
+
+    Args:
+        model (nn.Module): Model to quantize
+        bits (int): 8 or 4
+        group_size (int): Input channels sharing one scale, None for per-channel scales
+        include (tuple[str]): Name prefixes to quantize, None for every linear
+        exclude (tuple[str]): Name fragments kept in higher precision
+        modules (list[str]): Explicit module names, overrides `include` and `exclude`
+        convert_weights (bool): Quantize the current weights; False only builds empty modules for loading a
+            quantized state dict
+
+    Returns:
+        dict: Quantization config `{"bits", "group_size", "modules"}` to store with the checkpoint
+    """
+    if modules is None:
+        modules = quantizable_linears(model, include, exclude)
+    for name in modules:
+        linear = model.get_submodule(name)
+        if convert_weights:
+            quantized = WeightOnlyLinear.from_linear(linear, bits, group_size)
+        else:
+            quantized = WeightOnlyLinear(
+                linear.in_features, linear.out_features, linear.bias is not None, bits, group_size, linear.weight.dtype
+            )
+        _replace(model, name, quantized)
+    return {"bits": bits, "group_size": group_size, "modules": list(modules)}
+
+
+def module_bytes(model):
+    """Bytes held by the parameters and buffers of `model`"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
@@ -0,0 +1,139 @@
+import numpy as np
+import torch
+
+
+def _footprint_offsets(point_size):
+    """Pixel offsets covered by a square point, matching the inclusive PIL rectangle of side `point_size`"""
+    half = point_size // 2
+    r = np.arange(-half, half + 1)
+    dy, dx = np.meshgrid(r, r, indexing="ij")
+    return dx.reshape(-1), dy.reshape(-1)
+
+
+def _splat_numpy(points, colors, valid, height, width, point_size):
+    T, N, _ = points.shape
+    xy = points[..., :2]
+    depth = points[..., 2].astype(np.float64)
+
+    finite = np.isfinite(xy).all(axis=-1)
+    pixels = np.where(finite[..., None], xy, -1).astype(np.int64)
+    x, y = pixels[..., 0], pixels[..., 1]
+    keep = finite & (x >= 0) & (x < width) & (y > 0) & (y < height)
+    if valid is not None:
+        keep &= valid
+    # points without a usable depth lose every depth test
+    depth = np.where(np.isfinite(depth), depth, np.inf)
+
+    t_idx, n_idx = np.nonzero(keep)
+    x, y, depth = x[t_idx, n_idx], y[t_idx, n_idx], depth[t_idx, n_idx]
+    color = colors[n_idx] if colors.ndim == 2 else colors[t_idx, n_idx]
+
+    dx, dy = _footprint_offsets(point_size)
+    px = (x[:, None] + dx[None]).reshape(-1)
+    py = (y[:, None] + dy[None]).reshape(-1)
+    entry = np.repeat(np.arange(len(x)), len(dx))
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    px, py, entry = px[inside], py[inside], entry[inside]
+
+    flat = (t_idx[entry] * height + py) * width + px
+    # nearest point wins; ties go to the lowest entry so the result is deterministic
+    order = np.lexsort((entry, depth[entry], flat))
+    flat_sorted = flat[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = flat_sorted[1:] != flat_sorted[:-1]
+    winners = order[first]
+
+    frames = np.zeros((T * height * width, 3), dtype=np.uint8)
+    frames[flat[winners]] = color[entry[winners]]
+    return frames.reshape(T, height, width, 3)
+
+
+def _splat_torch(points, colors, valid, height, width, point_size):
+    T, N, _ = points.shape
+    device = points.device
+    xy = points[..., :2]
+    depth = points[..., 2].double()
+
+    finite = torch.isfinite(xy).all(dim=-1)
+    pixels = torch.where(finite[..., None], xy, torch.full_like(xy, -1)).long()
+    x, y = pixels[..., 0], pixels[..., 1]
+    keep = finite & (x >= 0) & (x < width) & (y > 0) & (y < height)
+    if valid is not None:
+        keep &= valid.to(device=device, dtype=torch.bool)
+    depth = torch.where(torch.isfinite(depth), depth, torch.full_like(depth, float("inf")))
+
+    t_idx, n_idx = torch.nonzero(keep, as_tuple=True)
+    x, y, depth = x[t_idx, n_idx], y[t_idx, n_idx], depth[t_idx, n_idx]
+    color = colors[n_idx] if colors.ndim == 2 else colors[t_idx, n_idx]
+
+    dx, dy = _footprint_offsets(point_size)
+    dx = torch.from_numpy(dx).to(device)
+    dy = torch.from_numpy(dy).to(device)
+    px = (x[:, None] + dx[None]).reshape(-1)
+    py = (y[:, None] + dy[None]).reshape(-1)
+    entry = torch.arange(len(x), device=device).repeat_interleave(len(dx))
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    px, py, entry = px[inside], py[inside], entry[inside]
+
+    flat = (t_idx[entry] * height + py) * width + px
+    num_pixels = T * height * width
+
+    # depth test: keep the nearest depth per pixel, then the lowest entry among equally near points
+    zbuf = torch.full((num_pixels,), float("inf"), dtype=depth.dtype, device=device)
+    zbuf = zbuf.scatter_reduce(0, flat, depth[entry], reduce="amin")
+    nearest = depth[entry] <= zbuf[flat]
+    winner = torch.full((num_pixels,), len(x), dtype=torch.long, device=device)
+    winner = winner.scatter_reduce(0, flat[nearest], entry[nearest], reduce="amin")
+
+    covered = winner < len(x)
+    frames = torch.zeros((num_pixels, 3), dtype=torch.uint8, device=device)
+    frames[covered] = color[winner[covered]].to(torch.uint8)
+    return frames.reshape(T, height, width, 3)
+
+
+def splat_points(points, colors, height, width, point_size=2, valid=None, frames_per_batch=8):
+    """Rasterize colored points into frames with a depth test, nearest point wins
+
+    Each point covers a square of `2 * (point_size // 2) + 1` pixels centred on its
+    truncated pixel coordinate, the same area the PIL rectangles used to cover.
+    Points are rejected with the same bounds test as `DiffusionAsShaderPipeline.valid_mask`.
+
+    Args:
+        points (numpy.ndarray or torch.Tensor): Points [T, N, 3] or [N, 3] as (x, y, depth) in pixels
+        colors (numpy.ndarray or torch.Tensor): uint8 colors [N, 3] or [T, N, 3]
+        height (int): Frame height
+        width (int): Frame width
+        point_size (int): Side length of the splat
+        valid (numpy.ndarray or torch.Tensor): Optional boolean mask [T, N] of points to draw
+        frames_per_batch (int): Frames rasterized per vectorized pass, None for the whole clip
+
+    Returns:
+        numpy.ndarray or torch.Tensor: uint8 frames [T, H, W, 3], same type (and device) as `points`
+    """
+    single = points.ndim == 2
+    if single:
+        points = points[None]
+        valid = valid[None] if valid is not None else None
+
+    T = points.shape[0]
+    step = T if not frames_per_batch else frames_per_batch
+
+    if isinstance(points, torch.Tensor):
+        colors = torch.as_tensor(colors, device=points.device)
+        if valid is not None:
+            valid = torch.as_tensor(valid, device=points.device)
+        splat, cat = _splat_torch, torch.cat
+    else:
+        colors = np.asarray(colors, dtype=np.uint8)
+        if valid is not None:
+            valid = np.asarray(valid, dtype=bool)
+        splat, cat = _splat_numpy, np.concatenate
+
+    chunks = []
+    for start in range(0, T, step):
+        end = start + step
+        chunk_colors = colors if colors.ndim == 2 else colors[start:end]
+        chunk_valid = valid[start:end] if valid is not None else None
+        chunks.append(splat(points[start:end], chunk_colors, chunk_valid, height, width, point_size))
+    frames = cat(chunks, 0)
+    return frames[0] if single else frames
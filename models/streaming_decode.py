@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import torch
+
+
+def frame_batches(num_frames, frame_batch_size):
+    """Latent frame ranges the CogVideoX VAE decodes together, the remainder goes to the first batch"""
+    num_batches = max(num_frames // frame_batch_size, 1)
+    remaining_frames = num_frames % frame_batch_size
+    for k in range(num_batches):
+        start_frame = frame_batch_size * k + (0 if k == 0 else remaining_frames)
+        end_frame = frame_batch_size * (k + 1) + remaining_frames
+        yield start_frame, end_frame
+
+
+def _decode_chunk(vae, z, conv_cache):
+    if vae.post_quant_conv is not None:
+        z = vae.post_quant_conv(z)
+    return vae.decoder(z, conv_cache=conv_cache)
+
+
+@torch.no_grad()
+def iter_decode_latents(vae, latents):
+    """Decode CogVideoX latents in causal temporal chunks
+
+    Follows `AutoencoderKLCogVideoX._decode` / `tiled_decode`, with the loop over time outermost:
+    every chunk of latent frames is decoded (tile by tile when tiling is enabled, each tile carrying
+    its own causal conv cache) and yielded before the next one is touched.
+
+    Args:
+        vae (AutoencoderKLCogVideoX): VAE of the pipeline
+        latents (torch.Tensor): Pipeline latents [B, F, C, H, W], scaled by `vae.config.scaling_factor`
+
+    Yields:
+        torch.Tensor: Video chunks [B, C, f, H, W] in range [-1, 1]
+    """
+    z = latents.permute(0, 2, 1, 3, 4) / vae.config.scaling_factor
+    _, _, num_frames, height, width = z.shape
+    frame_batch_size = vae.num_latent_frames_batch_size
+
+    tiled = vae.use_tiling and (width > vae.tile_latent_min_width or height > vae.tile_latent_min_height)
+    if not tiled:
+        conv_cache = None
+        for start_frame, end_frame in frame_batches(num_frames, frame_batch_size):
+            chunk, conv_cache = _decode_chunk(vae, z[:, :, start_frame:end_frame], conv_cache)
+            yield chunk
+        return
+
+    overlap_height = int(vae.tile_latent_min_height * (1 - vae.tile_overlap_factor_height))
+    overlap_width = int(vae.tile_latent_min_width * (1 - vae.tile_overlap_factor_width))
+    blend_extent_height = int(vae.tile_sample_min_height * vae.tile_overlap_factor_height)
+    blend_extent_width = int(vae.tile_sample_min_width * vae.tile_overlap_factor_width)
+    row_limit_height = vae.tile_sample_min_height - blend_extent_height
+    row_limit_width = vae.tile_sample_min_width - blend_extent_width
+    tile_rows = list(range(0, height, overlap_height))
+    tile_cols = list(range(0, width, overlap_width))
+
+    conv_caches = {}
+    for start_frame, end_frame in frame_batches(num_frames, frame_batch_size):
+        rows = []
+        for i in tile_rows:
+            row = []
+            for j in tile_cols:
+                tile = z[:, :, start_frame:end_frame, i:i + vae.tile_latent_min_height, j:j + vae.tile_latent_min_width]
+                tile, conv_caches[i, j] = _decode_chunk(vae, tile, conv_caches.get((i, j)))
+                row.append(tile)
+            rows.append(row)
+
+        result_rows = []
+        for i, row in enumerate(rows):
+            result_row = []
+            for j, tile in enumerate(row):
+                if i > 0:
+                    tile = vae.blend_v(rows[i - 1][j], tile, blend_extent_height)
+                if j > 0:
+                    tile = vae.blend_h(row[j - 1], tile, blend_extent_width)
+                result_row.append(tile[:, :, :, :row_limit_height, :row_limit_width])
+            result_rows.append(torch.cat(result_row, dim=4))
+        yield torch.cat(result_rows, dim=3)
+
+
+def chunk_to_uint8(chunk):
+    """Decoded chunk [B, C, f, H, W] in [-1, 1] of the first video to uint8 frames [f, H, W, C] on the CPU"""
+    frames = (chunk[0] / 2 + 0.5).clamp(0, 1).mul(255).round().to(torch.uint8)
+    return frames.permute(1, 2, 3, 0).cpu().numpy()
+
+
+class StreamingVideoWriter:
+    """Append uint8 frames to an mp4 file as they arrive
+
+    Example:
+        with StreamingVideoWriter(path, fps=8) as writer:
+            for frames in chunks:
+                writer.write(frames)
+    """
+
+    def __init__(self, path, fps=8, codec="libx264"):
+        """
+        Args:
+            path (str): Output mp4 path
+            fps (int): Frame rate
+            codec (str): ffmpeg video codec
+        """
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.frames_written = 0
+        self._writer = None
+
+    def write(self, frames):
+        """Append uint8 frames [N, H, W, 3]"""
+        import imageio_ffmpeg
+
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        if self._writer is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            height, width = frames.shape[1:3]
+            self._writer = imageio_ffmpeg.write_frames(self.path, (width, height), fps=self.fps, codec=self.codec)
+            self._writer.send(None)  # start the ffmpeg process
+        for frame in frames:
+            self._writer.send(frame)
+        self.frames_written += len(frames)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def stream_decode_to_video(vae, latents, path, fps=8, progress_callback=None):
+    """Decode latents chunk by chunk straight into an mp4 file
+
+    Only one chunk of decoded frames is held at a time, and the first frames reach the file
+    after the first chunk instead of after the whole decode.
+
+    Args:
+        vae (AutoencoderKLCogVideoX): VAE of the pipeline
+        latents (torch.Tensor): Latents [B, F, C, H, W] of the first video in the batch to write
+        path (str): Output mp4 path
+        fps (int): Frame rate
+        progress_callback (callable): Called as `progress_callback(frames_written, total_frames)` after every chunk
+
+    Returns:
+        str: `path`
+    """
+    total_frames = (latents.shape[1] - 1) * vae.config.temporal_compression_ratio + 1
+    with StreamingVideoWriter(path, fps=fps) as writer:
+        for chunk in iter_decode_latents(vae, latents[:1]):
+            writer.write(chunk_to_uint8(chunk))
+            if progress_callback is not None:
+                progress_callback(writer.frames_written, total_frames)
+    return path
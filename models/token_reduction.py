@@ -0,0 +1,67 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+def pooled_grid(grid, stride):
+    """Token grid `(frames, height, width)` after spatial pooling with `stride`"""
+    frames, height, width = grid
+    return frames, math.ceil(height / stride), math.ceil(width / stride)
+
+
+def pool_tokens(tokens, grid, stride):
+    """Average-pool video tokens over non-overlapping `stride` x `stride` spatial windows
+
+    Args:
+        tokens (torch.Tensor): Tokens `[B, F*H*W, D]` in frame, row, column order
+        grid (tuple[int, int, int]): Token grid `(F, H, W)`
+        stride (int): Spatial pooling factor, windows at the right and bottom border may be partial
+
+    Returns:
+        torch.Tensor: Pooled tokens `[B, F*ceil(H/stride)*ceil(W/stride), D]`
+    """
+    batch_size, _, dim = tokens.shape
+    frames, height, width = grid
+    x = tokens.transpose(1, 2).reshape(batch_size, dim, frames, height, width)
+    x = F.avg_pool3d(x, kernel_size=(1, stride, stride), stride=(1, stride, stride), ceil_mode=True)
+    return x.flatten(2).transpose(1, 2)
+
+
+def unpool_tokens(tokens, grid, stride):
+    """Nearest-neighbour inverse of `pool_tokens`, every pooled token is copied back to its window
+
+    Args:
+        tokens (torch.Tensor): Pooled tokens `[B, F*h*w, D]`
+        grid (tuple[int, int, int]): Full token grid `(F, H, W)`
+        stride (int): Spatial pooling factor used by `pool_tokens`
+
+    Returns:
+        torch.Tensor: Tokens `[B, F*H*W, D]`
+    """
+    batch_size, _, dim = tokens.shape
+    frames, height, width = grid
+    _, pooled_height, pooled_width = pooled_grid(grid, stride)
+    x = tokens.reshape(batch_size, frames, pooled_height, pooled_width, dim)
+    x = x.repeat_interleave(stride, dim=2)[:, :, :height].repeat_interleave(stride, dim=3)[:, :, :, :width]
+    return x.reshape(batch_size, frames * height * width, dim)
+
+
+def pool_rotary_emb(image_rotary_emb, grid, stride):
+    """Rotary embeddings of the pooled tokens, taken at the first position of every window
+
+    Args:
+        image_rotary_emb (tuple[torch.Tensor, torch.Tensor]): `(cos, sin)` of shape `[F*H*W, D]`, or None
+        grid (tuple[int, int, int]): Full token grid `(F, H, W)`
+        stride (int): Spatial pooling factor
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor]: `(cos, sin)` of shape `[F*h*w, D]`, or None
+    """
+    if image_rotary_emb is None:
+        return None
+    frames, height, width = grid
+    return tuple(
+        freqs.reshape(frames, height, width, -1)[:, ::stride, ::stride].reshape(-1, freqs.shape[-1])
+        for freqs in image_rotary_emb
+    )
@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ZOEDEPTH_REPO = "Intel/zoedepth-nyu-kitti"
+DEPTH_ANYTHING_REPO = "depth-anything/Depth-Anything-V2-Large-hf"
+MOGE_REPO = "Ruicheng/moge-vitl"
+COTRACKER_HUB_DIR = "facebookresearch_co-tracker_main"
+
+
+def _local_snapshot(repo_id):
+    """Resolve a Hugging Face repo to its local snapshot without touching the network"""
+    from huggingface_hub import snapshot_download
+
+    try:
+        return snapshot_download(repo_id, local_files_only=True)
+    except Exception as e:
+        raise FileNotFoundError(
+            f"{repo_id} is not available locally. Download it once with `huggingface-cli download {repo_id}`."
+        ) from e
+
+
+def _build_spatracker(checkpoint_dir, device):
+    from models.spatracker.predictor import SpaTrackerPredictor
+
+    checkpoint = os.path.join(checkpoint_dir, "spaT_final.pth")
+    if not os.path.isfile(checkpoint):
+        raise FileNotFoundError(f"SpaTracker checkpoint not found at {checkpoint}")
+    return SpaTrackerPredictor(
+        checkpoint=checkpoint,
+        interp_shape=(384, 576),
+        seq_length=12
+    ).to(device)
+
+
+def _build_cotracker(checkpoint_dir, device):
+    # torch.hub keeps a checkout of the repo after the first load; use it instead of resolving
+    # the hub entry point (and its GitHub API calls) again
+    hub_dir = os.path.join(torch.hub.get_dir(), COTRACKER_HUB_DIR)
+    if not os.path.isdir(hub_dir):
+        raise FileNotFoundError(
+            f"CoTracker hub checkout not found at {hub_dir}. "
+            "Run `torch.hub.load('facebookresearch/co-tracker', 'cotracker3_offline')` once to fetch it."
+        )
+    return torch.hub.load(hub_dir, "cotracker3_offline", source="local").to(device)
+
+
+def _build_moge(checkpoint_dir, device):
+    from huggingface_hub import hf_hub_download
+    from submodules.MoGe.moge.model.v1 import MoGeModel
+
+    try:
+        checkpoint = hf_hub_download(MOGE_REPO, "model.pt", local_files_only=True)
+    except Exception as e:
+        raise FileNotFoundError(f"{MOGE_REPO} is not available locally.") from e
+    return MoGeModel.from_pretrained(checkpoint).to(device)
+
+
+def _build_zoedepth(checkpoint_dir, device):
+    from image_gen_aux import DepthPreprocessor
+
+    return DepthPreprocessor.from_pretrained(_local_snapshot(ZOEDEPTH_REPO)).to(device)
+
+
+def _build_depth_anything(checkpoint_dir, device):
+    from image_gen_aux import DepthPreprocessor
+
+    return DepthPreprocessor.from_pretrained(_local_snapshot(DEPTH_ANYTHING_REPO)).to(device)
+
+
+BACKENDS = {
+    "spatracker": _build_spatracker,
+    "cotracker": _build_cotracker,
+    "moge": _build_moge,
+    "zoedepth": _build_zoedepth,
+    "depth_anything": _build_depth_anything,
+}
+
+
+class TrackerPool:
+    """Lazily built, reusable tracker and depth backends
+
+    Backends are constructed on first use from local checkpoints only and kept
+    warm for later jobs. At most `max_resident` backends stay loaded; the least
+    recently used one is released when another has to be built. `release` and
+    `release_all` free backends explicitly.
+
+    The pool is shared by concurrent jobs and the backends are not thread safe, so run them inside `use`,
+    which lets one job at a time call a backend.
+    """
+
+    def __init__(self, device="cuda", checkpoint_dir=None, max_resident=None):
+        """
+        Args:
+            device (str): Device the backends are placed on
+            checkpoint_dir (str): Directory holding local tracker checkpoints
+            max_resident (int): Maximum number of loaded backends, None for unlimited
+        """
+        self.device = device
+        self.checkpoint_dir = checkpoint_dir or os.path.join(project_root, "checkpoints")
+        self.max_resident = max_resident
+        self._backends = OrderedDict()
+        self._lock = threading.RLock()
+        self._use_locks = {name: threading.RLock() for name in BACKENDS}
+
+    def get(self, name):
+        """Return the backend `name`, building it if it is not loaded
+
+        Args:
+            name (str): One of "spatracker", "cotracker", "moge", "zoedepth", "depth_anything"
+        """
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown tracker backend '{name}', must be one of {list(BACKENDS)}")
+        with self._lock:
+            if name in self._backends:
+                self._backends.move_to_end(name)
+                return self._backends[name]
+
+            if self.max_resident is not None:
+                while len(self._backends) >= max(self.max_resident, 1):
+                    self.release(next(iter(self._backends)))
+
+            print(f"Loading {name} backend...")
+            backend = BACKENDS[name](self.checkpoint_dir, self.device)
+            if isinstance(backend, torch.nn.Module):
+                backend.eval()
+            self._backends[name] = backend
+            return backend
+
+    @contextmanager
+    def use(self, name):
+        """Hold the backend `name` for exclusive use, building it if it is not loaded
+
+        Args:
+            name (str): One of "spatracker", "cotracker", "moge", "zoedepth", "depth_anything"
+        """
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown tracker backend '{name}', must be one of {list(BACKENDS)}")
+        with self._use_locks[name]:
+            yield self.get(name)
+
+    def is_loaded(self, name):
+        return name in self._backends
+
+    def release(self, name):
+        """Unload a backend and free its device memory"""
+        with self._lock:
+            backend = self._backends.pop(name, None)
+            if backend is None:
+                return False
+            del backend
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            return True
+
+    def release_all(self):
+        with self._lock:
+            for name in list(self._backends):
+                self.release(name)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_tracker_pool(device="cuda", **kwargs):
+    """Return the process-wide tracker pool for `device`"""
+    with _pools_lock:
+        key = str(device)
+        if key not in _pools:
+            _pools[key] = TrackerPool(device=device, **kwargs)
+        return _pools[key]
@@ -0,0 +1,125 @@
+import bisect
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+# A single background worker keeps mp4 encodes ordered and off the generation path
+_writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video_writer")
+
+
+def to_uint8_frames(frames):
+    """Bring frames to a uint8 numpy array [T, H, W, 3]
+
+    Args:
+        frames (numpy.ndarray or torch.Tensor): uint8 frames [T, H, W, 3]
+
+    Returns:
+        numpy.ndarray: uint8 frames [T, H, W, 3], without copying when already on CPU and contiguous
+    """
+    if isinstance(frames, torch.Tensor):
+        frames = frames.detach().cpu().numpy()
+    return np.ascontiguousarray(frames, dtype=np.uint8)
+
+
+def write_video(frames, path, fps=8):
+    """Encode uint8 frames [T, H, W, 3] to an mp4 file"""
+    from moviepy.editor import ImageSequenceClip
+
+    frames = to_uint8_frames(frames)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    clip = ImageSequenceClip(list(frames), fps=fps)
+    clip.write_videofile(path, codec="libx264", fps=fps, logger=None)
+    return path
+
+
+def write_video_async(frames, path, fps=8):
+    """Encode frames to mp4 in the background
+
+    The frames must not be modified until the returned future is done.
+
+    Returns:
+        concurrent.futures.Future: Resolves to `path`, or raises the encoding error
+    """
+    return _writer_pool.submit(write_video, frames, path, fps)
+
+
+def plan_frame_reads(indices, key_indices, position=0):
+    """Decide how to reach every frame to read, seeking only when it saves decoding
+
+    Reaching frame t from the decoder position p means decoding the t - p frames in between, while a seek decodes
+    from the last keyframe k <= t. Seeking therefore only pays off when that keyframe lies beyond p.
+
+    Args:
+        indices (list[int]): Frames to read, sorted and unique
+        key_indices (list[int]): Keyframes of the stream, sorted
+        position (int): Frame the decoder returns next
+
+    Returns:
+        list[Tuple[int, int]]: (frame, frames to skip before it), a skip of -1 means seek to the frame
+    """
+    reads = []
+    for index in indices:
+        keyframe = key_indices[bisect.bisect_right(key_indices, index) - 1] if key_indices else 0
+        if index < position or keyframe > position:
+            reads.append((index, -1))
+        else:
+            reads.append((index, index - position))
+        position = index + 1
+    return reads
+
+
+class VideoFrameReader:
+    """Reads selected frames of a video, resized by the decoder
+
+    The container is opened once; frame count, frame rate and keyframes come from its metadata, and `read`
+    decodes only the requested frames.
+
+    Example:
+        reader = VideoFrameReader("input.mp4", size=(480, 720))
+        frames = reader.read(np.linspace(0, reader.num_frames - 1, 49).astype(int))  # uint8 [49, 3, 480, 720]
+    """
+
+    def __init__(self, path, size=None, num_threads=0):
+        """
+        Args:
+            path (str): Video file
+            size (Tuple[int, int]): (height, width) the frames are scaled to while decoding, None for the original size
+            num_threads (int): Decoder threads, 0 for automatic
+        """
+        import decord
+
+        height, width = size if size is not None else (-1, -1)
+        self.path = path
+        self._reader = decord.VideoReader(path, ctx=decord.cpu(0), width=width, height=height, num_threads=num_threads)
+        self.num_frames = len(self._reader)
+        self.fps = float(self._reader.get_avg_fps())
+        self.duration = self.num_frames / self.fps if self.fps > 0 else 0.0
+        self._key_indices = None
+        self._position = 0  # frame the decoder returns next
+
+    @property
+    def key_indices(self):
+        if self._key_indices is None:
+            self._key_indices = sorted(int(i) for i in self._reader.get_key_indices())
+        return self._key_indices
+
+    def read(self, indices):
+        """Decode the frames at `indices`, which may repeat and come in any order
+
+        Returns:
+            torch.Tensor: uint8 frames [T, C, H, W]
+        """
+        indices = [min(max(int(i), 0), self.num_frames - 1) for i in indices]
+        unique = sorted(set(indices))
+        decoded = {}
+        for index, skip in plan_frame_reads(unique, self.key_indices, self._position):
+            if skip < 0:
+                self._reader.seek_accurate(index)
+            elif skip > 0:
+                self._reader.skip_frames(skip)
+            decoded[index] = self._reader.next().asnumpy()
+            self._position = index + 1
+        frames = np.stack([decoded[i] for i in indices])  # [T, H, W, C]
+        return torch.from_numpy(frames).permute(0, 3, 1, 2).contiguous()
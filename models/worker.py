@@ -0,0 +1,539 @@
+import argparse
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import shutil
+import sys
+import threading
+import time
+import traceback
+import uuid
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+DEFAULT_ADDRESS = ("127.0.0.1", 7861)
+# Requests are pickled, so only clients holding the worker's key may connect
+AUTHKEY_ENV = "DAS_WORKER_AUTHKEY"
+# Seconds an authenticated client has to send its request
+REQUEST_TIMEOUT = 30.0
+
+
+def new_authkey():
+    """Random worker key, hex encoded to be passed through the environment"""
+    return secrets.token_bytes(32).hex()
+
+
+def env_authkey():
+    """Worker key from the `DAS_WORKER_AUTHKEY` environment variable, None if unset"""
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return authkey.encode("utf-8") if authkey else None
+
+
+def is_loopback(host):
+    """Whether `host` only accepts connections from this machine"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class GenerationJob:
+    """Base class of the typed job requests accepted by the inference worker
+
+    A job carries the options of one `demo.py` run; `demo_args` maps it to the command line of `demo.py`.
+    """
+
+    kind = None
+
+    def __init__(self, input_path, prompt="", checkpoint_path=None, num_inference_steps=50, job_id=None):
+        """
+        Args:
+            input_path (str): Input video or image
+            prompt (str): Generation prompt
+            checkpoint_path (str): DaS checkpoint, defaults to the one the worker was started with
+            num_inference_steps (int): Denoising steps
+            job_id (str): Identifier echoed in every event, generated if None
+        """
+        self.input_path = input_path
+        self.prompt = prompt or ""
+        self.checkpoint_path = checkpoint_path
+        self.num_inference_steps = num_inference_steps
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+
+    def options(self):
+        """Task specific `demo.py` options, None values are left out"""
+        return {}
+
+    def demo_args(self, output_dir, checkpoint_path, gpu):
+        """Command line of `demo.py` for this job"""
+        options = {
+            "input_path": self.input_path,
+            "prompt": self.prompt,
+            "checkpoint_path": self.checkpoint_path or checkpoint_path,
+            "output_dir": output_dir,
+            "gpu": gpu,
+            "num_inference_steps": self.num_inference_steps,
+            **self.options(),
+        }
+        argv = []
+        for key, value in options.items():
+            if value is not None:
+                argv += [f"--{key}", str(value)]
+        return argv
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.job_id}, input={self.input_path!r})"
+
+
+class MotionTransferJob(GenerationJob):
+    kind = "motion_transfer"
+
+    def __init__(self, input_path, prompt="", repaint=None, **kwargs):
+        """
+        Args:
+            repaint (str): Path of a repainted first frame, or "true" to repaint with Flux
+        """
+        super().__init__(input_path, prompt, **kwargs)
+        self.repaint = repaint
+
+    def options(self):
+        return {"repaint": self.repaint}
+
+
+class CameraControlJob(GenerationJob):
+    kind = "camera_control"
+
+    def __init__(self, input_path, prompt="", camera_motion=None, tracking_method="spatracker",
+                 override_extrinsics="append", **kwargs):
+        """
+        Args:
+            camera_motion (str): Camera motion string, e.g. "rot y 25 0 48"
+            tracking_method (str): spatracker, cotracker or moge
+            override_extrinsics (str): "override" or "append"
+        """
+        super().__init__(input_path, prompt, **kwargs)
+        self.camera_motion = camera_motion
+        self.tracking_method = tracking_method
+        self.override_extrinsics = override_extrinsics
+
+    def options(self):
+        return {
+            "camera_motion": self.camera_motion,
+            "tracking_method": self.tracking_method,
+            "override_extrinsics": self.override_extrinsics,
+        }
+
+
+class ObjectManipulationJob(GenerationJob):
+    kind = "object_manipulation"
+
+    def __init__(self, input_path, prompt="", object_motion=None, object_mask=None, tracking_method="moge", **kwargs):
+        """
+        Args:
+            object_motion (str): up, down, left or right
+            object_mask (str): Path of the binary object mask
+            tracking_method (str): spatracker, cotracker or moge
+        """
+        super().__init__(input_path, prompt, **kwargs)
+        self.object_motion = object_motion
+        self.object_mask = object_mask
+        self.tracking_method = tracking_method
+
+    def options(self):
+        return {
+            "object_motion": self.object_motion,
+            "object_mask": self.object_mask,
+            "tracking_method": self.tracking_method,
+        }
+
+
+class MeshAnimationJob(GenerationJob):
+    kind = "mesh_animation"
+
+    def __init__(self, input_path, prompt="", tracking_path=None, repaint=None, **kwargs):
+        """
+        Args:
+            tracking_path (str): Rendered tracking video of the animated mesh
+            repaint (str): Path of a repainted first frame, or "true" to repaint with Flux
+        """
+        super().__init__(input_path, prompt, **kwargs)
+        self.tracking_path = tracking_path
+        self.repaint = repaint
+
+    def options(self):
+        return {"tracking_path": self.tracking_path, "repaint": self.repaint}
+
+
+class JobEvent:
+    """Message sent from the worker to the client of a job
+
+    `kind` is one of "queued", "progress", "result" or "error"; a job ends with exactly one "result" or "error".
+    """
+
+    def __init__(self, job_id, kind, message="", artifacts=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.message = message
+        self.artifacts = artifacts or []
+
+    def __repr__(self):
+        return f"JobEvent({self.job_id}, {self.kind}, {self.message!r})"
+
+
+class WorkerError(RuntimeError):
+    """A job failed in the worker, the message carries the worker traceback"""
+
+
+class DemoRunner:
+    """Runs jobs through `demo.run` with the models resident between jobs
+
+    Every job thread gets its own `DiffusionAsShaderPipeline`, the models behind them are shared through the
+    process-wide model registry and tracker pool, which let one job at a time run a shared pipeline or tracker
+    backend. With a batch window, the denoising of concurrent jobs goes through one `GenerationScheduler`, so
+    compatible jobs share a batch; without one, concurrent jobs overlap only outside the shared models. One
+    `AdmissionController` predicts the cost of every job before it loads a model and queues, down-shifts or
+    rejects it against the jobs running.
+    """
+
+    def __init__(self, gpu=0, checkpoint_path="EXCAI/Diffusion-As-Shader", model_cache_gb=None, prompt_cache_dir=None,
+                 batch_window=0.0, max_batch_size=None, memory_gb=None, max_seconds=None, calibration_path=None,
+                 record_runs=True):
+        """
+        Args:
+            gpu (int): GPU device ID
+            checkpoint_path (str): Checkpoint of jobs that do not name one
+            model_cache_gb (float): Memory budget of the resident model registry in GB
+            prompt_cache_dir (str): Directory of the on-disk prompt embedding cache
+            batch_window (float): Seconds a job's generation waits for compatible ones, 0 to generate right away
+            max_batch_size (int): Upper bound on the jobs denoised together
+            memory_gb (float): Device memory admission control plans with, None for the total memory of the GPU
+            max_seconds (float): Reject jobs predicted to take longer
+            calibration_path (str): JSON lines file of measured runs, None to use the uncalibrated cost model
+            record_runs (bool): Record the measured runs to `calibration_path`, only meaningful with one job thread
+        """
+        import demo
+        from models.batching import total_bytes
+        from models.cost_model import GIB, AdmissionController, CalibrationStore, CostModel
+        from models.job_scheduler import GenerationScheduler
+
+        self.demo = demo
+        self.parser = demo.build_parser()
+        self.gpu = gpu
+        self.checkpoint_path = checkpoint_path
+        self.model_cache_gb = model_cache_gb
+        self.prompt_cache_dir = prompt_cache_dir
+        self._local = threading.local()
+        self.scheduler = None
+        if batch_window > 0:
+            self.scheduler = GenerationScheduler(self._new_pipeline(), window=batch_window, max_batch_size=max_batch_size)
+
+        self.calibration = CalibrationStore(calibration_path) if calibration_path else None
+        self.record_runs = record_runs
+        self.admission = None
+        capacity = memory_gb * GIB if memory_gb else total_bytes(f"cuda:{gpu}")
+        if capacity is not None:
+            import torch
+
+            device_name = torch.cuda.get_device_name(gpu) if torch.cuda.is_available() else None
+            cost_model = CostModel.from_store(self.calibration, device_name)
+            self.admission = AdmissionController(cost_model, capacity, max_seconds=max_seconds)
+
+    def _new_pipeline(self):
+        from models.pipelines import DiffusionAsShaderPipeline
+
+        return DiffusionAsShaderPipeline(gpu_id=self.gpu, model_cache_gb=self.model_cache_gb,
+                                         prompt_cache_dir=self.prompt_cache_dir)
+
+    def _pipeline(self):
+        das = getattr(self._local, "das", None)
+        if das is None:
+            das = self._local.das = self._new_pipeline()
+            das.job_scheduler = self.scheduler
+        return das
+
+    def __call__(self, job, output_dir, progress):
+        args = self.parser.parse_args(job.demo_args(output_dir, self.checkpoint_path, self.gpu) + ["--no_admission"])
+        calibration = self.calibration if self.record_runs else None
+        return [self.demo.run(args, das=self._pipeline(), progress=progress, admission=self.admission, calibration=calibration)]
+
+    def stats(self):
+        stats = {}
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.stats()
+        if self.admission is not None:
+            stats["admission"] = self.admission.stats()
+        return stats
+
+
+class StubRunner:
+    """Stand-in for `DemoRunner` that loads no model, to exercise the protocol without a GPU
+
+    Every job reports the stages of a real run and writes `job.json` with the `demo.py` arguments it would have
+    used, plus `result.mp4` copied from the input when the input is a video.
+    """
+
+    stages = ("Loading input media", "Generating the tracking video", "Encoding the tracking video", "Generating the video")
+
+    def __init__(self, checkpoint_path="EXCAI/Diffusion-As-Shader", delay=0.0):
+        self.checkpoint_path = checkpoint_path
+        self.delay = delay
+
+    def __call__(self, job, output_dir, progress):
+        if not os.path.exists(job.input_path):
+            raise FileNotFoundError(f"Input {job.input_path} does not exist")
+        for stage in self.stages:
+            progress(stage)
+            time.sleep(self.delay)
+        os.makedirs(output_dir, exist_ok=True)
+        record = os.path.join(output_dir, "job.json")
+        with open(record, "w", encoding="utf-8") as f:
+            json.dump({"kind": job.kind, "argv": job.demo_args(output_dir, self.checkpoint_path, "stub")}, f, indent=2)
+        artifacts = [record]
+        if os.path.splitext(job.input_path)[1].lower() in (".mp4", ".avi", ".mov"):
+            artifacts.insert(0, shutil.copyfile(job.input_path, os.path.join(output_dir, "result.mp4")))
+        return artifacts
+
+    def stats(self):
+        return {}
+
+
+class InferenceWorker:
+    """Long-lived process that owns the models and runs queued jobs
+
+    Every client connection submits one job and receives its events until the job ends. Jobs from concurrent
+    connections queue up in arrival order and run on `num_threads` executor threads; one thread runs them one at
+    a time, more let the generation steps of several jobs meet in the runner's batch scheduler.
+    """
+
+    def __init__(self, runner, output_dir="outputs", num_threads=1):
+        """
+        Args:
+            runner (callable): `runner(job, output_dir, progress)` returning the artifact paths of a job
+            output_dir (str): Every job writes to `<output_dir>/<job_id>`
+            num_threads (int): Jobs running at the same time
+        """
+        self.runner = runner
+        self.output_dir = output_dir
+        self.num_threads = num_threads
+        self.jobs = queue.Queue()
+        self.completed = 0
+        self.failed = 0
+        self._counter_lock = threading.Lock()
+
+    def run_job(self, job, send):
+        """Run one job, reporting its events through `send(event)`"""
+        def progress(message):
+            print(f"[{job.job_id}] {message}")
+            send(JobEvent(job.job_id, "progress", message))
+
+        try:
+            artifacts = self.runner(job, os.path.join(self.output_dir, job.job_id), progress)
+        except Exception as e:
+            with self._counter_lock:
+                self.failed += 1
+            print(f"[{job.job_id}] failed: {e}")
+            send(JobEvent(job.job_id, "error", f"{e}\n{traceback.format_exc()}"))
+        else:
+            with self._counter_lock:
+                self.completed += 1
+            send(JobEvent(job.job_id, "result", "done", artifacts))
+
+    def _execute(self):
+        while True:
+            job, conn = self.jobs.get()
+
+            def send(event):
+                try:
+                    conn.send(event)
+                except (OSError, EOFError):
+                    pass  # the client went away, the job still runs to keep the queue order simple
+
+            self.run_job(job, send)
+            conn.close()
+
+    def _accept(self, conn, authkey):
+        """Authenticate a client and take its request, on a thread of its own so that a silent client blocks no other"""
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+            if not conn.poll(REQUEST_TIMEOUT):
+                raise TimeoutError(f"no request within {REQUEST_TIMEOUT:.0f} s")
+            request = conn.recv()
+        except (AuthenticationError, OSError, EOFError) as e:
+            print(f"Dropped a client connection: {type(e).__name__} {e}")
+            conn.close()
+            return
+        if request == "ping":
+            conn.send("pong")
+            conn.close()
+            return
+        if request == "stats":
+            conn.send(self.stats())
+            conn.close()
+            return
+        if not isinstance(request, GenerationJob):
+            conn.send(JobEvent(None, "error", f"Unsupported request {type(request).__name__}"))
+            conn.close()
+            return
+        conn.send(JobEvent(request.job_id, "queued", f"{self.jobs.qsize()} jobs ahead"))
+        self.jobs.put((request, conn))
+
+    def stats(self):
+        """Queue depth, job counts and the runner's metrics, e.g. those of its batch scheduler"""
+        with self._counter_lock:
+            stats = {"queued": self.jobs.qsize(), "completed": self.completed, "failed": self.failed}
+        stats.update(self.runner.stats())
+        return stats
+
+    def serve(self, authkey, address=DEFAULT_ADDRESS):
+        """Accept jobs on a socket until interrupted
+
+        Args:
+            authkey (bytes): Key clients authenticate with
+            address (tuple): Host and port to listen on
+        """
+        if not authkey:
+            raise ValueError("The inference worker needs an authentication key")
+        for i in range(self.num_threads):
+            threading.Thread(target=self._execute, name=f"job_executor_{i}", daemon=True).start()
+        # clients authenticate in `_accept` rather than in `Listener.accept`, which would block the accept loop
+        with Listener(address) as listener:
+            print(f"Inference worker listening on {address}")
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._accept, args=(conn, authkey), daemon=True).start()
+
+
+class WorkerClient:
+    """Submits jobs to an `InferenceWorker`
+
+    Example:
+        client = WorkerClient()
+        video_path = client.submit(CameraControlJob("input.mp4", "a car", camera_motion="rot y 25"))[0]
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        """
+        Args:
+            address (tuple): Host and port of the worker
+            authkey (bytes): Key of the worker, defaults to `DAS_WORKER_AUTHKEY`
+        """
+        self.address = tuple(address)
+        self.authkey = authkey or env_authkey()
+
+    def _connect(self):
+        if not self.authkey:
+            raise WorkerError(f"No key for the inference worker at {self.address}, set {AUTHKEY_ENV}")
+        return Client(self.address, authkey=self.authkey)
+
+    def ping(self):
+        """True if a worker answers at the address and accepts the key"""
+        if not self.authkey:
+            return False
+        try:
+            with self._connect() as conn:
+                conn.send("ping")
+                return conn.recv() == "pong"
+        except (AuthenticationError, OSError, EOFError):
+            return False
+
+    def stats(self):
+        """Metrics of the worker, see `InferenceWorker.stats`"""
+        with self._connect() as conn:
+            conn.send("stats")
+            return conn.recv()
+
+    def wait_ready(self, timeout=600.0, interval=1.0, process=None):
+        """Block until the worker answers, e.g. while it loads its models
+
+        Args:
+            timeout (float): Seconds to wait
+            interval (float): Seconds between attempts
+            process (subprocess.Popen): Worker process, waiting stops early if it exits
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.ping():
+                return
+            if process is not None and process.poll() is not None:
+                raise WorkerError(f"Inference worker exited with code {process.returncode}")
+            time.sleep(interval)
+        raise TimeoutError(f"No inference worker at {self.address} after {timeout:.0f} s")
+
+    def submit(self, job, on_event=None):
+        """Run a job in the worker and wait for it
+
+        Args:
+            job (GenerationJob): Job to run
+            on_event (callable): Called with every `JobEvent` of the job, e.g. to forward progress
+
+        Returns:
+            list[str]: Artifact paths, the generated video first
+        """
+        with self._connect() as conn:
+            conn.send(job)
+            while True:
+                event = conn.recv()
+                if on_event is not None:
+                    on_event(event)
+                if event.kind == "result":
+                    return event.artifacts
+                if event.kind == "error":
+                    raise WorkerError(event.message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent DaS inference worker")
+    parser.add_argument("--host", type=str, default=DEFAULT_ADDRESS[0], help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1], help="Port to listen on")
+    parser.add_argument("--gpu", type=int, default=0, help="GPU device ID")
+    parser.add_argument("--checkpoint_path", type=str, default="EXCAI/Diffusion-As-Shader", help="Default model checkpoint")
+    parser.add_argument("--output_dir", type=str, default="outputs", help="Jobs write to <output_dir>/<job_id>")
+    parser.add_argument("--model_cache_gb", type=float, default=None, help="Memory budget in GB for resident models")
+    parser.add_argument("--prompt_cache_dir", type=str, default=None, help="Directory to persist T5 prompt embeddings")
+    parser.add_argument("--job_threads", type=int, default=1, help="Jobs running at the same time")
+    parser.add_argument("--batch_window", type=float, default=0.0,
+                        help="Seconds a job's generation waits for compatible jobs to share its batch, needs --job_threads > 1")
+    parser.add_argument("--max_batch_size", type=int, default=None, help="Upper bound on the jobs denoised together")
+    parser.add_argument("--memory_gb", type=float, default=None,
+                        help="Device memory in GB admission control plans with, defaults to the total memory of the GPU")
+    parser.add_argument("--max_seconds", type=float, default=None, help="Reject jobs predicted to take longer than this")
+    parser.add_argument("--calibration_path", type=str, default=None,
+                        help="JSON lines file of measured runs calibrating the cost model, defaults to <output_dir>/cost_calibration.jsonl")
+    parser.add_argument("--stub", action="store_true", help="Load no model and fake the jobs, to test clients without a GPU")
+    parser.add_argument("--stub_delay", type=float, default=0.0, help="Seconds per stage in --stub mode")
+    args = parser.parse_args()
+
+    authkey = env_authkey()
+    if authkey is None:
+        if not is_loopback(args.host):
+            parser.error(f"Set {AUTHKEY_ENV} to listen on {args.host}: requests are unpickled, so the worker only "
+                         "accepts clients holding its key")
+        # a local worker started by hand gets a fresh key, readable only by its user
+        authkey = new_authkey().encode("utf-8")
+        os.makedirs(args.output_dir, exist_ok=True)
+        key_path = os.path.join(args.output_dir, "worker.key")
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+        print(f"{AUTHKEY_ENV} is not set, clients authenticate with the key in {key_path}")
+
+    # Jobs unpickle as `models.worker` classes, so the worker uses those rather than the `__main__` copies
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from models.worker import DemoRunner, InferenceWorker, StubRunner
+
+    if args.stub:
+        runner = StubRunner(args.checkpoint_path, delay=args.stub_delay)
+    else:
+        # concurrent jobs share the process-wide peak memory, so only a single job thread records runs
+        runner = DemoRunner(args.gpu, args.checkpoint_path, args.model_cache_gb, args.prompt_cache_dir,
+                            batch_window=args.batch_window, max_batch_size=args.max_batch_size,
+                            memory_gb=args.memory_gb, max_seconds=args.max_seconds,
+                            calibration_path=args.calibration_path or os.path.join(args.output_dir, "cost_calibration.jsonl"),
+                            record_runs=args.job_threads == 1)
+    InferenceWorker(runner, args.output_dir, num_threads=args.job_threads).serve(authkey, (args.host, args.port))
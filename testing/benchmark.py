@@ -0,0 +1,139 @@
+import argparse
+import os
+import sys
+import time
+
+import torch
+from PIL import Image
+from diffusers import CogVideoXDPMScheduler
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.cogvideox_tracking import CogVideoXImageToVideoPipelineTracking
+
+
+def load_pipeline(model_path, dtype, device):
+    pipe = CogVideoXImageToVideoPipelineTracking.from_pretrained(model_path, torch_dtype=dtype)
+    pipe.scheduler = CogVideoXDPMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    pipe.to(device, dtype=dtype)
+    pipe.vae.enable_slicing()
+    pipe.vae.enable_tiling()
+    pipe.transformer.eval()
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def random_inputs(pipe, height, width, num_frames, dtype, device, seed):
+    """Blank first frame and random tracking latents of the right shape"""
+    generator = torch.Generator().manual_seed(seed)
+    latent_frames = (num_frames - 1) // pipe.vae_scale_factor_temporal + 1
+    tracking_maps = torch.randn(
+        1, latent_frames, pipe.vae.config.latent_channels,
+        height // pipe.vae_scale_factor_spatial, width // pipe.vae_scale_factor_spatial,
+        generator=generator,
+    ).to(device=device, dtype=dtype)
+    tracking_image = torch.rand(1, 3, height, width, generator=generator).to(device=device, dtype=dtype)
+    image = Image.new("RGB", (width, height))
+    return image, tracking_maps, tracking_image
+
+
+def run(pipe, args, image, tracking_maps, tracking_image, **call_kwargs):
+    """Denoise once, returning (latents, seconds per step, host syncs per step)"""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    latents = pipe(
+        prompt=args.prompt,
+        image=image,
+        num_inference_steps=args.num_inference_steps,
+        num_frames=args.num_frames,
+        use_dynamic_cfg=True,
+        guidance_scale=args.guidance_scale,
+        generator=torch.Generator().manual_seed(args.seed),
+        tracking_maps=tracking_maps,
+        tracking_image=tracking_image,
+        height=args.height,
+        width=args.width,
+        output_type="latent",
+        **call_kwargs,
+    ).frames
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    syncs = pipe.host_syncs_per_step or []
+    return latents, elapsed / args.num_inference_steps, (sum(syncs) / len(syncs) if syncs else float("nan"))
+
+
+def drift(latents, reference):
+    """Relative L2 distance of the final latents to the fully evaluated reference"""
+    latents, reference = latents.float(), reference.float()
+    return ((latents - reference).norm() / reference.norm().clamp_min(1e-8)).item()
+
+
+def benchmark(pipe, args, inputs, name, reference=None, **call_kwargs):
+    """Time `args.repeats` runs of the current configuration and report drift against `reference`"""
+    run(pipe, args, *inputs, **call_kwargs)  # warm-up
+    for repeat in range(args.repeats):
+        latents, step_time, syncs = run(pipe, args, *inputs, **call_kwargs)
+        line = f"{name} run {repeat}: {step_time * 1000:.1f} ms/step, {syncs:.2f} host syncs/step"
+        if reference is not None:
+            line += f", drift {drift(latents, reference):.4f}"
+        print(line)
+    return latents, step_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DaS denoising loop")
+    parser.add_argument("--model_path", type=str, required=True, help="The path of the DaS checkpoint")
+    parser.add_argument("--prompt", type=str, default="A dog running on the grass", help="Prompt used for every run")
+    parser.add_argument("--num_inference_steps", type=int, default=50, help="Number of denoising steps")
+    parser.add_argument("--guidance_scale", type=float, default=6.0, help="The scale for classifier-free guidance")
+    parser.add_argument("--height", type=int, default=480, help="Video height")
+    parser.add_argument("--width", type=int, default=720, help="Video width")
+    parser.add_argument("--num_frames", type=int, default=49, help="Number of frames")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed runs after one warm-up run")
+    parser.add_argument("--dtype", type=str, default="bfloat16", help="The data type for computation")
+    parser.add_argument("--seed", type=int, default=42, help="The seed for reproducibility")
+    parser.add_argument("--tracking_cache_interval", type=int, default=None,
+                        help="Also benchmark tracking-branch reuse, recomputing every k steps")
+    parser.add_argument("--tracking_cache_threshold", type=float, default=None,
+                        help="Also benchmark tracking-branch reuse, recomputing when the time embedding changes by more than this")
+    parser.add_argument("--block_cache_threshold", type=float, default=None,
+                        help="Also benchmark block residual reuse (TeaCache), skipping steps whose input changes by less than this")
+    parser.add_argument("--guidance_interval", type=float, nargs=2, default=None, metavar=("LOW", "HIGH"),
+                        help="Also benchmark applying CFG only to timesteps in [LOW, HIGH]")
+    parser.add_argument("--uncond_interval", type=int, default=None,
+                        help="Also benchmark evaluating the unconditional pass every k guided steps")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if args.dtype == "float16" else torch.bfloat16
+
+    pipe = load_pipeline(args.model_path, dtype, device)
+    image, tracking_maps, tracking_image = random_inputs(pipe, args.height, args.width, args.num_frames, dtype, device, args.seed)
+    pipe.count_host_syncs = True
+
+    inputs = (image, tracking_maps, tracking_image)
+    reference, full_time = benchmark(pipe, args, inputs, "full")
+
+    if args.tracking_cache_interval is not None or args.tracking_cache_threshold is not None:
+        cache = pipe.transformer.enable_tracking_cache(
+            interval=args.tracking_cache_interval, threshold=args.tracking_cache_threshold
+        )
+        _, cached_time = benchmark(pipe, args, inputs, "tracking cache", reference)
+        pipe.transformer.disable_tracking_cache()
+        print(f"tracking cache: {full_time / cached_time:.2f}x speedup, {cache.stats()}")
+
+    if args.block_cache_threshold is not None:
+        cache = pipe.transformer.enable_block_cache(args.block_cache_threshold)
+        _, cached_time = benchmark(pipe, args, inputs, "block cache", reference)
+        pipe.transformer.disable_block_cache()
+        print(f"block cache: {full_time / cached_time:.2f}x speedup, {cache.stats()}")
+
+    if args.guidance_interval is not None or args.uncond_interval is not None:
+        _, guided_time = benchmark(
+            pipe, args, inputs, "reduced guidance", reference,
+            guidance_interval=tuple(args.guidance_interval) if args.guidance_interval is not None else None,
+            uncond_interval=args.uncond_interval or 1,
+        )
+        print(f"reduced guidance: {full_time / guided_time:.2f}x speedup")
@@ -0,0 +1,119 @@
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.camera_motion import _compiled_motion, compile_motion, parse_motion, spiral_matrices
+from testing.checks import check
+
+
+def legacy_rotation(angle, axis):
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    mat = {
+        'x': [[1, 0, 0], [0, c, -s], [0, s, c]],
+        'y': [[c, 0, s], [0, 1, 0], [-s, 0, c]],
+        'z': [[c, -s, 0], [s, c, 0], [0, 0, 1]],
+    }[axis]
+    out = np.eye(4)
+    out[:3, :3] = mat
+    return out
+
+
+def legacy_spiral(radius, frame_num):
+    """Spiral poses as the per-frame look-at loop computed them"""
+    t = np.linspace(0, 1, frame_num)
+    r = np.sin(np.pi * t) * radius * 0.1
+    theta = 2 * np.pi * t
+    y, x, z = r * np.cos(theta) * 0.3, r * np.sin(theta), -r
+    z[z < 0] *= 0.5
+    z[z > 0] *= 0.5
+    target = np.array([0, 0, radius * 0.5])
+    poses = []
+    for pos in np.vstack([x, y, z]).T:
+        direction = (target - pos) / np.linalg.norm(target - pos)
+        right = np.cross(np.array([0, 1, 0]), direction)
+        right /= np.linalg.norm(right)
+        up = np.cross(direction, right)
+        pose = np.eye(4)
+        pose[:3, :3] = np.linalg.inv(np.vstack([right, up, direction]))
+        pose[:3, 3] = pos
+        poses.append(pose)
+    return np.stack(poses)
+
+
+def legacy_motion(spec, frame_num):
+    """Per-frame reference of `CameraMotionGenerator.get_default_motion` before the motion compiler"""
+    final = np.tile(np.eye(4), (frame_num, 1, 1))
+    for segment in parse_motion(spec, frame_num):
+        current = np.tile(np.eye(4), (frame_num, 1, 1))
+        spiral = legacy_spiral(segment.params[0], frame_num) if segment.kind == 'spiral' else None
+        for i in range(segment.start, frame_num):
+            t = (min(i, segment.end) - segment.start) / (segment.end - segment.start)
+            if segment.kind == 'trans':
+                current[i, :3, 3] = np.array(segment.params) * t
+            elif segment.kind == 'rot':
+                current[i] = legacy_rotation(segment.params[1] * t, segment.params[0])
+            else:
+                current[i] = spiral[int(t * (frame_num - 1))]
+        final = final @ current
+    return torch.from_numpy(final)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the compiled camera trajectories against the per-frame implementation")
+    parser.add_argument("--frame_num", type=int, default=49, help="Frames of the trajectories")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Tolerance of the comparisons")
+    args = parser.parse_args()
+    n = args.frame_num
+
+    ok = True
+    for spec in (
+        "trans 0 0 0.5",
+        "rot y 25",
+        "trans 0 0 0.5 0 30; rot x 25 0 30; trans 0.1 0 0 30 48",
+        "spiral 2",
+        "rot z -40 10 20; spiral 1.5 5 40; trans -0.2 0.1 0 48 12",
+    ):
+        compiled = compile_motion(spec, n)
+        max_diff = (compiled.double() - legacy_motion(spec, n)).abs().max().item()
+        ok &= check(f"{spec[:44]}: max abs diff {max_diff:.1e}", compiled.shape == (n, 4, 4) and max_diff <= args.atol)
+    ok &= check("spiral poses match the look-at loop",
+                (spiral_matrices(2.0, n) - torch.from_numpy(legacy_spiral(2.0, n))).abs().max().item() <= args.atol)
+
+    # Keyframes: exact at the keys, SLERP halfway between them, orthonormal everywhere
+    poses = compile_motion("key 0 0 0 0; key 24 0 0 1 0 90 0; key 48 0.5 0 1 0 90 30", n).double()
+    ok &= check("keyframe poses are hit", torch.allclose(poses[24, :3, 3], torch.tensor([0.0, 0, 1], dtype=torch.float64), atol=args.atol)
+                and torch.allclose(poses[24], compile_motion("trans 0 0 1; rot y 90", n)[-1].double(), atol=args.atol))
+    ok &= check("rotation is slerped between keys",
+                torch.allclose(poses[12, :3, :3], compile_motion("rot y 45", n)[-1, :3, :3].double(), atol=args.atol))
+    rotations = poses[:, :3, :3]
+    identity = torch.eye(3, dtype=torch.float64).expand_as(rotations)
+    ok &= check("interpolated rotations stay orthonormal", torch.allclose(rotations @ rotations.transpose(1, 2), identity, atol=args.atol))
+    steps = (poses[1:, :3, 3] - poses[:-1, :3, 3]).norm(dim=-1)
+    ok &= check("translation has no jump at the middle key", (steps[23] - steps[24]).abs().item() < 0.2 * steps[23].item())
+
+    # Memoization: a repeated spec is a cache hit and callers cannot corrupt the cached trajectory
+    spec = "rot x 10; trans 0 0 0.3 0 20"
+    first = compile_motion(spec, n)
+    hits = _compiled_motion.cache_info().hits
+    start = time.perf_counter()
+    second = compile_motion("ROT x 10 ;  trans 0 0 0.3 0 20", n)
+    elapsed = time.perf_counter() - start
+    ok &= check(f"repeated spec is served from the cache ({elapsed * 1e6:.0f}us)", _compiled_motion.cache_info().hits == hits + 1)
+    first.zero_()
+    ok &= check("cached trajectory is copied out", torch.equal(compile_motion(spec, n), second))
+
+    for bad in ("trans 1 2", "rot w 10", "zoom 2", "key 3 0 0 0; key 3 1 1 1"):
+        try:
+            compile_motion(bad, n)
+            ok &= check(f"'{bad}' is rejected", False)
+        except ValueError:
+            ok &= check(f"'{bad}' is rejected", True)
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.batching import activation_budget_bytes, estimate_item_bytes, needs_sequential_cfg
+from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking, cfg_forward
+from models.cost_model import GIB, CostModel, JobSpec
+from models.model_cache import module_nbytes
+
+# Reduced transformer that runs in a few milliseconds on CPU
+TINY_CONFIG = dict(
+    num_tracking_blocks=1,
+    num_attention_heads=2,
+    attention_head_dim=16,
+    in_channels=8,
+    out_channels=4,
+    time_embed_dim=16,
+    text_embed_dim=32,
+    num_layers=2,
+    sample_width=8,
+    sample_height=8,
+    sample_frames=9,
+    max_text_seq_length=8,
+)
+
+
+def tiny_transformer(config, seed):
+    """Randomly initialized tracking transformer with a live tracking branch
+
+    The copied blocks are created uninitialized and the mixers at zero, so they are filled the way a converted
+    checkpoint would be: copies of the main blocks and small random mixers.
+    """
+    torch.manual_seed(seed)
+    transformer = CogVideoXTransformer3DModelTracking(**config)
+    for i in range(transformer.num_tracking_blocks):
+        transformer.transformer_blocks_copy[i].load_state_dict(transformer.transformer_blocks[i].state_dict())
+    for linear in [transformer.initial_combine_linear, *transformer.combine_linears]:
+        torch.nn.init.normal_(linear.weight, std=0.02)
+    return transformer.eval()
+
+
+def random_step_inputs(config, batch_size, seed):
+    """CFG-doubled inputs of one denoising step for the tiny transformer"""
+    generator = torch.Generator().manual_seed(seed)
+    latent_frames = (config["sample_frames"] - 1) // 4 + 1
+    shape = (2 * batch_size, latent_frames, config["in_channels"], config["sample_height"], config["sample_width"])
+    hidden_states = torch.randn(*shape, generator=generator)
+    tracking_maps = torch.randn(*shape, generator=generator)
+    encoder_hidden_states = torch.randn(2 * batch_size, config["max_text_seq_length"], config["text_embed_dim"], generator=generator)
+    timestep = torch.full((2 * batch_size,), 999, dtype=torch.long)
+    return hidden_states, encoder_hidden_states, tracking_maps, timestep
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that sequential CFG passes match the batched pass bitwise")
+    parser.add_argument("--batch_size", type=int, default=2, help="Videos per step before CFG doubling")
+    parser.add_argument("--seed", type=int, default=42, help="The seed for reproducibility")
+    args = parser.parse_args()
+
+    torch.use_deterministic_algorithms(True)
+    transformer = tiny_transformer(TINY_CONFIG, args.seed)
+
+    hidden_states, encoder_hidden_states, tracking_maps, timestep = random_step_inputs(TINY_CONFIG, args.batch_size, args.seed)
+    with torch.no_grad():
+        tracking_embeds = transformer.prepare_tracking_embeds(encoder_hidden_states, tracking_maps)
+        outputs = {
+            sequential: cfg_forward(
+                transformer, sequential,
+                hidden_states=hidden_states,
+                encoder_hidden_states=encoder_hidden_states,
+                timestep=timestep,
+                tracking_embeds=tracking_embeds,
+            )
+            for sequential in (False, True)
+        }
+
+    identical = torch.equal(outputs[False], outputs[True])
+    max_diff = (outputs[False] - outputs[True]).abs().max().item()
+    print(f"sequential vs batched: identical={identical}, max abs diff {max_diff:.3e}")
+
+    # The automatic decision on the tiny model: a budget that only just holds the weights runs the CFG halves
+    # sequentially, with the same result; a roomy one keeps the doubled batch
+    height, width = TINY_CONFIG["sample_height"] * 8, TINY_CONFIG["sample_width"] * 8
+    pair_bytes = args.batch_size * estimate_item_bytes(height, width, TINY_CONFIG["sample_frames"], transformer.config, torch.float32)
+    resident_bytes = module_nbytes(transformer)
+    ok = identical
+    for budget_bytes, expected in ((resident_bytes + pair_bytes // 2, True), (resident_bytes + 2 * pair_bytes, False)):
+        activation_bytes = activation_budget_bytes("cpu", budget_bytes / 1024 ** 3, resident_bytes)
+        sequential = needs_sequential_cfg(height, width, TINY_CONFIG["sample_frames"], args.batch_size, transformer.config,
+                                          activation_bytes, torch.float32)
+        with torch.no_grad():
+            output = cfg_forward(transformer, sequential, hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states,
+                                 timestep=timestep, tracking_embeds=tracking_embeds)
+        matches = torch.equal(output, outputs[False])
+        print(f"tiny model, budget {budget_bytes / 1024 ** 2:.1f} MB ({resident_bytes / 1024 ** 2:.1f} MB weights): "
+              f"{'sequential' if sequential else 'batched'}, matches batched CFG: {matches}")
+        ok &= sequential == expected and matches
+
+    # The automatic split of the full-size model at the default resolution, the weights take their share of the budget
+    full_config = argparse.Namespace(num_attention_heads=48, attention_head_dim=64, patch_size=2)
+    item_gb = estimate_item_bytes(480, 720, 49, full_config) / GIB
+    breakdown = CostModel().memory_breakdown(JobSpec())
+    weights_bytes = int(breakdown["resident"] + breakdown["weights"])
+    for budget_gb in (24, 28, 32, 40, 80):
+        activation_bytes = activation_budget_bytes("cpu", budget_gb, weights_bytes)
+        sequential = needs_sequential_cfg(480, 720, 49, 1, full_config, activation_bytes)
+        print(f"480x720x49, {item_gb:.1f} GB per CFG pair, {weights_bytes / GIB:.1f} GB weights, budget {budget_gb} GB: "
+              f"{'sequential' if sequential else 'batched'}")
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,4 @@
+def check(name, condition):
+    """Print one ok/FAILED line of a check script and return `condition`, to be and-ed into its exit status"""
+    print(f"{name:<60} {'ok' if condition else 'FAILED'}")
+    return condition
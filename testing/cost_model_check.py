@@ -0,0 +1,142 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.cost_model import (
+    GIB,
+    AdmissionController,
+    AdmissionError,
+    CalibrationStore,
+    CostModel,
+    JobSpec,
+)
+from testing.checks import check
+
+# Coefficients of a made-up device the calibration has to recover
+TRUE_MEMORY = {"resident": 14.0 * GIB, "weights": 1.1, "activations": 0.6, "vae": 1500.0}
+TRUE_LATENCY = {"overhead": 9.0, "transformer": 1.0 / 90e12, "vae": 3.0e-6}
+
+SPECS = [
+    JobSpec(num_frames=frames, height=height, width=width, batch_size=batch, num_inference_steps=steps,
+            sequential_cfg=sequential, vae_tiling=tiling)
+    for frames, height, width in ((49, 480, 720), (25, 480, 720), (49, 320, 480), (49, 576, 1024))
+    for batch in (1, 2)
+    for steps in (25, 50)
+    for sequential in (False, True)
+    for tiling in (True, False)
+]
+
+
+def max_relative_error(model, reference, specs):
+    errors = []
+    for spec in specs:
+        errors.append(abs(model.predict_memory(spec) - reference.predict_memory(spec)) / reference.predict_memory(spec))
+        errors.append(abs(model.predict_latency(spec) - reference.predict_latency(spec)) / reference.predict_latency(spec))
+    return max(errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the cost model, its calibration and admission control on CPU")
+    parser.add_argument("--num_records", type=int, default=16, help="Recorded runs the calibration gets")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Relative error allowed after calibration")
+    args = parser.parse_args()
+
+    ok = True
+    model = CostModel()
+    base = JobSpec()
+    print(f"default spec: peak {model.predict_memory(base) / GIB:.1f}GB, ~{model.predict_latency(base):.0f}s, "
+          f"{ {name: f'{value / GIB:.1f}GB' for name, value in model.memory_breakdown(base).items()} }")
+
+    # The analytic terms move the way the options do
+    ok &= check("more frames cost more memory and time",
+                model.predict_memory(base) > model.predict_memory(base.replace(num_frames=25))
+                and model.predict_latency(base) > model.predict_latency(base.replace(num_frames=25)))
+    ok &= check("sequential CFG lowers the peak", model.predict_memory(base.replace(sequential_cfg=True)) < model.predict_memory(base))
+    ok &= check("VAE tiling lowers the peak", model.predict_memory(base) < model.predict_memory(base.replace(vae_tiling=False)))
+    ok &= check("fewer tracking blocks cost less",
+                model.predict_memory(base.replace(num_tracking_blocks=9)) < model.predict_memory(base)
+                and model.predict_latency(base.replace(num_tracking_blocks=9)) < model.predict_latency(base))
+    ok &= check("latency scales with steps and windows",
+                model.predict_latency(base.replace(num_inference_steps=25)) < model.predict_latency(base)
+                < model.predict_latency(base.replace(num_windows=2)))
+
+    # Calibration recovers a device from its recorded runs, through the store
+    reference = CostModel(TRUE_MEMORY, TRUE_LATENCY)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = CalibrationStore(os.path.join(tmp_dir, "runs", "calibration.jsonl"))
+        for spec in SPECS[::3][:args.num_records]:
+            store.record(spec, reference.predict_memory(spec), reference.predict_latency(spec), device_name="test-gpu")
+        store.record(base, 1, 1.0, device_name="other-gpu")
+        with open(store.path, "a", encoding="utf-8") as f:
+            f.write("{not json\n")
+        ok &= check("store keeps one device's runs, skips broken lines", len(store.records("test-gpu")) == args.num_records)
+
+        error_before = max_relative_error(CostModel(), reference, SPECS)
+        calibrated = CostModel.from_store(store, "test-gpu")
+        error_after = max_relative_error(calibrated, reference, SPECS)
+        print(f"max relative error: uncalibrated {error_before:.3f}, calibrated {error_after:.3f}")
+        ok &= check("calibration fits held-out specs", error_after <= args.tolerance)
+        ok &= check("calibrated model counts its runs", calibrated.num_records == args.num_records)
+
+    # Admission: admit, down-shift to sequential CFG, reject
+    peak = model.predict_memory(base)
+    sequential_peak = model.predict_memory(base.replace(sequential_cfg=True))
+    controller = AdmissionController(model, peak / 0.95 + GIB)
+    ok &= check("admits a job that fits", controller.plan(base).action == "admit")
+    controller = AdmissionController(model, (peak + sequential_peak) / 2 / 0.95)
+    decision = controller.plan(base)
+    ok &= check("down-shifts to sequential CFG", decision.action == "downshift" and decision.spec.sequential_cfg)
+    controller = AdmissionController(model, sequential_peak / 2)
+    ok &= check("rejects a job that can never fit", controller.plan(base).action == "reject")
+    controller = AdmissionController(model, 10 * peak, max_seconds=1.0)
+    ok &= check("rejects a job over the time limit", controller.plan(base).action == "reject")
+    try:
+        controller.acquire(base)
+        ok &= check("acquire raises AdmissionError on reject", False)
+    except AdmissionError:
+        ok &= check("acquire raises AdmissionError on reject", True)
+
+    # Batches: VAE slicing first, then the largest batch that fits
+    batch = base.replace(batch_size=4, vae_slicing=False)
+    controller = AdmissionController(model, model.predict_memory(batch.replace(vae_slicing=True)) / 0.95 + GIB)
+    decision = controller.plan(batch)
+    ok &= check("down-shifts a batch to VAE slicing", decision.action == "downshift" and decision.spec.vae_slicing
+                and not decision.spec.sequential_cfg)
+    controller = AdmissionController(model, model.predict_memory(base.replace(batch_size=2, sequential_cfg=True)) / 0.95 + GIB)
+    size, decision = controller.max_batch_size(base, 8)
+    ok &= check("largest fitting batch", size == 2 and decision.action in ("admit", "downshift"))
+
+    # Concurrent jobs share the weights and queue for activation memory
+    breakdown = model.memory_breakdown(base)
+    job_bytes = breakdown["activations"] + breakdown["vae"]
+    controller = AdmissionController(model, (peak + job_bytes / 2) / 0.95)
+    first = controller.acquire(base)
+    ok &= check("second job queues behind the first", controller.plan(base).action == "queue")
+    events = []
+
+    def second_job():
+        decision = controller.acquire(base, timeout=10, on_queue=lambda d: events.append("queued"))
+        events.append("admitted")
+        controller.release(decision)
+
+    thread = threading.Thread(target=second_job)
+    thread.start()
+    time.sleep(0.2)
+    ok &= check("queued job waits", events == ["queued"])
+    controller.release(first)
+    thread.join(timeout=10)
+    ok &= check("queued job runs once memory is released", events == ["queued", "admitted"])
+    stats = controller.stats()
+    print(stats)
+    ok &= check("stats count decisions", stats["decisions"]["queue"] == 1 and stats["active_jobs"] == 0)
+    controller = AdmissionController(model, (peak + 2.5 * job_bytes) / 0.95)
+    first = controller.acquire(base)
+    ok &= check("weights are counted once for concurrent jobs", controller.plan(base).action == "admit")
+    controller.release(first)
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.depth import depth_per_frame, estimate_video_depth
+from testing.checks import check
+
+
+class FakeDepthPreprocessor:
+    """Depth from brightness, per PIL image as a min-max normalized depth image or batched as raw tensors
+
+    Args:
+        batched (str): "ok", "raises", "inverted" or "layout", how the batched tensor call behaves
+    """
+
+    def __init__(self, batched="ok"):
+        self.batched = batched
+        self.calls = {"pil": 0, "batched": 0}
+
+    def __call__(self, image, return_type="pil"):
+        if isinstance(image, Image.Image):
+            self.calls["pil"] += 1
+            depth = np.asarray(image, dtype=np.float32).mean(axis=-1)
+            depth = (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)
+            return [Image.fromarray((depth * 255).round().astype(np.uint8))]
+        self.calls["batched"] += 1
+        if self.batched == "raises":
+            raise TypeError("unexpected keyword argument 'return_type'")
+        depth = image.mean(dim=1) * 7.0 + 3.0  # [B, H, W], raw scale
+        if self.batched == "inverted":
+            depth = -depth
+        if self.batched == "layout":
+            depth = depth[:, None].expand(-1, 3, -1, -1)
+        return depth
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check batched depth estimation against the per-frame depth images")
+    parser.add_argument("--num_frames", type=int, default=12, help="Frames of the test video")
+    parser.add_argument("--video_path", type=str, default=None, help="Video to run the real depth preprocessor on")
+    parser.add_argument("--depth_model", type=str, default="Intel/zoedepth-nyu-kitti", help="Checkpoint of the real preprocessor")
+    args = parser.parse_args()
+
+    ok = True
+    generator = torch.Generator().manual_seed(0)
+    video = torch.rand(args.num_frames, 3, 24, 32, generator=generator)
+
+    # A model whose batched output matches its depth images runs batched after a one-frame check
+    model = FakeDepthPreprocessor("ok")
+    depth = estimate_video_depth(model, video, batch_size=5)
+    reference = depth_per_frame(FakeDepthPreprocessor(), video)
+    error = (depth - reference).abs().mean().item()
+    ok &= check(f"batched depth matches per-frame depth (mean abs diff {error:.4f})", depth.shape == reference.shape and error < 0.01)
+    ok &= check("batched calls after one per-frame check", model.calls == {"pil": 1, "batched": 4})
+    estimate_video_depth(model, video, batch_size=5)
+    ok &= check("the check runs once per model", model.calls == {"pil": 1, "batched": 7})
+
+    # Models whose batched call fails or disagrees fall back to the per-frame depth images
+    for behaviour in ("raises", "inverted", "layout"):
+        model = FakeDepthPreprocessor(behaviour)
+        depth = estimate_video_depth(model, video, batch_size=5)
+        ok &= check(f"batched call {behaviour}: per-frame depth", torch.equal(depth, reference))
+
+    # The real preprocessor, where it is installed
+    if args.video_path is not None:
+        from image_gen_aux import DepthPreprocessor
+
+        from demo import load_media
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model = DepthPreprocessor.from_pretrained(args.depth_model).to(device)
+        frames, _, _ = load_media(args.video_path, max_frames=args.num_frames)
+        frames = frames.to(device)
+        reference = depth_per_frame(model, frames)
+        depth = estimate_video_depth(model, frames, batch_size=4)
+        error = (depth - reference).abs().mean().item()
+        ok &= check(f"{args.depth_model}: matches per-frame depth (mean abs diff {error:.4f})", error < 0.02)
+
+    sys.exit(0 if ok else 1)
@@ -1,4 +1,5 @@
 import argparse
+import time
 from typing import Any, Dict, List, Literal, Tuple
 import pandas as pd
 import os
@@ -30,6 +31,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, '..'))
 from models.cogvideox_tracking import CogVideoXImageToVideoPipelineTracking, CogVideoXPipelineTracking, CogVideoXVideoToVideoPipelineTracking
 from training.dataset import VideoDataset, VideoDatasetWithResizingTracking
+from models.prompt_cache import get_prompt_cache
+from models.batching import total_bytes
+from models.cost_model import GIB, AdmissionController, AdmissionError, CalibrationStore, CostModel, JobSpec, read_transformer_config
 
 class VideoDatasetWithResizingTrackingEval(VideoDataset):
     def __init__(self, *args, **kwargs) -> None:
@@ -319,6 +323,11 @@ def generate_video(
     num_samples: int = -1,
     evaluation_dir: str = "evaluations",
     fps: int = 8,
+    prompt_cache_dir: str = None,
+    batch_size: int = 1,
+    memory_gb: float = None,
+    max_seconds: float = None,
+    calibration_path: str = None,
 ):
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -335,6 +344,29 @@ def generate_video(
             random_seed=seed
         )
 
+    # Admission control: per resolution, the largest batch predicted to fit the device, decided before the model is loaded
+    batch_plans = {}
+    calibration = None
+    capacity = memory_gb * GIB if memory_gb else total_bytes(device)
+    if samples and capacity is not None:
+        calibration = CalibrationStore(calibration_path or os.path.join(data_root, evaluation_dir, "cost_calibration.jsonl"))
+        device_name = torch.cuda.get_device_name(device) if torch.cuda.is_available() else None
+        admission = AdmissionController(CostModel.from_store(calibration, device_name), capacity, max_seconds=max_seconds)
+        transformer = read_transformer_config(model_path)
+        if generate_type != "i2v":
+            transformer["num_tracking_blocks"] = 0
+        for size in sorted({(sample["height"], sample["width"]) for sample in samples}):
+            spec = JobSpec(num_frames=49, height=size[0], width=size[1], guidance=guidance_scale > 1.0,
+                           num_inference_steps=num_inference_steps, dtype_bytes=torch.tensor([], dtype=dtype).element_size(),
+                           **transformer)
+            limit, decision = admission.max_batch_size(spec, batch_size)
+            if decision.action == "reject":
+                raise AdmissionError(f"{size[0]}x{size[1]} samples: {decision.reason}")
+            if decision.spec.sequential_cfg and generate_type != "i2v":
+                raise AdmissionError(f"{size[0]}x{size[1]} samples need sequential CFG, which only the tracking pipeline supports")
+            print(f"{size[0]}x{size[1]}: batches of {limit}, {decision}")
+            batch_plans[size] = (limit, decision.spec)
+
     # Load model and data
     if generate_type == "i2v":
         pipe = CogVideoXImageToVideoPipelineTracking.from_pretrained(model_path, torch_dtype=dtype)
@@ -356,54 +388,93 @@ def generate_video(
     pipe.vae.eval()
     pipe.transformer.gradient_checkpointing = False
     pipe.scheduler = CogVideoXDPMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    if hasattr(pipe, "set_prompt_cache"):
+        # the negative prompt is shared by every sample and only encoded once
+        pipe.set_prompt_cache(get_prompt_cache(prompt_cache_dir))
 
     # Generate video
     if samples:
         from tqdm import tqdm
-        for i, sample in tqdm(enumerate(samples), desc="Samples Num:"):
-            print(f"Prompt: {sample['prompt'][:30]}")
-            tracking_frame = sample["tracking_frame"].to(device=device, dtype=dtype)
-            video_frame = sample["video_frame"].to(device=device, dtype=dtype)
-            video = sample["video"].to(device=device, dtype=dtype)
-            tracking_maps = sample["tracking_maps"].to(device=device, dtype=dtype)
-            
-            # VAE
-            print("encoding tracking maps")
-            tracking_video = tracking_maps
-            tracking_maps = tracking_maps.unsqueeze(0)
-            tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, C, F, H, W]
-            with torch.no_grad():
-                tracking_latent_dist = pipe.vae.encode(tracking_maps).latent_dist
-                tracking_maps = tracking_latent_dist.sample() * pipe.vae.config.scaling_factor
-                tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, F, C, H, W]
 
+        # consecutive samples sharing a resolution are denoised together, at most batch_size at a time
+        groups = []
+        for i, sample in enumerate(samples):
+            group_limit = batch_plans.get((sample["height"], sample["width"]), (batch_size, None))[0]
+            if groups and len(groups[-1]) < group_limit and \
+                    (samples[groups[-1][0]]["height"], samples[groups[-1][0]]["width"]) == (sample["height"], sample["width"]):
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+
+        for group in tqdm(groups, desc="Batches:"):
+            prompts, images, tracking_images, tracking_latents, videos, tracking_videos = [], [], [], [], [], []
+            for i in group:
+                sample = samples[i]
+                print(f"Prompt: {sample['prompt'][:30]}")
+                tracking_frame = sample["tracking_frame"].to(device=device, dtype=dtype)
+                video_frame = sample["video_frame"].to(device=device, dtype=dtype)
+                video = sample["video"].to(device=device, dtype=dtype)
+                tracking_maps = sample["tracking_maps"].to(device=device, dtype=dtype)
+                
+                # VAE
+                print("encoding tracking maps")
+                tracking_video = tracking_maps
+                tracking_maps = tracking_maps.unsqueeze(0)
+                tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, C, F, H, W]
+                with torch.no_grad():
+                    tracking_latent_dist = pipe.vae.encode(tracking_maps).latent_dist
+                    tracking_maps = tracking_latent_dist.sample() * pipe.vae.config.scaling_factor
+                    tracking_maps = tracking_maps.permute(0, 2, 1, 3, 4)  # [B, F, C, H, W]
+
+                prompts.append(sample["prompt"])
+                images.append((video_frame + 1.0) / 2.0)
+                tracking_images.append((tracking_frame.unsqueeze(0) + 1.0) / 2.0)
+                tracking_latents.append(tracking_maps)
+                videos.append(video)
+                tracking_videos.append(tracking_video)
 
             pipeline_args = {
-                "prompt": sample["prompt"],
+                "prompt": prompts,
                 "negative_prompt": "The video is not of a high quality, it has a low resolution. Watermark present in each frame. The background is solid. Strange body and strange trajectory. Distortion.",
                 "num_inference_steps": num_inference_steps,
                 "num_frames": 49,
                 "use_dynamic_cfg": True,
                 "guidance_scale": guidance_scale,
-                "generator": torch.Generator(device=device).manual_seed(seed),
-                "height": sample["height"],
-                "width": sample["width"]
+                # one generator per sample, so a sample generates the same video in any batch
+                "generator": [torch.Generator(device=device).manual_seed(seed) for _ in group],
+                "height": samples[group[0]]["height"],
+                "width": samples[group[0]]["width"]
             }
 
-            pipeline_args["image"] = (video_frame + 1.0) / 2.0
+            pipeline_args["image"] = images
             
             if tracking_column and generate_type == "i2v":
-                pipeline_args["tracking_maps"] = tracking_maps
-                pipeline_args["tracking_image"] = (tracking_frame.unsqueeze(0) + 1.0) / 2.0
+                pipeline_args["tracking_maps"] = torch.cat(tracking_latents, dim=0)
+                pipeline_args["tracking_image"] = torch.cat(tracking_images, dim=0)
+
+            plan_spec = batch_plans.get((pipeline_args["height"], pipeline_args["width"]), (None, None))[1]
+            if plan_spec is not None and plan_spec.sequential_cfg:
+                pipeline_args["sequential_cfg"] = True
+            measure = calibration is not None and plan_spec is not None and torch.cuda.is_available()
+            if measure:
+                torch.cuda.reset_peak_memory_stats(device)
+                start = time.perf_counter()
 
             with torch.no_grad():
-                video_generate = pipe(**pipeline_args).frames[0]
+                videos_generate = pipe(**pipeline_args).frames
+
+            if measure:
+                # the tracking encodes above are not timed, the cost model's VAE term absorbs the difference
+                torch.cuda.synchronize(device)
+                calibration.record(plan_spec.replace(batch_size=len(group)), torch.cuda.max_memory_allocated(device),
+                                   time.perf_counter() - start, torch.cuda.get_device_name(device))
 
             output_dir = os.path.join(data_root, evaluation_dir)
-            output_name = f"{i:04d}.mp4"
-            output_file = os.path.join(output_dir, output_name)
             os.makedirs(output_dir, exist_ok=True)
-            export_concat_video(video_generate, video, tracking_video, output_file, fps=fps)
+            for i, video_generate, video, tracking_video in zip(group, videos_generate, videos, tracking_videos):
+                output_name = f"{i:04d}.mp4"
+                output_file = os.path.join(output_dir, output_name)
+                export_concat_video(video_generate, video, tracking_video, output_file, fps=fps)
             
     else:
         pipeline_args = {
@@ -664,6 +735,22 @@ if __name__ == "__main__":
     parser.add_argument("--fps", type=int, default=8, 
                        help="Frames per second for the output video")
 
+    # Add batch_size parameter
+    parser.add_argument("--batch_size", type=int, default=1,
+                       help="Number of dataset samples with the same resolution generated together")
+
+    # Add prompt_cache_dir parameter
+    parser.add_argument("--prompt_cache_dir", type=str, default=None,
+                       help="Directory to persist T5 prompt embeddings across runs")
+
+    # Admission control parameters
+    parser.add_argument("--memory_gb", type=float, default=None,
+                       help="Device memory in GB batches are planned against, defaults to the total memory of the GPU")
+    parser.add_argument("--max_seconds", type=float, default=None,
+                       help="Refuse to start when a batch is predicted to take longer than this")
+    parser.add_argument("--calibration_path", type=str, default=None,
+                       help="JSON lines file of measured batches calibrating the cost model, defaults to <data_root>/<evaluation_dir>/cost_calibration.jsonl")
+
     args = parser.parse_args()
     dtype = torch.float16 if args.dtype == "float16" else torch.bfloat16
     
@@ -688,4 +775,9 @@ if __name__ == "__main__":
         num_samples=args.num_samples,
         evaluation_dir=args.evaluation_dir,
         fps=args.fps,
+        prompt_cache_dir=args.prompt_cache_dir,
+        batch_size=args.batch_size,
+        memory_gb=args.memory_gb,
+        max_seconds=args.max_seconds,
+        calibration_path=args.calibration_path,
     )
\ No newline at end of file
@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.video_io import VideoFrameReader, plan_frame_reads
+from testing.checks import check
+
+
+def write_test_video(path, num_frames, height, width, gop, fps=30):
+    """Moving gradient video with a keyframe every `gop` frames"""
+    import imageio_ffmpeg
+
+    writer = imageio_ffmpeg.write_frames(path, (width, height), fps=fps, codec="libx264",
+                                         output_params=["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0"])
+    writer.send(None)
+    y, x = np.mgrid[0:height, 0:width]
+    for t in range(num_frames):
+        frame = np.stack([(x + 4 * t) % 256, (y + 2 * t) % 256, np.full_like(x, (7 * t) % 256)], axis=-1)
+        writer.send(np.ascontiguousarray(frame, dtype=np.uint8))
+    writer.close()
+
+
+def decoded_frames(reads):
+    """Frames decoded by the forward reads of a plan, the decoding after keyframe seeks not counted"""
+    return sum(skip + 1 for _, skip in reads if skip >= 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the seeking frame reader returns the frames a full decode would")
+    parser.add_argument("--num_frames", type=int, default=300, help="Frames of the test video")
+    parser.add_argument("--gop", type=int, default=30, help="Keyframe interval of the test video")
+    args = parser.parse_args()
+
+    ok = True
+
+    # Read plans: forward decoding inside a GOP, seeks across keyframes
+    keys = list(range(0, 300, 30))
+    ok &= check("dense reads never seek", all(skip >= 0 for _, skip in plan_frame_reads(list(range(0, 49)), keys)))
+    reads = plan_frame_reads([0, 5, 100, 101, 250], keys)
+    ok &= check("sparse reads seek past keyframes", [skip for _, skip in reads] == [0, 4, -1, 0, -1])
+    ok &= check("reads inside the current GOP skip forward", plan_frame_reads([3, 20], keys) == [(3, 3), (20, 16)])
+    ok &= check("reads behind the decoder position seek", plan_frame_reads([3, 20], keys, position=290) == [(3, -1), (20, 16)])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        import decord
+
+        path = os.path.join(tmp_dir, "test.mp4")
+        write_test_video(path, args.num_frames, 96, 128, args.gop)
+
+        reader = VideoFrameReader(path, size=(48, 80))
+        ok &= check("metadata read from the container", reader.num_frames == args.num_frames and abs(reader.fps - 30) < 1e-3)
+        ok &= check("keyframes found", reader.key_indices[:2] == [0, args.gop])
+
+        full = decord.VideoReader(path, width=80, height=48)
+        for name, indices in (
+            ("first 49 frames", np.arange(49)),
+            ("49 frames spread over the video", np.linspace(0, args.num_frames - 1, 49).astype(int)),
+            ("repeated and unordered frames", np.array([10, 10, 250, 3, 3, 120])),
+        ):
+            frames = reader.read(indices)
+            reference = torch.from_numpy(full.get_batch(list(indices)).asnumpy()).permute(0, 3, 1, 2)
+            ok &= check(f"{name}: uint8 [T,C,H,W]", frames.dtype == torch.uint8 and tuple(frames.shape) == (len(indices), 3, 48, 80))
+            ok &= check(f"{name}: equal to a full decode", torch.equal(frames, reference))
+
+        spread = sorted(set(np.linspace(0, args.num_frames - 1, 49).astype(int).tolist()))
+        print(f"frames decoded for 49 spread frames: {decoded_frames(plan_frame_reads(spread, reader.key_indices))} "
+              f"of {args.num_frames} (plus keyframe seeks)")
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,125 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from models.job_scheduler import GenerationRequest, GenerationScheduler
+from testing.checks import check
+
+
+class RecordingPipeline:
+    """Stand-in for `DiffusionAsShaderPipeline` that records the batches it is asked to generate"""
+
+    def __init__(self, delay=0.05, fail_prompt=None):
+        self.delay = delay
+        self.fail_prompt = fail_prompt
+        self.batches = []
+        self.options = []
+
+    def encode_tracking(self, tracking_tensor, model_path, dtype=torch.bfloat16):
+        return torch.zeros(1, 13, 16, 60, 90)
+
+    def generate_batch(self, prompts, image_tensors, tracking_tensors, seeds, model_path, num_inference_steps,
+                       guidance_scale, dtype, tracking_latents=None, cache_threshold=None, sequential_cfg=None,
+                       vae_slicing=None, vae_tiling=None):
+        self.batches.append(list(prompts))
+        self.options.append((sequential_cfg, vae_slicing, vae_tiling))
+        time.sleep(self.delay)
+        if self.fail_prompt in prompts:
+            raise RuntimeError("generation failed")
+        return [f"{prompt}/{seed}" for prompt, seed in zip(prompts, seeds)]
+
+
+def request(prompt, seed=0, steps=50, frames=49, **options):
+    generator = torch.Generator().manual_seed(seed)
+    return GenerationRequest(
+        prompt=prompt,
+        image_tensor=torch.rand(3, 48, 72, generator=generator),
+        tracking_tensor=torch.zeros(frames, 48, 72, 3, dtype=torch.uint8),
+        model_path="checkpoint",
+        seed=seed,
+        num_inference_steps=steps,
+        **options,
+    )
+
+
+def submit_together(scheduler, requests):
+    """Submit from one thread per request, as concurrent jobs would"""
+    futures = [None] * len(requests)
+
+    def submit(i):
+        futures[i] = scheduler.submit(requests[i])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return futures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check batching, deduplication and metrics of the generation scheduler")
+    parser.add_argument("--window", type=float, default=0.2, help="Batching window in seconds")
+    args = parser.parse_args()
+
+    ok = True
+
+    # Compatible requests share a batch, incompatible ones do not
+    das = RecordingPipeline()
+    scheduler = GenerationScheduler(das, window=args.window)
+    requests = [request("a", 1), request("b", 2), request("c", 3), request("d", 4, steps=25)]
+    futures = submit_together(scheduler, requests)
+    results = [future.result(timeout=10) for future in futures]
+    ok &= check("results fan out to their submitters", results == ["a/1", "b/2", "c/3", "d/4"])
+    ok &= check("compatible requests coalesce", sorted(map(sorted, das.batches)) == [["a", "b", "c"], ["d"]])
+
+    # Identical submissions run once and share the result
+    das.batches.clear()
+    futures = submit_together(scheduler, [request("e", 5), request("e", 5), request("f", 6)])
+    ok &= check("identical submissions share one future", futures[0] is futures[1])
+    ok &= check("duplicates get the result", futures[1].result(timeout=10) == "e/5")
+    futures[2].result(timeout=10)
+    ok &= check("duplicates are generated once", sorted(das.batches[0]) == ["e", "f"])
+
+    stats = scheduler.stats()
+    print(stats)
+    ok &= check("metrics count batches and duplicates", stats["batches"] == 3 and stats["deduplicated"] == 1)
+    ok &= check("batch size histogram", stats["batch_size_histogram"] == {1: 1, 2: 1, 3: 1})
+    ok &= check("wait times cover every submission", stats["wait_seconds"]["count"] == 7)
+    ok &= check("queue drained", stats["queue_depth"] == 0)
+
+    # A batch runs with the strictest memory-saving options of its jobs
+    das.options.clear()
+    futures = submit_together(scheduler, [request("i", 12), request("j", 13, sequential_cfg=True, vae_tiling=True)])
+    [future.result(timeout=10) for future in futures]
+    ok &= check("admission down-shifts apply to the whole batch", das.options == [(True, None, True)])
+    das.options.clear()
+    scheduler.submit(request("k", 14)).result(timeout=10)
+    ok &= check("a batch without down-shifts keeps the defaults", das.options == [(None, None, None)])
+    scheduler.close()
+
+    # A full group does not wait for the window
+    das = RecordingPipeline()
+    scheduler = GenerationScheduler(das, window=60.0, max_batch_size=2)
+    start = time.monotonic()
+    futures = submit_together(scheduler, [request("g", 7), request("h", 8)])
+    [future.result(timeout=10) for future in futures]
+    ok &= check("max_batch_size dispatches early", time.monotonic() - start < 5)
+    scheduler.close()
+
+    # A failed batch fails every submission in it, later batches still run
+    das = RecordingPipeline(fail_prompt="bad")
+    scheduler = GenerationScheduler(das, window=args.window)
+    futures = submit_together(scheduler, [request("bad", 9), request("fine", 10)])
+    errors = [future.exception(timeout=10) for future in futures]
+    ok &= check("batch failure reaches all submitters", all(isinstance(e, RuntimeError) for e in errors))
+    ok &= check("scheduler keeps running", scheduler.submit(request("next", 11)).result(timeout=10) == "next/11")
+    scheduler.close()
+
+    sys.exit(0 if ok else 1)
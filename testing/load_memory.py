@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+
+
+def load_once(checkpoint, subfolder, stream_weights, dtype):
+    """Load the transformer in this process and return (seconds, peak RSS in GB)"""
+    import torch
+    from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking
+
+    start = time.perf_counter()
+    CogVideoXTransformer3DModelTracking.from_pretrained(
+        checkpoint,
+        subfolder=subfolder,
+        torch_dtype=torch.float16 if dtype == "float16" else torch.bfloat16,
+        stream_weights=stream_weights,
+    )
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+
+def measure(checkpoint, subfolder, stream_weights, dtype):
+    """Run `load_once` in a fresh interpreter so every path starts from the same RSS"""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--checkpoint", checkpoint, "--dtype", dtype,
+    ]
+    if subfolder:
+        command += ["--subfolder", subfolder]
+    if not stream_weights:
+        command.append("--legacy")
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak RSS of loading the tracking transformer, streamed vs legacy")
+    parser.add_argument("--checkpoint", type=str, action="append", required=True,
+                        help="Model directory; pass a DaS checkpoint and a plain CogVideoX one to cover both paths")
+    parser.add_argument("--subfolder", type=str, default="transformer", help="Subfolder holding the transformer")
+    parser.add_argument("--dtype", type=str, default="bfloat16", help="The data type to load in")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--legacy", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        elapsed, peak_gb = load_once(args.checkpoint[0], args.subfolder, not args.legacy, args.dtype)
+        print(json.dumps({"seconds": elapsed, "peak_rss_gb": peak_gb}))
+        sys.exit(0)
+
+    for checkpoint in args.checkpoint:
+        for stream_weights in (False, True):
+            result = measure(checkpoint, args.subfolder, stream_weights, args.dtype)
+            name = "streamed" if stream_weights else "legacy"
+            print(f"{checkpoint} {name}: peak RSS {result['peak_rss_gb']:.2f} GB, {result['seconds']:.1f} s")
@@ -0,0 +1,98 @@
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from cfg_equivalence import random_step_inputs, tiny_transformer
+from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking
+from models.quantization import module_bytes
+
+# Reduced transformer, large enough for the linear layers to dominate the forward pass
+SMALL_CONFIG = dict(
+    num_tracking_blocks=2,
+    num_attention_heads=4,
+    attention_head_dim=32,
+    in_channels=8,
+    out_channels=4,
+    time_embed_dim=32,
+    text_embed_dim=64,
+    num_layers=4,
+    sample_width=16,
+    sample_height=16,
+    sample_frames=9,
+    max_text_seq_length=16,
+)
+
+
+def forward(transformer, inputs):
+    hidden_states, encoder_hidden_states, tracking_maps, timestep = inputs
+    return transformer(
+        hidden_states=hidden_states,
+        encoder_hidden_states=encoder_hidden_states,
+        timestep=timestep,
+        tracking_maps=tracking_maps,
+        return_dict=False,
+    )[0]
+
+
+def relative_error(output, reference):
+    return ((output - reference).norm() / reference.norm().clamp_min(1e-8)).item()
+
+
+def measure(transformer, inputs, reference, repeats):
+    """(relative output error, ms per forward, weight MB)"""
+    with torch.no_grad():
+        output = forward(transformer, inputs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            forward(transformer, inputs)
+        elapsed = (time.perf_counter() - start) / repeats
+    return relative_error(output, reference), elapsed * 1000, module_bytes(transformer) / 1024 ** 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare weight-only quantization variants of the tracking transformer on CPU")
+    parser.add_argument("--group_size", type=int, default=64, help="Input channels sharing one scale")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed forward passes per variant")
+    parser.add_argument("--per_block", action="store_true", help="Also quantize one block at a time to int4 to find sensitive blocks")
+    parser.add_argument("--seed", type=int, default=42, help="The seed for reproducibility")
+    args = parser.parse_args()
+
+    base = tiny_transformer(SMALL_CONFIG, args.seed)
+    inputs = random_step_inputs(SMALL_CONFIG, 1, args.seed)
+    with torch.no_grad():
+        reference = forward(base, inputs)
+
+    variants = {"reference": {}}
+    for bits in (8, 4):
+        variants[f"all int{bits}"] = dict(bits=bits)
+        variants[f"main blocks int{bits}"] = dict(bits=bits, include=("transformer_blocks.",))
+        variants[f"tracking blocks int{bits}"] = dict(bits=bits, include=("transformer_blocks_copy.",))
+    if args.per_block:
+        for i in range(SMALL_CONFIG["num_layers"]):
+            variants[f"main block {i} int4"] = dict(bits=4, include=(f"transformer_blocks.{i}.",))
+        for i in range(SMALL_CONFIG["num_tracking_blocks"]):
+            variants[f"tracking block {i} int4"] = dict(bits=4, include=(f"transformer_blocks_copy.{i}.",))
+
+    print(f"{'variant':<26} {'rel. error':>10} {'ms/forward':>11} {'weights MB':>11}")
+    for name, options in variants.items():
+        model = copy.deepcopy(base)
+        if options:
+            model.quantize(group_size=args.group_size, **options)
+        error, ms, mb = measure(model, inputs, reference, args.repeats)
+        print(f"{name:<26} {error:>10.2e} {ms:>11.2f} {mb:>11.3f}")
+
+    # Quantized checkpoints load through from_pretrained without requantizing
+    model = copy.deepcopy(base).quantize(bits=4, group_size=args.group_size)
+    with tempfile.TemporaryDirectory() as tmp_dir, torch.no_grad():
+        model.save_pretrained(tmp_dir)
+        loaded = CogVideoXTransformer3DModelTracking.from_pretrained(tmp_dir, torch_dtype=torch.float32).eval()
+        identical = torch.equal(forward(model, inputs), forward(loaded, inputs))
+    print(f"int4 save_pretrained/from_pretrained round trip identical: {identical}")
+    sys.exit(0 if identical else 1)
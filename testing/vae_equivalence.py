@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+
+import torch
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..'))
+from diffusers.models import AutoencoderKLCogVideoX
+from models.streaming_decode import iter_decode_latents
+
+# Reduced VAE with the CogVideoX layout: 8x spatial and 4x causal temporal compression
+TINY_VAE_CONFIG = dict(
+    block_out_channels=(16, 16, 16, 16),
+    latent_channels=4,
+    layers_per_block=1,
+    norm_num_groups=4,
+    sample_height=48,
+    sample_width=64,
+)
+
+
+def tiny_vae(seed, tiled):
+    torch.manual_seed(seed)
+    vae = AutoencoderKLCogVideoX(**TINY_VAE_CONFIG).eval()
+    if tiled:
+        # tiles smaller than the test video, so the decode is tiled
+        vae.enable_tiling(tile_sample_min_height=32, tile_sample_min_width=32)
+    return vae
+
+
+def report(name, output, reference, atol):
+    max_diff = (output - reference).abs().max().item()
+    ok = output.shape == reference.shape and max_diff <= atol
+    print(f"{name:<58} max abs diff {max_diff:.3e} {'ok' if ok else 'FAILED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the streamed VAE decode against the VAE on CPU")
+    parser.add_argument("--num_frames", type=int, default=17, help="Frames of the test video, 4k+1")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Tolerance of the equivalence checks")
+    parser.add_argument("--seed", type=int, default=42, help="The seed for reproducibility")
+    args = parser.parse_args()
+
+    generator = torch.Generator().manual_seed(args.seed)
+    video = torch.rand(1, 3, args.num_frames, TINY_VAE_CONFIG["sample_height"], TINY_VAE_CONFIG["sample_width"], generator=generator) * 2 - 1
+
+    ok = True
+    with torch.no_grad():
+        for tiled in (False, True):
+            mode = "tiled" if tiled else "untiled"
+            vae = tiny_vae(args.seed, tiled)
+
+            # Streaming decode: the chunks concatenate to `vae.decode`
+            latents = vae.encode(video).latent_dist.mode().permute(0, 2, 1, 3, 4) * vae.config.scaling_factor
+            reference = vae.decode(latents.permute(0, 2, 1, 3, 4) / vae.config.scaling_factor).sample
+            streamed = torch.cat(list(iter_decode_latents(vae, latents)), dim=2)
+            ok &= report(f"{mode} streamed decode vs vae.decode", streamed, reference, args.atol)
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import subprocess
+import socket
+import sys
+import tempfile
+import threading
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+sys.path.append(project_root)
+from models.worker import (
+    AUTHKEY_ENV,
+    CameraControlJob,
+    MeshAnimationJob,
+    MotionTransferJob,
+    ObjectManipulationJob,
+    WorkerClient,
+    WorkerError,
+    new_authkey,
+)
+from testing.checks import check
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the inference worker protocol against a stub worker, no GPU needed")
+    parser.add_argument("--port", type=int, default=7871, help="Port of the stub worker")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "input.mp4")
+        image_path = os.path.join(tmp_dir, "input.png")
+        for path in (video_path, image_path):
+            with open(path, "wb") as f:
+                f.write(b"stub media")
+
+        # Without a key the worker refuses to listen beyond loopback
+        env = {key: value for key, value in os.environ.items() if key != AUTHKEY_ENV}
+        refused = subprocess.run(
+            [sys.executable, "-m", "models.worker", "--stub", "--host", "0.0.0.0", "--port", str(args.port),
+             "--output_dir", os.path.join(tmp_dir, "outputs")],
+            cwd=os.path.abspath(project_root), env=env, capture_output=True, text=True, timeout=60,
+        )
+        ok &= check("no key: refuses to listen on 0.0.0.0", refused.returncode != 0 and AUTHKEY_ENV in refused.stderr)
+
+        authkey = new_authkey()
+        worker = subprocess.Popen(
+            [sys.executable, "-m", "models.worker", "--stub", "--stub_delay", "0.05",
+             "--port", str(args.port), "--output_dir", os.path.join(tmp_dir, "outputs")],
+            cwd=os.path.abspath(project_root), env={**env, AUTHKEY_ENV: authkey},
+        )
+        try:
+            client = WorkerClient(("127.0.0.1", args.port), authkey=authkey.encode("utf-8"))
+            client.wait_ready(timeout=30, interval=0.2, process=worker)
+
+            # Clients without the key are turned away, a silent connection blocks no other client
+            ok &= check("wrong key is rejected", not WorkerClient(("127.0.0.1", args.port), authkey=b"guess").ping())
+            with socket.create_connection(("127.0.0.1", args.port)):
+                ok &= check("silent client does not block others", client.ping())
+
+            jobs = [
+                MotionTransferJob(video_path, "a dog running", repaint="true"),
+                CameraControlJob(video_path, "a street", camera_motion="rot y 25 0 48", tracking_method="moge"),
+                ObjectManipulationJob(image_path, "a cup", object_motion="up", object_mask=image_path),
+                MeshAnimationJob(video_path, "a robot", tracking_path=video_path),
+            ]
+            for job in jobs:
+                events = []
+                artifacts = client.submit(job, on_event=events.append)
+                kinds = [event.kind for event in events]
+                ok &= check(f"{job.kind}: queued, progress, result", kinds[0] == "queued" and kinds[-1] == "result"
+                            and kinds.count("progress") == 4 and all(e.job_id == job.job_id for e in events))
+                with open(artifacts[-1], "r", encoding="utf-8") as f:
+                    argv = json.load(f)["argv"]
+                ok &= check(f"{job.kind}: demo.py options forwarded", all(
+                    f"--{key}" in argv for key, value in job.options().items() if value is not None))
+                ok &= check(f"{job.kind}: video artifact first for video inputs",
+                            (artifacts[0].endswith("result.mp4")) == job.input_path.endswith(".mp4"))
+
+            # Failures come back as WorkerError instead of killing the worker
+            try:
+                client.submit(MotionTransferJob(os.path.join(tmp_dir, "missing.mp4")))
+                ok &= check("missing input raises WorkerError", False)
+            except WorkerError as e:
+                ok &= check("missing input raises WorkerError", "does not exist" in str(e))
+
+            # Concurrent clients are served one job at a time, in order
+            results = {}
+
+            def submit(i):
+                results[i] = client.submit(CameraControlJob(video_path, f"prompt {i}", job_id=f"concurrent-{i}"))
+
+            threads = [threading.Thread(target=submit, args=(i,)) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            ok &= check("concurrent jobs all complete", sorted(results) == [0, 1, 2])
+            ok &= check("worker still answers", client.ping())
+            stats = client.stats()
+            ok &= check("stats count completed and failed jobs", stats["completed"] == 7 and stats["failed"] == 1)
+        finally:
+            worker.terminate()
+            worker.wait()
+
+    sys.exit(0 if ok else 1)
@@ -73,6 +73,17 @@ def _get_dataset_args(parser: argparse.ArgumentParser) -> None:
         default=18,
         help="Number of tracking blocks to use.",
     )
+    parser.add_argument(
+        "--tracking_token_stride",
+        type=int,
+        default=None,
+        help="Run the tracking blocks on tracking tokens average-pooled over stride x stride latent patches. Fine-tunes the tracking branch for the reduced token count and is saved with the checkpoint config. Defaults to the value of the loaded checkpoint.",
+    )
+    parser.add_argument(
+        "--delta_checkpoints",
+        action="store_true",
+        help="Save training checkpoints as tracking-branch deltas (initial_combine_linear, combine_linears, transformer_blocks_copy) with a manifest pointing at `--pretrained_model_name_or_path` instead of the whole transformer.",
+    )
     parser.add_argument(
         "--id_token",
         type=str,
@@ -102,6 +113,12 @@ def _get_dataset_args(parser: argparse.ArgumentParser) -> None:
         action="store_true",
         help="Whether to use a pre-encoded tensor dataset of latents and prompt embeddings instead of videos and text prompts. The expected format is that saved by running the `prepare_dataset.py` script.",
     )
+    parser.add_argument(
+        "--prompt_cache_dir",
+        type=str,
+        default=None,
+        help="Directory to persist T5 prompt embeddings across steps and runs when `--load_tensors` is not used. Repeated prompts are only encoded once.",
+    )
     parser.add_argument(
         "--random_flip",
         type=float,
@@ -69,6 +69,8 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, '..'))
 from models.cogvideox_tracking import CogVideoXImageToVideoPipelineTracking
 from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking, CogVideoXPipelineTracking
+from models.checkpoint_io import read_delta_manifest
+from models.prompt_cache import PromptEmbeddingCache
 
 logger = get_logger(__name__)
 
@@ -390,6 +392,7 @@ def main(args):
         subfolder="text_encoder",
         revision=args.revision,
     )
+    prompt_cache = PromptEmbeddingCache(cache_dir=args.prompt_cache_dir) if args.prompt_cache_dir else None
 
     # CogVideoX-2b weights are stored in float16
     # CogVideoX-5b and CogVideoX-5b-I2V weights are stored in bfloat16
@@ -411,6 +414,9 @@ def main(args):
             variant=args.variant,
             num_tracking_blocks=args.num_tracking_blocks,
         )
+        if args.tracking_token_stride is not None:
+            # Adapt the tracking branch to pooled tracking tokens, see `set_tracking_token_stride`
+            transformer.set_tracking_token_stride(args.tracking_token_stride)
 
     vae = AutoencoderKLCogVideoX.from_pretrained(
         args.pretrained_model_name_or_path,
@@ -479,9 +485,15 @@ def main(args):
                 if isinstance(unwrap_model(model), type(unwrap_model(transformer))):
                     model: CogVideoXTransformer3DModelTracking
                     model = unwrap_model(model)
-                    model.save_pretrained(
-                        os.path.join(output_dir, "transformer"), safe_serialization=True, max_shard_size="5GB"
-                    )
+                    if args.delta_checkpoints:
+                        # the frozen base weights are not rewritten, only the trainable tracking branch
+                        model.save_delta(
+                            os.path.join(output_dir, "transformer"), args.pretrained_model_name_or_path, "transformer"
+                        )
+                    else:
+                        model.save_pretrained(
+                            os.path.join(output_dir, "transformer"), safe_serialization=True, max_shard_size="5GB"
+                        )
                 else:
                     raise ValueError(f"Unexpected save model: {model.__class__}")
 
@@ -536,14 +548,19 @@ def main(args):
         else:
             with init_empty_weights():
                 transformer_ = CogVideoXTransformer3DModelTracking.from_config(
-                    args.pretrained_model_name_or_path, subfolder="transformer", num_tracking_blocks=args.num_tracking_blocks
+                    args.pretrained_model_name_or_path, subfolder="transformer", num_tracking_blocks=args.num_tracking_blocks,
+                    tracking_token_stride=args.tracking_token_stride or 1,
                 )
                 init_under_meta = True
 
-        load_model = CogVideoXTransformer3DModelTracking.from_pretrained(os.path.join(input_dir, "transformer"))
-        transformer_.register_to_config(**load_model.config)
-        transformer_.load_state_dict(load_model.state_dict(), assign=init_under_meta)
-        del load_model
+        if read_delta_manifest(os.path.join(input_dir, "transformer")) is not None and not init_under_meta:
+            # the frozen weights are already in place, only the tracking branch changes
+            transformer_.load_delta(os.path.join(input_dir, "transformer"))
+        else:
+            load_model = CogVideoXTransformer3DModelTracking.from_pretrained(os.path.join(input_dir, "transformer"))
+            transformer_.register_to_config(**load_model.config)
+            transformer_.load_state_dict(load_model.state_dict(), assign=init_under_meta)
+            del load_model
 
         # Make sure the trainable params are in float32. This is again needed since the base models
         # are in `weight_dtype`. More details:
@@ -927,6 +944,7 @@ def main(args):
                         accelerator.device,
                         weight_dtype,
                         requires_grad=False,
+                        prompt_cache=prompt_cache,
                     )
                 else:
                     prompt_embeds = prompts.to(dtype=weight_dtype)
@@ -64,6 +64,7 @@ from utils import get_gradient_norm, get_optimizer, prepare_rotary_positional_em
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, '..'))
 from models.cogvideox_tracking import CogVideoXTransformer3DModelTracking, CogVideoXPipelineTracking
+from models.prompt_cache import PromptEmbeddingCache
 
 logger = get_logger(__name__)
 
@@ -349,6 +350,7 @@ def main(args):
         subfolder="text_encoder",
         revision=args.revision,
     )
+    prompt_cache = PromptEmbeddingCache(cache_dir=args.prompt_cache_dir) if args.prompt_cache_dir else None
 
     # CogVideoX-2b weights are stored in float16
     # CogVideoX-5b and CogVideoX-5b-I2V weights are stored in bfloat16
@@ -746,6 +748,7 @@ def main(args):
                         accelerator.device,
                         weight_dtype,
                         requires_grad=False,
+                        prompt_cache=prompt_cache,
                     )
                 else:
                     prompt_embeds = prompts.to(dtype=weight_dtype)
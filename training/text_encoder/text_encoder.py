@@ -74,6 +74,7 @@ def compute_prompt_embeddings(
     device: torch.device,
     dtype: torch.dtype,
     requires_grad: bool = False,
+    prompt_cache=None,
 ):
     if requires_grad:
         prompt_embeds = encode_prompt(
@@ -85,6 +86,26 @@ def compute_prompt_embeddings(
             device=device,
             dtype=dtype,
         )
+    elif prompt_cache is not None:
+        # only prompts missing from the cache go through the text encoder
+        prompt = [prompt] if isinstance(prompt, str) else list(prompt)
+        with torch.no_grad():
+            prompt_embeds = prompt_cache.fetch(
+                prompt,
+                lambda prompts: encode_prompt(
+                    tokenizer,
+                    text_encoder,
+                    prompts,
+                    num_videos_per_prompt=1,
+                    max_sequence_length=max_sequence_length,
+                    device=device,
+                    dtype=dtype,
+                ),
+                getattr(tokenizer, "name_or_path", None) or "t5",
+                max_sequence_length,
+                dtype,
+                device=device,
+            )
     else:
         with torch.no_grad():
             prompt_embeds = encode_prompt(
@@ -4,11 +4,23 @@ import gradio as gr
 import torch
 import subprocess
 import argparse
-import glob
+import atexit
 
 project_root = os.path.dirname(os.path.abspath(__file__))
 os.environ["GRADIO_TEMP_DIR"] = os.path.join(project_root, "tmp", "gradio")
 sys.path.append(project_root)
+from models.worker import (
+    AUTHKEY_ENV,
+    DEFAULT_ADDRESS,
+    CameraControlJob,
+    MeshAnimationJob,
+    MotionTransferJob,
+    ObjectManipulationJob,
+    WorkerClient,
+    WorkerError,
+    is_loopback,
+    new_authkey,
+)
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description="Diffusion as Shader Web UI")
@@ -17,6 +29,12 @@ parser.add_argument("--share", action="store_true", help="Share the web UI")
 parser.add_argument("--gpu", type=int, default=0, help="GPU device ID")
 parser.add_argument("--model_path", type=str, default="EXCAI/Diffusion-As-Shader", help="Path to model checkpoint")
 parser.add_argument("--output_dir", type=str, default="outputs", help="Output directory")
+parser.add_argument("--worker_address", type=str, default=None,
+                    help=f"host:port of a running inference worker sharing {AUTHKEY_ENV}, one is started on 127.0.0.1:7861 if none answers")
+parser.add_argument("--stub_worker", action="store_true", help="Start the worker without models, to try the UI without a GPU")
+parser.add_argument("--memory_gb", type=float, default=None,
+                    help="Device memory in GB the worker admits jobs against, defaults to the total memory of the GPU")
+parser.add_argument("--max_seconds", type=float, default=None, help="Reject jobs predicted to take longer than this")
 args = parser.parse_args()
 
 # Use the original GPU ID throughout the entire code for consistency
@@ -39,6 +57,13 @@ else:
 DEFAULT_MODEL_PATH = args.model_path
 OUTPUT_DIR = args.output_dir
 
+if args.worker_address:
+    host, port = args.worker_address.rsplit(":", 1)
+    WORKER_ADDRESS = (host, int(port))
+else:
+    WORKER_ADDRESS = DEFAULT_ADDRESS
+worker_client = WorkerClient(WORKER_ADDRESS)
+
 # Create necessary directories
 os.makedirs("outputs", exist_ok=True)
 # Create project tmp directory instead of using system temp
@@ -84,235 +109,120 @@ def save_uploaded_file(file):
         
     return temp_path
 
-def create_run_command(args):
-    """Create command based on input parameters"""
-    cmd = ["python", "demo.py"]
-    
-    if "prompt" not in args or args["prompt"] is None or args["prompt"] == "":
-        args["prompt"] = ""
-    if "checkpoint_path" not in args or args["checkpoint_path"] is None or args["checkpoint_path"] == "":
-        args["checkpoint_path"] = DEFAULT_MODEL_PATH
-    
-    # 添加调试输出
-    print(f"DEBUG: Command args: {args}")
+def start_worker():
+    """Start the inference worker unless one already answers at WORKER_ADDRESS
     
-    for key, value in args.items():
-        if value is not None:
-            # Handle boolean values correctly - for repaint, we need to pass true/false
-            if isinstance(value, bool):
-                cmd.append(f"--{key}")
-                cmd.append(str(value).lower())  # Convert True/False to true/false
-            else:
-                cmd.append(f"--{key}")
-                cmd.append(str(value))
-    
-    return cmd
+    The worker loads the models once and keeps them resident, every Gradio action is a job sent to it.
+    """
+    if worker_client.ping():
+        print(f"Using the inference worker at {WORKER_ADDRESS}")
+        return None
+    if not is_loopback(WORKER_ADDRESS[0]):
+        raise WorkerError(f"No inference worker accepting {AUTHKEY_ENV} at {WORKER_ADDRESS}, "
+                          f"start it there with the same {AUTHKEY_ENV}")
+    # a fresh key per worker, handed to the child through its environment
+    authkey = new_authkey()
+    worker_client.authkey = authkey.encode("utf-8")
+    cmd = [
+        sys.executable, "-m", "models.worker",
+        "--host", WORKER_ADDRESS[0], "--port", str(WORKER_ADDRESS[1]),
+        "--gpu", str(args.gpu), "--checkpoint_path", DEFAULT_MODEL_PATH, "--output_dir", OUTPUT_DIR,
+    ]
+    if args.memory_gb is not None:
+        cmd += ["--memory_gb", str(args.memory_gb)]
+    if args.max_seconds is not None:
+        cmd += ["--max_seconds", str(args.max_seconds)]
+    if args.stub_worker:
+        cmd.append("--stub")
+    print(f"Starting inference worker: {' '.join(cmd)}")
+    process = subprocess.Popen(cmd, cwd=project_root, env={**os.environ, AUTHKEY_ENV: authkey})
+    atexit.register(process.terminate)
+    worker_client.wait_ready(process=process)
+    return process
 
-def run_process(cmd):
-    """Run command and return output"""
-    print(f"Running command: {' '.join(cmd)}")
-    process = subprocess.Popen(
-        cmd, 
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True
-    )
-    
-    output = []
-    for line in iter(process.stdout.readline, ""):
-        print(line, end="")
-        output.append(line)
-        if not line:
-            break
-    
-    process.stdout.close()
-    return_code = process.wait()
-    
-    if return_code:
-        stderr = process.stderr.read()
-        print(f"Error: {stderr}")
-        raise subprocess.CalledProcessError(return_code, cmd, output="\n".join(output), stderr=stderr)
-    
-    return "\n".join(output)
+def run_job(job, progress):
+    """Send a job to the worker, forward its progress and return the generated video"""
+    def on_event(event):
+        print(f"[{event.job_id}] {event.kind}: {event.message.splitlines()[0] if event.message else ''}")
+        if event.kind in ("queued", "progress"):
+            progress(None, desc=event.message)
 
-# Process functions for each tab
-def process_motion_transfer(source, prompt, mt_repaint_option, mt_repaint_image):
-    """Process video motion transfer task"""
     try:
-        # Save uploaded files
-        input_video_path = save_uploaded_file(source)
-        if input_video_path is None:
-            return None
-        
-        print(f"DEBUG: Repaint option: {mt_repaint_option}")
-        print(f"DEBUG: Repaint image: {mt_repaint_image}")
-        
-        args = {
-            "input_path": input_video_path,
-            "prompt": f"\"{prompt}\"",
-            "checkpoint_path": DEFAULT_MODEL_PATH,
-            "output_dir": OUTPUT_DIR,
-            "gpu": GPU_ID
-        }
-        
-        # Priority: Custom Image > Yes > No
-        if mt_repaint_image is not None:
-            # Custom image takes precedence if provided
-            repaint_path = save_uploaded_file(mt_repaint_image)
-            print(f"DEBUG: Repaint path: {repaint_path}")
-            args["repaint"] = repaint_path
-        elif mt_repaint_option == "Yes":
-            # Otherwise use Yes/No selection
-            args["repaint"] = "true"
-        
-        # Create and run command
-        cmd = create_run_command(args)
-        output = run_process(cmd)
-        
-        # Find generated video files
-        output_files = glob.glob(os.path.join(OUTPUT_DIR, "*.mp4"))
-        if output_files:
-            # Sort by modification time, return the latest file
-            latest_file = max(output_files, key=os.path.getmtime)
-            return latest_file
-        else:
-            return None
+        return worker_client.submit(job, on_event=on_event)[0]
+    except WorkerError as e:
+        # jobs rejected by admission control tell the user why instead of failing silently
+        reason = str(e).strip().splitlines()[-1]
+        if reason.startswith("models.cost_model.AdmissionError") or reason.startswith("AdmissionError"):
+            raise gr.Error(reason.split(":", 1)[-1].strip())
+        print(f"Processing failed: {str(e)}")
+        return None
     except Exception as e:
-        import traceback
-        print(f"Processing failed: {str(e)}\n{traceback.format_exc()}")
+        print(f"Processing failed: {str(e)}")
         return None
 
-def process_camera_control(source, prompt, camera_motion, tracking_method, override_extrinsics):
+# Process functions for each tab
+def process_motion_transfer(source, prompt, mt_repaint_option, mt_repaint_image, progress=gr.Progress()):
+    """Process video motion transfer task"""
+    input_video_path = save_uploaded_file(source)
+    if input_video_path is None:
+        return None
+    
+    # Priority: Custom Image > Yes > No
+    repaint = None
+    if mt_repaint_image is not None:
+        repaint = save_uploaded_file(mt_repaint_image)
+    elif mt_repaint_option == "Yes":
+        repaint = "true"
+    
+    return run_job(MotionTransferJob(input_video_path, prompt, repaint=repaint), progress)
+
+def process_camera_control(source, prompt, camera_motion, tracking_method, override_extrinsics, progress=gr.Progress()):
     """Process camera control task"""
-    try:
-        # Save uploaded files
-        input_media_path = save_uploaded_file(source)
-        if input_media_path is None:
-            return None
-        
-        print(f"DEBUG: Camera motion: '{camera_motion}'")
-        print(f"DEBUG: Tracking method: '{tracking_method}'")
-        print(f"DEBUG: Override extrinsics: '{override_extrinsics}'")
-        
-        args = {
-            "input_path": input_media_path,
-            "prompt": prompt,
-            "checkpoint_path": DEFAULT_MODEL_PATH,
-            "output_dir": OUTPUT_DIR,
-            "gpu": GPU_ID,
-            "tracking_method": tracking_method
-        }
-        
-        if camera_motion and camera_motion.strip():
-            args["camera_motion"] = camera_motion
-            
-        # 设置 override_extrinsics 参数
-        if override_extrinsics == "Apply on top of extrinsics (preserve original camera)":
-            args["override_extrinsics"] = "append"
-        else:
-            args["override_extrinsics"] = "override"
-        
-        # Create and run command
-        cmd = create_run_command(args)
-        output = run_process(cmd)
-        
-        # Find generated video files
-        output_files = glob.glob(os.path.join(OUTPUT_DIR, "*.mp4"))
-        if output_files:
-            # Sort by modification time, return the latest file
-            latest_file = max(output_files, key=os.path.getmtime)
-            return latest_file
-        else:
-            return None
-    except Exception as e:
-        import traceback
-        print(f"Processing failed: {str(e)}\n{traceback.format_exc()}")
+    input_media_path = save_uploaded_file(source)
+    if input_media_path is None:
         return None
+    
+    job = CameraControlJob(
+        input_media_path,
+        prompt,
+        camera_motion=camera_motion if camera_motion and camera_motion.strip() else None,
+        tracking_method=tracking_method,
+        override_extrinsics="append" if override_extrinsics == "Apply on top of extrinsics (preserve original camera)" else "override",
+    )
+    return run_job(job, progress)
 
-def process_object_manipulation(source, prompt, object_motion, object_mask, tracking_method):
+def process_object_manipulation(source, prompt, object_motion, object_mask, tracking_method, progress=gr.Progress()):
     """Process object manipulation task"""
-    try:
-        # Save uploaded files
-        input_image_path = save_uploaded_file(source)
-        if input_image_path is None:
-            return None
-            
-        object_mask_path = save_uploaded_file(object_mask)
-        
-        args = {
-            "input_path": input_image_path,
-            "prompt": prompt,
-            "checkpoint_path": DEFAULT_MODEL_PATH,
-            "output_dir": OUTPUT_DIR,
-            "gpu": GPU_ID,
-            "object_motion": object_motion,
-            "object_mask": object_mask_path,
-            "tracking_method": tracking_method
-        }
-        
-        # Create and run command
-        cmd = create_run_command(args)
-        output = run_process(cmd)
-        
-        # Find generated video files
-        output_files = glob.glob(os.path.join(OUTPUT_DIR, "*.mp4"))
-        if output_files:
-            # Sort by modification time, return the latest file
-            latest_file = max(output_files, key=os.path.getmtime)
-            return latest_file
-        else:
-            return None
-    except Exception as e:
-        import traceback
-        print(f"Processing failed: {str(e)}\n{traceback.format_exc()}")
+    input_image_path = save_uploaded_file(source)
+    if input_image_path is None:
         return None
+    
+    job = ObjectManipulationJob(
+        input_image_path,
+        prompt,
+        object_motion=object_motion,
+        object_mask=save_uploaded_file(object_mask),
+        tracking_method=tracking_method,
+    )
+    return run_job(job, progress)
 
-def process_mesh_animation(source, prompt, tracking_video, ma_repaint_option, ma_repaint_image):
+def process_mesh_animation(source, prompt, tracking_video, ma_repaint_option, ma_repaint_image, progress=gr.Progress()):
     """Process mesh animation task"""
-    try:
-        # Save uploaded files
-        input_video_path = save_uploaded_file(source)
-        if input_video_path is None:
-            return None
-            
-        tracking_video_path = save_uploaded_file(tracking_video)
-        if tracking_video_path is None:
-            return None
-        
-        args = {
-            "input_path": input_video_path,
-            "prompt": prompt,
-            "checkpoint_path": DEFAULT_MODEL_PATH,
-            "output_dir": OUTPUT_DIR,
-            "gpu": GPU_ID,
-            "tracking_path": tracking_video_path
-        }
-        
-        # Priority: Custom Image > Yes > No
-        if ma_repaint_image is not None:
-            # Custom image takes precedence if provided
-            repaint_path = save_uploaded_file(ma_repaint_image)
-            args["repaint"] = repaint_path
-        elif ma_repaint_option == "Yes":
-            # Otherwise use Yes/No selection
-            args["repaint"] = "true"
-        
-        # Create and run command
-        cmd = create_run_command(args)
-        output = run_process(cmd)
-        
-        # Find generated video files
-        output_files = glob.glob(os.path.join(OUTPUT_DIR, "*.mp4"))
-        if output_files:
-            # Sort by modification time, return the latest file
-            latest_file = max(output_files, key=os.path.getmtime)
-            return latest_file
-        else:
-            return None
-    except Exception as e:
-        import traceback
-        print(f"Processing failed: {str(e)}\n{traceback.format_exc()}")
+    input_video_path = save_uploaded_file(source)
+    if input_video_path is None:
+        return None
+    tracking_video_path = save_uploaded_file(tracking_video)
+    if tracking_video_path is None:
         return None
+    
+    # Priority: Custom Image > Yes > No
+    repaint = None
+    if ma_repaint_image is not None:
+        repaint = save_uploaded_file(ma_repaint_image)
+    elif ma_repaint_option == "Yes":
+        repaint = "true"
+    
+    return run_job(MeshAnimationJob(input_video_path, prompt, tracking_path=tracking_video_path, repaint=repaint), progress)
 
 # Create Gradio interface with updated layout
 with gr.Blocks(title="Diffusion as Shader") as demo:
@@ -584,5 +494,8 @@ if __name__ == "__main__":
     if args.share:
         print("Creating public link for remote access")
     
+    # Models live in the worker process, loaded once for all requests
+    start_worker()
+    
     # Launch interface
     demo.launch(share=args.share, server_port=args.port) 
\ No newline at end of file